@@ -7,7 +7,43 @@ from uuid import uuid4
 
 # from random import random
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+
+
+class Block(object):
+    """
+    A block in the chain. Never modified once it has been appended
+    """
+
+    __slots__ = (
+        "index",
+        "timestamp",
+        "transactions",
+        "proof",
+        "previous_hash",
+        "hash",
+    )
+
+    def __init__(self, index, timestamp, transactions, proof, previous_hash, hash):
+        self.index = index
+        self.timestamp = timestamp
+        self.transactions = transactions
+        self.proof = proof
+        self.previous_hash = previous_hash
+        self.hash = hash
+
+    def to_json(self):
+        """
+        :return: <dict> JSON-ready form, also used for canonical hashing
+        """
+        return {
+            "index": self.index,
+            "timestamp": self.timestamp,
+            "transactions": list(self.transactions),
+            "proof": self.proof,
+            "previous_hash": self.previous_hash,
+            "hash": self.hash,
+        }
 
 
 class Blockchain(object):
@@ -30,11 +66,11 @@ class Blockchain(object):
 ​
         :param proof: <int> The proof given by the Proof of Work algorithm
         :param previous_hash: (Optional) <str> Hash of previous Block
-        :return: <dict> New Block
+        :return: <Block> New Block
         """
 
         if len(self.chain) > 0:
-            block_string = json.dumps(self.last_block, sort_keys=True)
+            block_string = json.dumps(self.last_block.to_json(), sort_keys=True)
 
             guess = f"{block_string}{proof}".encode()
 
@@ -42,14 +78,14 @@ class Blockchain(object):
         else:
             current_hash = ""
 
-        block = {
-            "index": len(self.chain) + 1,
-            "timestamp": time(),
-            "transactions": self.current_transactions,
-            "proof": proof,
-            "previous_hash": previous_hash or self.hash(self.chain[-1]),
-            "hash": current_hash,
-        }
+        block = Block(
+            index=len(self.chain) + 1,
+            timestamp=time(),
+            transactions=self.current_transactions,
+            proof=proof,
+            previous_hash=previous_hash or self.hash(self.chain[-1]),
+            hash=current_hash,
+        )
 
         # Reset current block tx's
         self.current_transactions = []
@@ -64,7 +100,7 @@ class Blockchain(object):
         """
         Creates a SHA-256 hash of a Block
 ​
-        :param block": <dict> Block
+        :param block": <Block> Block
         "return": <str>
         """
 
@@ -72,7 +108,7 @@ class Blockchain(object):
         # 2. Must maintain order of hashes
 
         # Create block string
-        string_object = json.dumps(block, sort_keys=True)
+        string_object = json.dumps(block.to_json(), sort_keys=True)
         block_string = string_object.encode()
 
         # Hash block string using sha256
@@ -95,11 +131,15 @@ class Blockchain(object):
         :return: A valid proof for the provided block
         """
 
-        block_string = json.dumps(self.last_block, sort_keys=True)
-        proof = None
+        block_string = json.dumps(self.last_block.to_json(), sort_keys=True)
+        # Hash the block string once, every guess reuses that state
+        midstate = hashlib.sha256(block_string.encode())
+
+        # Count up from a random start so no proof is tried twice
+        proof = random.getrandbits(62)
 
-        while not self.valid_proof(block_string, proof):
-            proof = random.random()
+        while not self.valid_midstate_proof(midstate, proof):
+            proof += 1
         return proof
 
     @staticmethod
@@ -115,10 +155,25 @@ class Blockchain(object):
         :return: True if the resulting hash is a valid proof, False otherwise
         """
 
-        guess = f"{block_string}{proof}".encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
+        midstate = hashlib.sha256(block_string.encode())
 
-        return guess_hash[:4] == "0000"
+        return Blockchain.valid_midstate_proof(midstate, proof)
+
+    @staticmethod
+    def valid_midstate_proof(midstate, proof):
+        """
+        Same check as `valid_proof`, but starts from a sha256 object that
+        has already been fed the block string, so only the proof is hashed
+        :param midstate: <hashlib.sha256> Hash state after the block string
+        :param proof: <int?> The proof to check
+        :return: True if the resulting hash is a valid proof, False otherwise
+        """
+
+        guess = midstate.copy()
+        guess.update(f"{proof}".encode())
+
+        # 4 leading hex zeroes == the first 2 raw bytes are zero
+        return guess.digest()[:2] == b"\x00\x00"
 
 
 # Instantiate our Node
@@ -143,24 +198,106 @@ def mine():
     response = {
         # TODO: Send a JSON response with the new block
         "message": "New block forged!",
-        "index": block["index"],
-        "transactions": block["transactions"],
-        "proof": block["proof"],
+        "index": block.index,
+        "transactions": block.transactions,
+        "proof": block.proof,
         "previous_hash": previous_hash,
-        "hash": block["hash"],
+        "hash": block.hash,
     }
 
     return jsonify(response), 200
 
 
+# Blocks per chunk when streaming the chain
+CHAIN_CHUNK_SIZE = 100
+
+
 @app.route("/chain", methods=["GET"])
 def full_chain():
-    response = {
-        # TODO: Return the chain and its current length
-        "length": len(blockchain.chain),
-        "chain": blockchain.chain,
-    }
-    return jsonify(response), 200
+    """
+    Returns the chain, or a range of it.
+
+    Query parameters (all optional, block indexes are 1-based):
+    * from / to - first and last block to return
+    * cursor - same as `from`, for following `next_cursor`
+    * limit - maximum number of blocks to return
+    * format=ndjson - one block per line instead of a JSON document
+      (also chosen by `Accept: application/x-ndjson`)
+
+    The body is streamed a chunk at a time, and an ETag keyed on the tip
+    hash lets clients skip unchanged ranges.
+    """
+    length = len(blockchain.chain)
+
+    start = request.args.get("cursor", request.args.get("from", 1, type=int), type=int)
+    end = request.args.get("to", length, type=int)
+    limit = request.args.get("limit", type=int)
+
+    if start < 1 or end > length or (limit is not None and limit < 1):
+        return jsonify({"error": f"Blocks run from 1 to {length}"}), 400
+
+    if limit is not None:
+        end = min(end, start + limit - 1)
+
+    next_cursor = end + 1 if end < length else None
+
+    ndjson = request.args.get("format") == "ndjson" or (
+        request.accept_mimetypes.best == "application/x-ndjson"
+    )
+
+    # Blocks never change, so the tip and the range pin down the response
+    etag = f"{blockchain.hash(blockchain.last_block)}-{start}-{end}-{int(ndjson)}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    if ndjson:
+        response = Response(
+            _chain_chunks(start, end, "", "\n", "\n", ""),
+            mimetype="application/x-ndjson",
+        )
+        response.headers["X-Chain-Length"] = str(length)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = str(next_cursor)
+    else:
+        head = (
+            f'{{"length": {length}, "from": {start}, "to": {end}, '
+            f'"next_cursor": {"null" if next_cursor is None else next_cursor}, '
+            f'"chain": ['
+        )
+        response = Response(
+            _chain_chunks(start, end, head, ",", "", "]}"),
+            mimetype="application/json",
+        )
+
+    response.set_etag(etag)
+    return response
+
+
+def _chain_chunks(start, end, head, separator, tail_separator, tail):
+    """
+    Yields the blocks from `start` to `end` (inclusive, 1-based) as JSON,
+    a chunk at a time, so the whole chain is never one string in memory
+    """
+    yield head
+
+    for chunk_start in range(start - 1, end, CHAIN_CHUNK_SIZE):
+        chunk_end = min(chunk_start + CHAIN_CHUNK_SIZE, end)
+        chunk = separator.join(
+            json.dumps(block.to_json())
+            for block in blockchain.chain[chunk_start:chunk_end]
+        )
+
+        if chunk_start > start - 1:
+            chunk = separator + chunk
+
+        yield chunk
+
+    if end >= start:
+        yield tail_separator
+
+    yield tail
 
 
 # Run the program on port 5000
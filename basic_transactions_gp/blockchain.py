@@ -5,6 +5,65 @@ import json
 from time import time
 
 
+class Transaction(object):
+    """
+    A single transfer of coins from `sender` to `recipient`
+    """
+
+    __slots__ = ("sender", "recipient", "amount")
+
+    def __init__(self, sender, recipient, amount):
+        self.sender = sender
+        self.recipient = recipient
+        self.amount = amount
+
+    def to_json(self):
+        """
+        :return: <dict> JSON-ready form, also used for canonical hashing
+        """
+        return {
+            "sender": self.sender,
+            "recipient": self.recipient,
+            "amount": self.amount,
+        }
+
+
+class Block(object):
+    """
+    A block in the chain. Never modified once it has been appended
+    """
+
+    __slots__ = (
+        "index",
+        "hash",
+        "proof",
+        "timestamp",
+        "transactions",
+        "previous_hash",
+    )
+
+    def __init__(self, index, hash, proof, timestamp, transactions, previous_hash):
+        self.index = index
+        self.hash = hash
+        self.proof = proof
+        self.timestamp = timestamp
+        self.transactions = transactions
+        self.previous_hash = previous_hash
+
+    def to_json(self):
+        """
+        :return: <dict> JSON-ready form, also used for canonical hashing
+        """
+        return {
+            "index": self.index,
+            "hash": self.hash,
+            "proof": self.proof,
+            "timestamp": self.timestamp,
+            "transactions": [tx.to_json() for tx in self.transactions],
+            "previous_hash": self.previous_hash,
+        }
+
+
 class Blockchain(object):
     def __init__(self):
         self.chain = []
@@ -28,12 +87,12 @@ class Blockchain(object):
 ​
         :param proof: <int> The proof given by the Proof of Work algorithm
         :param previous_hash: (Optional) <str> Hash of previous Block
-        :return: <dict> New Block
+        :return: <Block> New Block
         """
 
         # Normal behaviour for a new block
         if len(self.chain) > 0:
-            block_string = json.dumps(self.last_block, sort_keys=True)
+            block_string = json.dumps(self.last_block.to_json(), sort_keys=True)
 
             guess = f"{block_string}{proof}".encode()
 
@@ -43,14 +102,14 @@ class Blockchain(object):
             current_hash = ""
 
         # New block
-        block = {
-            "index": len(self.chain) + 1,
-            "hash": current_hash,
-            "proof": proof,
-            "timestamp": time(),
-            "transactions": self.current_transactions,
-            "previous_hash": previous_hash or self.hash(self.chain[-1]),
-        }
+        block = Block(
+            index=len(self.chain) + 1,
+            hash=current_hash,
+            proof=proof,
+            timestamp=time(),
+            transactions=self.current_transactions,
+            previous_hash=previous_hash or self.hash(self.chain[-1]),
+        )
 
         # Reset current block tx's
         self.current_transactions = []
@@ -65,7 +124,7 @@ class Blockchain(object):
         """
         Creates a SHA-256 hash of a Block
 ​
-        :param block": <dict> Block
+        :param block": <Block> Block
         "return": <str>
         """
 
@@ -73,7 +132,7 @@ class Blockchain(object):
         # 2. Must maintain order of hashes
 
         # Create block string
-        string_object = json.dumps(block, sort_keys=True)
+        string_object = json.dumps(block.to_json(), sort_keys=True)
         block_string = string_object.encode()
 
         # Hash block string using sha256
@@ -96,7 +155,7 @@ class Blockchain(object):
         :return: A valid proof for the provided block
         """
 
-        block_string = json.dumps(self.last_block, sort_keys=True)
+        block_string = json.dumps(self.last_block.to_json(), sort_keys=True)
         proof = None
 
         while not self.valid_proof(block_string, proof):
@@ -130,8 +189,6 @@ class Blockchain(object):
         :return: <int> The index of the Block that will hold this transaction
         """
 
-        self.current_transactions.append(
-            {"sender": sender, "recipient": recipient, "amount": amount}
-        )
+        self.current_transactions.append(Transaction(sender, recipient, amount))
 
-        return self.last_block["index"] + 1
+        return self.last_block.index + 1
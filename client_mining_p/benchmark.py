@@ -0,0 +1,354 @@
+"""
+Benchmarks for the hashing, mining and serving paths.
+
+    python benchmark.py [--output benchmark.json] [--quick]
+
+Every result is written to one JSON file, so runs from before and after
+a change can be diffed to catch regressions.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+from multiprocessing import cpu_count
+from statistics import mean
+from time import perf_counter, time
+
+from block import Block, Transaction, header_bytes
+from blockchain import Blockchain
+from difficulty import Retarget
+from hashing import ProofHasher, target, valid_proof
+from storage import BlockStore
+
+# Defaults for a full run, --quick shrinks all of them
+PROOF_ITERATIONS = 200000
+HASH_ITERATIONS = 2000
+BLOCK_SIZES = [0, 1, 10, 100, 1000]
+MINE_SAMPLES = 20
+MINE_DIFFICULTY = 18
+MINE_ROUNDS = 5
+CHAIN_SIZES = [10000, 100000, 1000000]
+
+
+def best_rate(fn, iterations, repeat=3):
+    """
+    Runs `fn(iterations)` `repeat` times
+    :return: <float> Best operations per second
+    """
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        fn(iterations)
+        elapsed = perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return iterations / best
+
+
+def latency_summary(samples):
+    """
+    :param samples: <list> Latencies in seconds
+    :return: <dict> Mean and percentiles, in milliseconds
+    """
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+    return {
+        "samples": len(ordered),
+        "mean_ms": mean(ordered) * 1000,
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def bench_valid_proof(iterations):
+    """
+    Guesses per second for each way of checking a proof
+    """
+    last_block = Blockchain(difficulty=0).last_block
+    header_string = json.dumps(last_block.header(), sort_keys=True)
+    header = last_block.header_bytes()
+    zero_bits = 16
+    hasher = ProofHasher(header)
+    threshold = target(zero_bits)
+
+    def naive(n):
+        # The original scheme: hash the whole JSON string every guess, in hex
+        for proof in range(n):
+            guess = f"{header_string}{proof}".encode()
+            hashlib.sha256(guess).hexdigest()[:4] == "0000"
+
+    def one_off(n):
+        for proof in range(n):
+            valid_proof(header, proof, zero_bits)
+
+    def midstate(n):
+        for proof in range(n):
+            hasher.valid(proof, zero_bits)
+
+    def midstate_target(n):
+        for proof in range(n):
+            int.from_bytes(hasher.digest(proof), "big") < threshold
+
+    return {
+        name: best_rate(fn, iterations)
+        for name, fn in [
+            ("naive_hexdigest", naive),
+            ("hashing.valid_proof", one_off),
+            ("ProofHasher.valid", midstate),
+            ("ProofHasher.digest_vs_target", midstate_target),
+        ]
+    }
+
+
+def bench_miner(difficulty, rounds, workers=None):
+    """
+    Hash rate of the multi-process miner, estimated from how long it takes
+    to find `rounds` proofs: each one takes 2 ** difficulty guesses on
+    average
+    """
+    from miner import proof_of_work
+
+    header = Blockchain(difficulty=0).last_block.header()
+    workers = workers or cpu_count()
+
+    start = perf_counter()
+    for i in range(rounds):
+        header["timestamp"] = i
+        proof_of_work(header_bytes(header), difficulty, workers)
+    elapsed = perf_counter() - start
+
+    return {
+        "workers": workers,
+        "difficulty": difficulty,
+        "rounds": rounds,
+        "seconds": elapsed,
+        "estimated_hashes_per_sec": rounds * 2**difficulty / elapsed,
+    }
+
+
+def bench_block_hash(sizes, iterations):
+    """
+    Throughput of hashing, Merkle roots and serialization against the
+    number of transactions in a block
+    """
+    chain = Blockchain(difficulty=0)
+    results = []
+
+    for size in sizes:
+        transactions = [
+            Transaction(f"sender-{i}", f"recipient-{i}", i, i % 3) for i in range(size)
+        ]
+        block = Block(2, "", 0, time(), transactions, chain.block_hashes[-1])
+
+        def block_hash(n):
+            for _ in range(n):
+                chain.hash(block)
+
+        def merkle_root(n):
+            for _ in range(n):
+                block.compute_merkle_root()
+
+        def to_string(n):
+            for _ in range(n):
+                block.to_string()
+
+        def to_bytes(n):
+            for _ in range(n):
+                block.to_bytes()
+
+        # Big blocks are slow to serialize, keep the total work similar
+        n = max(10, iterations // max(size, 1))
+
+        results.append(
+            {
+                "transactions": size,
+                "bytes": len(block.to_string()),
+                "binary_bytes": len(block.to_bytes()),
+                "Blockchain.hash_per_sec": best_rate(block_hash, iterations),
+                "merkle_root_per_sec": best_rate(merkle_root, n),
+                "to_string_per_sec": best_rate(to_string, n),
+                "to_bytes_per_sec": best_rate(to_bytes, n),
+            }
+        )
+
+    return results
+
+
+def load_node(data_dir):
+    """
+    Imports the node against a scratch data directory
+    """
+    os.environ["BLOCKCHAIN_DATA_DIR"] = data_dir
+
+    import blockchain_node
+
+    return blockchain_node
+
+
+def bench_mine(node, samples):
+    """
+    Latency of /mine for proofs rejected by the cheap pre-check, and for
+    valid proofs that forge a block
+    """
+    client = node.app.test_client()
+
+    # Keep the difficulty where it starts, blocks come much faster here
+    node.blockchain.retarget.max_difficulty = node.blockchain.difficulty
+
+    rejected = []
+    forged = []
+    for _ in range(samples):
+        start = perf_counter()
+        client.post("/mine", json={"id": "bench", "proof": 1})
+        rejected.append(perf_counter() - start)
+
+        proof = node.blockchain.proof_of_work()
+        start = perf_counter()
+        response = client.post("/mine", json={"id": "bench", "proof": proof})
+        forged.append(perf_counter() - start)
+
+        if not response.get_json()["success"]:
+            raise RuntimeError("Benchmark proof was rejected")
+
+    return {
+        "difficulty": node.blockchain.difficulty,
+        "rejected": latency_summary(rejected),
+        "forged": latency_summary(forged),
+    }
+
+
+def bench_chain(node, sizes, data_dir):
+    """
+    Time to serve /chain from an on-disk chain of each size. The chain is
+    grown from one size to the next, at difficulty 0 so building it is
+    all serialization and storage
+    """
+    client = node.app.test_client()
+
+    store = BlockStore(os.path.join(data_dir, "chain"), sync_every=4096)
+    retarget = Retarget(min_difficulty=0, max_difficulty=0)
+    chain = Blockchain(difficulty=0, store=store, retarget=retarget)
+
+    # Serve this chain instead of the node's own
+    node.blockchain = chain
+
+    results = []
+    for size in sizes:
+        start = perf_counter()
+        while len(chain.chain) < size:
+            chain.new_block(chain.proof_of_work(), None)
+        build = perf_counter() - start
+
+        node.publish_tip()
+
+        def get(query, headers=None):
+            start = perf_counter()
+            response = client.get("/chain" + query, headers=headers)
+            body = response.get_data()
+            return perf_counter() - start, len(body), response
+
+        seconds, size_bytes, response = get("")
+        ndjson_seconds, ndjson_bytes, _ = get("?format=ndjson")
+        binary_seconds, binary_bytes, _ = get("?format=binary")
+        page_seconds, _, _ = get(f"?from={size - 99}&limit=100")
+        etag = response.headers["ETag"]
+        not_modified_seconds, _, _ = get("", {"If-None-Match": etag})
+
+        results.append(
+            {
+                "blocks": size,
+                "build_seconds": build,
+                "json_seconds": seconds,
+                "json_bytes": size_bytes,
+                "json_mb_per_sec": size_bytes / seconds / 1e6,
+                "ndjson_seconds": ndjson_seconds,
+                "ndjson_bytes": ndjson_bytes,
+                "binary_seconds": binary_seconds,
+                "binary_bytes": binary_bytes,
+                "last_page_seconds": page_seconds,
+                "not_modified_seconds": not_modified_seconds,
+            }
+        )
+        print(f"  /chain at {size} blocks: {seconds:.3f}s, {size_bytes} bytes")
+
+    store.close()
+
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {
+        "timestamp": time(),
+        "commit": commit or None,
+        "python": sys.version,
+        "platform": platform.platform(),
+        "cpu_count": cpu_count(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the blockchain")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument(
+        "--quick", action="store_true", help="Small sizes, for a smoke test"
+    )
+    parser.add_argument(
+        "--chain-sizes", type=int, nargs="+", help="Chain lengths for /chain"
+    )
+    args = parser.parse_args()
+
+    if args.quick:
+        PROOF_ITERATIONS //= 20
+        HASH_ITERATIONS //= 20
+        BLOCK_SIZES = BLOCK_SIZES[:4]
+        MINE_SAMPLES = 5
+        MINE_DIFFICULTY = 12
+        MINE_ROUNDS = 2
+        CHAIN_SIZES = [1000, 10000]
+
+    chain_sizes = args.chain_sizes or CHAIN_SIZES
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        results = {"environment": environment()}
+
+        print("valid_proof variants")
+        results["valid_proof"] = bench_valid_proof(PROOF_ITERATIONS)
+
+        print("Multi-process miner")
+        results["miner"] = bench_miner(MINE_DIFFICULTY, MINE_ROUNDS)
+
+        print("Block hashing against block size")
+        results["block_hash"] = bench_block_hash(BLOCK_SIZES, HASH_ITERATIONS)
+
+        node = load_node(data_dir)
+
+        print("/mine latency")
+        results["mine"] = bench_mine(node, MINE_SAMPLES)
+
+        print("/chain serialization")
+        results["chain"] = bench_chain(node, chain_sizes, data_dir)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"Results written to {args.output}")
@@ -0,0 +1,402 @@
+import hashlib
+import json
+
+from merkle import merkle_root
+from wire import Reader, encode, frame
+
+# Everything in a block except its transactions, which the header commits
+# to through the Merkle root. Block hashes and proofs cover only these,
+# encoded in this order
+HEADER_FIELDS = (
+    "index",
+    "hash",
+    "proof",
+    "timestamp",
+    "previous_hash",
+    "merkle_root",
+    "difficulty",
+    "state_root",
+)
+
+NUMBER = (int, float)
+NONE = type(None)
+
+# What each field may hold. Anything else can't be encoded, or hashed
+TRANSACTION_TYPES = {
+    "sender": str,
+    "recipient": str,
+    "amount": NUMBER,
+    "fee": NUMBER,
+    "nonce": int,
+    "signature": (str, NONE),
+}
+HEADER_TYPES = {
+    "index": int,
+    "hash": str,
+    "proof": int,
+    "timestamp": NUMBER,
+    # The genesis block's is 1
+    "previous_hash": (str, int),
+    "merkle_root": str,
+    "difficulty": int,
+    "state_root": (str, NONE),
+}
+
+
+def check_types(data, types):
+    """
+    :param data: <dict> Decoded fields
+    :param types: <dict> Field -> allowed types, see `HEADER_TYPES`
+    :raises ValueError: if a field holds anything else. Bools never pass
+    for numbers
+    """
+    for field, allowed in types.items():
+        value = data[field]
+        if isinstance(value, bool) or not isinstance(value, allowed):
+            raise ValueError(f"Bad {field}")
+
+
+class Transaction(object):
+    """
+    A single transfer of coins from `sender` to `recipient`, paying `fee`
+    to whoever mines it into a block. Signed by the sender's key, except
+    for mining rewards. `nonce` counts the sender's transactions, the
+    first one it sends is 0 (see `Ledger.admissible`)
+    """
+
+    __slots__ = ("sender", "recipient", "amount", "fee", "nonce", "signature")
+
+    def __init__(self, sender, recipient, amount, fee=0, nonce=0, signature=None):
+        self.sender = sender
+        self.recipient = recipient
+        self.amount = amount
+        self.fee = fee
+        self.nonce = nonce
+        self.signature = signature
+
+    def to_json(self):
+        """
+        :return: <dict> JSON-ready form, also used for canonical hashing
+        """
+        data = self.signed_json()
+
+        if self.signature is not None:
+            data["signature"] = self.signature
+
+        return data
+
+    def signed_json(self):
+        """
+        :return: <dict> Everything the signature covers
+        """
+        data = {
+            "sender": self.sender,
+            "recipient": self.recipient,
+            "amount": self.amount,
+        }
+
+        # Left out when there is none, so fee-less transactions (and the
+        # blocks holding them) hash the same as before fees existed
+        if self.fee:
+            data["fee"] = self.fee
+        if self.nonce:
+            data["nonce"] = self.nonce
+
+        return data
+
+    def signing_bytes(self):
+        """
+        :return: <bytes> Binary form of what the sender signs
+        """
+        # A zero fee is the same fee however it was written
+        return encode(
+            (self.sender, self.recipient, self.amount, self.fee or 0, self.nonce)
+        )
+
+    def to_bytes(self):
+        """
+        :return: <bytes> Binary form, what the txid covers
+        """
+        return self.signing_bytes() + encode((self.signature,))
+
+    def to_string(self):
+        """
+        :return: <str> Canonical `json.dumps(sort_keys=True)` form
+        """
+        return json.dumps(self.to_json(), sort_keys=True)
+
+    def txid(self):
+        """
+        :return: <str> Hex SHA-256 of the binary form
+        """
+        return hashlib.sha256(self.to_bytes()).hexdigest()
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        :raises KeyError, ValueError: if `data` isn't a transaction
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Not a transaction")
+
+        data = dict(data)
+        data.setdefault("fee", 0)
+        data.setdefault("nonce", 0)
+        data.setdefault("signature", None)
+        check_types(data, TRANSACTION_TYPES)
+
+        return cls(
+            data["sender"],
+            data["recipient"],
+            data["amount"],
+            data["fee"],
+            data["nonce"],
+            data["signature"],
+        )
+
+    @classmethod
+    def read(cls, reader):
+        """
+        :param reader: <wire.Reader> Positioned at a binary transaction
+        :raises ValueError: if it isn't one
+        """
+        values = reader.values(len(TRANSACTION_TYPES))
+        check_types(dict(zip(TRANSACTION_TYPES, values)), TRANSACTION_TYPES)
+
+        return cls(*values)
+
+
+class Block(object):
+    """
+    A block in the chain. Never modified once it has been appended
+
+    The block is split into a fixed-size header and a body (the
+    transactions). The header carries the Merkle root of the body, so
+    hashing the header alone is enough to commit to the whole block.
+    It also records the difficulty the block was mined at, so peers can
+    check it against the retarget rules, and every so often the root of
+    the balances before it (see `Ledger.state_root`).
+
+    Blocks older than a balance snapshot may be pruned down to their
+    header, with `transactions` set to None.
+    """
+
+    __slots__ = (
+        "index",
+        "hash",
+        "proof",
+        "timestamp",
+        "transactions",
+        "previous_hash",
+        "merkle_root",
+        "difficulty",
+        "state_root",
+    )
+
+    def __init__(
+        self,
+        index,
+        hash,
+        proof,
+        timestamp,
+        transactions,
+        previous_hash,
+        merkle_root=None,
+        difficulty=0,
+        state_root=None,
+    ):
+        self.index = index
+        self.hash = hash
+        self.proof = proof
+        self.timestamp = timestamp
+        self.transactions = transactions
+        self.previous_hash = previous_hash
+        self.difficulty = difficulty
+        self.state_root = state_root
+
+        if merkle_root is None:
+            merkle_root = self.compute_merkle_root()
+        self.merkle_root = merkle_root
+
+    def compute_merkle_root(self):
+        """
+        :return: <str> Merkle root of the block's transaction ids
+        """
+        return merkle_root([tx.txid() for tx in self.transactions])
+
+    def header(self):
+        """
+        :return: <dict> The block's header fields
+        """
+        return {
+            "index": self.index,
+            "hash": self.hash,
+            "proof": self.proof,
+            "timestamp": self.timestamp,
+            "previous_hash": self.previous_hash,
+            "merkle_root": self.merkle_root,
+            "difficulty": self.difficulty,
+            "state_root": self.state_root,
+        }
+
+    def header_bytes(self):
+        """
+        :return: <bytes> Binary header, what block hashes and proofs cover
+        """
+        return encode(
+            (
+                self.index,
+                self.hash,
+                self.proof,
+                self.timestamp,
+                self.previous_hash,
+                self.merkle_root,
+                self.difficulty,
+                self.state_root,
+            )
+        )
+
+    @property
+    def pruned(self):
+        """
+        True if only the header is left
+        """
+        return self.transactions is None
+
+    def header_only(self):
+        """
+        :return: <Block> Copy of the block with its transactions pruned
+        """
+        return Block(
+            self.index,
+            self.hash,
+            self.proof,
+            self.timestamp,
+            None,
+            self.previous_hash,
+            self.merkle_root,
+            self.difficulty,
+            self.state_root,
+        )
+
+    def to_json(self):
+        """
+        :return: <dict> JSON-ready form of the whole block
+        """
+        return {
+            "index": self.index,
+            "hash": self.hash,
+            "proof": self.proof,
+            "timestamp": self.timestamp,
+            "transactions": (
+                None if self.pruned else [tx.to_json() for tx in self.transactions]
+            ),
+            "previous_hash": self.previous_hash,
+            "merkle_root": self.merkle_root,
+            "difficulty": self.difficulty,
+            "state_root": self.state_root,
+        }
+
+    def to_string(self):
+        """
+        :return: <str> Canonical `json.dumps(sort_keys=True)` form of the block
+        """
+        return json.dumps(self.to_json(), sort_keys=True)
+
+    def to_bytes(self):
+        """
+        :return: <bytes> Binary form of the block: its header, the number
+        of transactions (None if pruned), then each transaction
+        """
+        if self.pruned:
+            return self.header_bytes() + encode((None,))
+
+        parts = [self.header_bytes(), encode((len(self.transactions),))]
+        parts.extend(tx.to_bytes() for tx in self.transactions)
+
+        return b"".join(parts)
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        :raises KeyError, ValueError: if `data` isn't a block
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Not a block")
+
+        check_types(data, HEADER_TYPES)
+
+        transactions = data["transactions"]
+        if isinstance(transactions, list):
+            transactions = [Transaction.from_json(tx) for tx in transactions]
+        elif transactions is not None:
+            raise ValueError("Bad transactions")
+
+        return cls(
+            data["index"],
+            data["hash"],
+            data["proof"],
+            data["timestamp"],
+            transactions,
+            data["previous_hash"],
+            data["merkle_root"],
+            data["difficulty"],
+            data["state_root"],
+        )
+
+    @classmethod
+    def from_string(cls, block_string):
+        return cls.from_json(json.loads(block_string))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        :param data: <bytes> A block from `to_bytes`
+        :raises ValueError: if it isn't one
+        """
+        reader = Reader(data)
+        header = reader.values(len(HEADER_FIELDS))
+
+        count = reader.value()
+        if count is None:
+            transactions = None
+        elif isinstance(count, int) and not isinstance(count, bool):
+            transactions = [Transaction.read(reader) for _ in range(count)]
+        else:
+            raise ValueError("Not a transaction count")
+
+        if not reader.at_end():
+            raise ValueError("Trailing bytes after the block")
+
+        block = dict(zip(HEADER_FIELDS, header), transactions=transactions)
+        check_types(block, HEADER_TYPES)
+
+        return cls(**block)
+
+
+def header_bytes(data):
+    """
+    Binary header of a block that is still in its decoded JSON form
+    :param data: <dict> The block, as from `Block.to_json`, or just its header
+    :return: <bytes> Same as `Block.header_bytes`
+    """
+    return encode(data[field] for field in HEADER_FIELDS)
+
+
+def chain_bytes(blocks):
+    """
+    Yields blocks in their binary form, each one length-prefixed so a
+    stream of them can be split without decoding
+    :param blocks: Iterable of Blocks
+    """
+    for block in blocks:
+        yield frame(block.to_bytes())
+
+
+def read_chain(data):
+    """
+    :param data: <bytes> Output of `chain_bytes`, joined
+    :return: <list> The Blocks
+    :raises ValueError: if any block is malformed
+    """
+    return [Block.from_bytes(raw) for raw in Reader(data).frames()]
@@ -1,150 +1,1021 @@
+import os
 import random
 import hashlib
-import json
 
+from itertools import islice
 from time import time
+from urllib.parse import urlparse
+
+from block import Block, Transaction
+from difficulty import (
+    MEDIAN_TIME_BLOCKS,
+    RETARGET_WINDOW,
+    Retarget,
+    median_time,
+    valid_timestamp,
+)
+from hashing import ProofHasher, target, valid_proof
+from ledger import BLOCK_REWARD, MINT_ADDRESS, Ledger, split_reward
+from mempool import MAX_BLOCK_BYTES, MAX_BLOCK_TRANSACTIONS, Mempool
+from merkle import merkle_proof
+from metrics import HASH_BUCKETS, Histogram, timed
+from snapshot import (
+    KEEP_SNAPSHOTS,
+    SNAPSHOT_INTERVAL,
+    Snapshot,
+    is_snapshot_height,
+    load_snapshot,
+    save_snapshot,
+)
+from storage import StoredChain
+from tree import (
+    DUPLICATE,
+    EXTENDED,
+    INVALID,
+    ORPHAN,
+    REORGANIZED,
+    SIDE_BRANCH,
+    BlockTree,
+    block_work,
+)
+from validation import validate_chain, verify_block
+
+HASH_SECONDS = Histogram(
+    "blockchain_hash_seconds",
+    "Time spent in Blockchain.hash, cached hashes included",
+    HASH_BUCKETS,
+)
 
 
 class Blockchain(object):
-    def __init__(self, difficulty=3, reward=5):
-        # bLoCkChAiN
-        self.chain = []
+    def __init__(
+        self,
+        difficulty=12,
+        reward=BLOCK_REWARD,
+        store=None,
+        mempool=None,
+        max_block_transactions=MAX_BLOCK_TRANSACTIONS,
+        max_block_bytes=MAX_BLOCK_BYTES,
+        retarget=None,
+        verifier=None,
+        snapshot_interval=SNAPSHOT_INTERVAL,
+    ):
+        # Optional on-disk BlockStore, the chain lives in memory without one
+        self.store = store
 
-        # mining settings
+        # mining settings, difficulty is counted in leading zero bits.
+        # `difficulty` is where a new chain starts, and the floor for
+        # retargeting unless `retarget` says otherwise
+        self.initial_difficulty = difficulty
         self.difficulty = difficulty
-        self.difficulty_string = "0" * difficulty
         self.reward = reward
+        self.retarget = (
+            retarget if retarget is not None else Retarget(min_difficulty=difficulty)
+        )
+
+        # tx's waiting to be put into a block, and how many fit in one
+        self.mempool = mempool if mempool is not None else Mempool()
+        self.max_block_transactions = max_block_transactions
+        self.max_block_bytes = max_block_bytes
 
-        # tx's to be put into next block
-        self.current_transactions = []
+        # Optional SignatureVerifier for blocks from peers, its cache
+        # remembers transactions already checked on their way in
+        self.verifier = verifier
 
-        # Genesis block
-        self.new_block(proof=100, previous_hash=1)
+        # Blocks commit to the balances every this many blocks
+        self.snapshot_interval = snapshot_interval
 
-    def new_block(self, proof, previous_hash):
+        # bLoCkChAiN, plus its caches and lookup indexes
+        self._reset_chain()
+
+        # Peer nodes, as base URLs. Replaced rather than changed in place,
+        # so it can be read from any thread
+        self.nodes = frozenset()
+
+        # Genesis block, unless the store already holds a chain
+        if len(self.chain) == 0:
+            self.new_block(proof=100, previous_hash=1)
+
+    def _reset_chain(self):
+        """
+        Sets up the chain, its caches and its lookup indexes. With a store
+        they are rebuilt straight from the store's index, no block is read
+        """
+        if self.store is None:
+            self.chain = []
+
+            # Canonical string and hash of every block, by position in the
+            # chain. Blocks never change once appended, so each is
+            # serialized only once
+            self.block_strings = []
+            self.block_hashes = []
+        else:
+            self.chain = StoredChain(self.store, decode=Block.from_string)
+            self.block_strings = self.store
+            self.block_hashes = self.store.hashes
+
+        # Competing branches off the chain
+        self.tree = BlockTree()
+
+        self._rebuild_indexes()
+
+    def _rebuild_indexes(self):
+        """
+        Rebuilds the lookup indexes and the ledger from the chain as it is.
+        A pruned chain starts from the snapshot saved with it, only the
+        blocks after it are read
+        """
+        if self.store is None:
+            proofs = [block.proof for block in self.chain]
+        else:
+            proofs = self.store.proofs
+
+        # Lookup indexes, kept up to date by `new_block`
+        self.used_proofs = set(proofs)
+        self.blocks_by_hash = {
+            block_hash: i for i, block_hash in enumerate(self.block_hashes)
+        }
+
+        # Recent balance snapshots, oldest first, and how many leading
+        # blocks are pruned down to their headers
+        self.snapshots = []
+        self.pruned_height = 0
+
+        saved = None
+        if len(self.block_strings) > 0:
+            if Block.from_string(self.block_strings[0]).pruned:
+                saved = load_snapshot(self._snapshot_path())
+                if saved is None:
+                    raise ValueError("Pruned chain without its balance snapshot")
+
+        self.ledger = Ledger()
+        self.chain_work = []
+        self.retarget.reset()
+        work = 0
+        start = 0
+
+        if saved is not None and saved.work is not None:
+            # The pruned blocks can't be rolled back, so nothing before
+            # the snapshot ever looks at their work
+            self.ledger = Ledger(saved.balances, saved.nonces)
+            self.snapshots.append(saved)
+            self.pruned_height = saved.height
+            self.chain_work = [None] * (saved.height - 1) + [saved.work]
+            work = saved.work
+            start = saved.height
+
+        # Only the last window + 1 blocks decide the next difficulty
+        first = min(start, max(len(self.block_strings) - self.retarget.window - 1, 0))
+
+        # Balances, history, cumulative work and the retarget window need
+        # whole blocks, so the rest of a stored chain is read through once
+        # here, without keeping the blocks around
+        for position in range(first, len(self.block_strings)):
+            block = Block.from_string(self.block_strings[position])
+            self.retarget.add_block(block.timestamp, block.difficulty)
+
+            if position < start:
+                continue
+
+            work += block_work(block.difficulty)
+            self.chain_work.append(work)
+
+            if block.pruned:
+                self.pruned_height = block.index
+
+            if saved is not None and block.index <= saved.height:
+                # Covered by the snapshot, saved before it knew its work
+                if block.index == saved.height:
+                    self.ledger = Ledger(saved.balances, saved.nonces)
+                    self.snapshots.append(saved._replace(work=work))
+            else:
+                self.ledger.apply_block(block)
+                if is_snapshot_height(block.index, self.snapshot_interval):
+                    self._take_snapshot(block.index, self.block_hashes[block.index - 1])
+
+        if len(self.block_strings) > 0:
+            self.difficulty = self.retarget.next_difficulty()
+        else:
+            self.difficulty = self.initial_difficulty
+
+    def new_block(self, proof, previous_hash, reward_to=None):
         """
         Create a new Block in the Blockchain
 ​
         A block should have:
         * Index
         * Timestamp
-        * List of current transactions
+        * The best transactions from the mempool that fit in a block
         * The proof used to mine this block
         * The hash of the previous block
 ​
         :param proof: <int> The proof given by the Proof of Work algorithm
         :param previous_hash: (Optional) <str> Hash of previous Block
-        :return: <dict> New Block
+        :param reward_to: (Optional) <str> Address paid the mining reward
+        plus the fees of every transaction in the block, or <dict> address
+        -> weight to split it between, e.g. a pool's shares
+        :return: <Block> New Block
         """
 
+        timestamp = time()
+
         # Normal behaviour for a new block
         if len(self.chain) > 0:
-            block_string = json.dumps(self.last_block, sort_keys=True)
+            header = self.last_header_bytes
 
-            guess = f"{block_string}{proof}".encode()
+            current_hash = ProofHasher(header).digest(proof).hex()
 
-            current_hash = hashlib.sha256(guess).hexdigest()
+            # Peers reject blocks that aren't past the median time, even
+            # if our clock has gone back
+            median = median_time(self._previous_timestamps(self.block_hashes[-1]))
+            timestamp = max(timestamp, median + 0.001)
         else:
             # Genesis block only
             current_hash = ""
 
         # New block
-        block = {
-            "index": len(self.chain) + 1,
-            "hash": current_hash,
-            "proof": proof,
-            "timestamp": time(),
-            "transactions": self.current_transactions,
-            "previous_hash": previous_hash or self.hash(self.chain[-1]),
-        }
-
-        # Reset current block tx's
-        self.current_transactions = []
+        block = Block(
+            index=len(self.chain) + 1,
+            hash=current_hash,
+            proof=proof,
+            timestamp=timestamp,
+            transactions=self._assemble_transactions(reward_to),
+            previous_hash=previous_hash or self.hash(self.chain[-1]),
+            difficulty=self.difficulty,
+            state_root=self._next_state_root(),
+        )
 
         # Append new block to chain
-        self.chain.append(block)
+        self._append_block(block)
 
         # Return new block
         return block
 
+    def _assemble_transactions(self, reward_to):
+        """
+        Picks the transactions for a new block out of the mempool, with
+        the reward transactions (if any) first
+        """
+        # The genesis block is empty
+        if len(self.chain) == 0:
+            return []
+
+        if reward_to is None:
+            weights = {}
+        elif isinstance(reward_to, dict):
+            weights = reward_to
+        else:
+            weights = {reward_to: 1}
+
+        max_count = max(self.max_block_transactions - len(weights), 0)
+        chosen = self.mempool.select(max_count, self.max_block_bytes)
+
+        # A reorg may have confirmed or outspent some of them meanwhile
+        transactions = self.ledger.admissible(chosen)
+
+        # Ones whose sender has an earlier nonce still waiting go back,
+        # for a later block
+        if len(transactions) < len(chosen):
+            kept = {id(tx) for tx in transactions}
+            for tx in chosen:
+                if id(tx) not in kept:
+                    self._admit(tx)
+
+        if weights:
+            fees = sum(tx.fee for tx in transactions)
+            rewards = [
+                Transaction(MINT_ADDRESS, address, amount)
+                for address, amount in split_reward(self.reward + fees, weights)
+            ]
+            transactions[:0] = rewards
+
+        return transactions
+
+    def _append_block(self, block):
+        """
+        Appends a block to the chain (or the store), serializing and hashing
+        it exactly once, and records it in the lookup indexes
+        """
+        block_string = block.to_string()
+        block_hash = hashlib.sha256(block.header_bytes()).hexdigest()
+
+        if self.store is None:
+            self.chain.append(block)
+            self.block_strings.append(block_string)
+            self.block_hashes.append(block_hash)
+        else:
+            # The store's strings and hashes double as our caches
+            self.store.append(block_string, block_hash, block.proof)
+            self.chain.remember(len(self.chain) - 1, block)
+
+        self.used_proofs.add(block.proof)
+        self.blocks_by_hash[block_hash] = len(self.chain) - 1
+
+        previous_work = self.chain_work[-1] if self.chain_work else 0
+        self.chain_work.append(previous_work + block_work(block.difficulty))
+
+        # Pruned blocks only come in while bootstrapping from a snapshot,
+        # which sets the ledger itself
+        if not block.pruned:
+            self.ledger.apply_block(block)
+
+            if is_snapshot_height(block.index, self.snapshot_interval):
+                self._take_snapshot(block.index, block_hash)
+
+        # The only place the difficulty changes, once per block
+        self.retarget.add_block(block.timestamp, block.difficulty)
+        self.difficulty = self.retarget.next_difficulty()
+
+        # A side block that just became active is no longer a side block
+        if self.tree:
+            self.tree.discard(block_hash)
+            self.tree.prune(block.index)
+
+    def _take_snapshot(self, height, block_hash):
+        """
+        Remembers the balances as they are after block `height`, which
+        is the last block
+        """
+        self.snapshots.append(
+            Snapshot(
+                height,
+                block_hash,
+                self.ledger.state_root(),
+                self.ledger.snapshot(),
+                self.ledger.nonce_snapshot(),
+                self.chain_work[-1],
+            )
+        )
+        del self.snapshots[:-KEEP_SNAPSHOTS]
+
+    def _next_state_root(self):
+        """
+        :return: <str> The state root the next block has to commit to, None
+        unless the tip is at a snapshot height
+        """
+        height = len(self.chain)
+        if not is_snapshot_height(height, self.snapshot_interval):
+            return None
+
+        for taken in self.snapshots:
+            if taken.height == height:
+                return taken.state_root
+
+        return self.ledger.state_root()
+
+    def _fits(self, block):
+        """
+        Checks a block against the state it would be appended to: the
+        state root it commits to, and that none of its transactions was
+        confirmed before or spends more than its sender has
+        """
+        if block.state_root != self._next_state_root():
+            return False
+
+        transactions = block.transactions
+
+        return len(self.ledger.admissible(transactions)) == len(transactions)
+
+    @property
+    def snapshot(self):
+        """
+        The latest balance snapshot a block in the chain commits to, what
+        a new node can bootstrap from
+        :return: <Snapshot> or None if there is none yet
+        """
+        for taken in reversed(self.snapshots):
+            if taken.height < len(self.chain):
+                return taken
+
+        return None
+
+    def _snapshot_path(self):
+        return os.path.join(self.store.path, "snapshot.json")
+
+    def _rollback(self, length):
+        """
+        Takes every block from position `length` onwards off the chain,
+        newest first, undoing each one in the ledger and the lookup indexes.
+        The blocks are kept in the tree as a side branch, in case it wins
+        again later
+        :param length: <int> Number of blocks to keep
+        :return: <list> The Blocks taken off, oldest first
+        """
+        dropped = []
+        for i in range(len(self.chain) - 1, length - 1, -1):
+            block = self.chain[i]
+            block_hash = self.block_hashes[i]
+
+            self.ledger.revert_block(block)
+            self.used_proofs.discard(block.proof)
+            del self.blocks_by_hash[block_hash]
+            self.tree.add(block_hash, block, self.chain_work[i])
+
+            dropped.append(block)
+
+        if self.store is None:
+            del self.chain[length:]
+            del self.block_strings[length:]
+            del self.block_hashes[length:]
+        else:
+            self.store.truncate(length)
+            self.chain.forget(length)
+
+        del self.chain_work[length:]
+        self.snapshots = [s for s in self.snapshots if s.height <= length]
+
+        # Only the last window + 1 blocks decide the next difficulty
+        self.retarget.reset()
+        for i in range(max(length - self.retarget.window - 1, 0), length):
+            block = self.chain[i]
+            self.retarget.add_block(block.timestamp, block.difficulty)
+
+        if length > 0:
+            self.difficulty = self.retarget.next_difficulty()
+        else:
+            self.difficulty = self.initial_difficulty
+
+        dropped.reverse()
+
+        return dropped
+
+    def _switch_branch(self, fork, blocks):
+        """
+        Reorg: rolls the chain back to its first `fork` blocks and then
+        forward along `blocks`. Costs O(depth of the fork), not O(chain).
+        Transactions only the dropped blocks held go back to the mempool
+        :return: True if the chain switched, False if a block on the branch
+        doesn't fit the state before it, the chain is left as it was then
+        """
+        dropped = self._rollback(fork)
+
+        for i, block in enumerate(blocks):
+            if not self._fits(block):
+                # Only the state shows the branch is invalid, back out
+                self._rollback(fork)
+                for side in blocks[i:]:
+                    self.tree.discard(self.hash(side))
+                for old in dropped:
+                    self._append_block(old)
+
+                return False
+
+            self._append_block(block)
+
+        for block in dropped:
+            for tx in block.transactions:
+                if tx.sender != MINT_ADDRESS:
+                    self._admit(tx)
+
+        self.mempool.discard(tx.txid() for block in blocks for tx in block.transactions)
+
+        return True
+
+    def adopt_branch(self, fork, fork_hash, blocks):
+        """
+        Replaces every block after the first `fork` with `blocks`, a branch
+        with more work from a peer that has already been validated
+        :param fork: <int> Number of blocks both chains share
+        :param fork_hash: <str> Hash of the last shared block, None if
+        there is none
+        :param blocks: <list> The branch's Blocks, in order
+        :return: True if the branch was adopted, False if our chain has
+        changed since and the branch no longer fits or no longer has more
+        work
+        """
+        if fork > len(self.chain):
+            return False
+
+        # Pruned blocks can't be rolled back
+        if fork < self.pruned_height:
+            return False
+
+        if fork > 0 and self.block_hashes[fork - 1] != fork_hash:
+            return False
+
+        fork_work = self.chain_work[fork - 1] if fork > 0 else 0
+        branch_work = fork_work + sum(block_work(b.difficulty) for b in blocks)
+        if branch_work <= self.work:
+            return False
+
+        return self._switch_branch(fork, blocks)
+
+    def add_block(self, block, min_difficulty=0):
+        """
+        Adds a block mined somewhere else, e.g. announced by a peer. It may
+        extend the chain, start or grow a side branch, or give a side
+        branch more work than the chain, which then becomes the chain
+        :param block: <Block> The block
+        :param min_difficulty: <int> Leading zero bits its proof needs at least
+        :return: <str> EXTENDED, REORGANIZED, SIDE_BRANCH, DUPLICATE, ORPHAN
+        (its parent is unknown) or INVALID
+        """
+        block_hash = hashlib.sha256(block.header_bytes()).hexdigest()
+        if block_hash in self.blocks_by_hash or block_hash in self.tree:
+            return DUPLICATE
+
+        parent_hash = block.previous_hash
+        position = self.blocks_by_hash.get(parent_hash)
+        if position is not None:
+            # Forks deeper than the prune depth are left to consensus, and
+            # pruned blocks can't be rolled back at all
+            if position < len(self.chain) - self.tree.prune_depth:
+                return INVALID
+            if position + 1 < self.pruned_height:
+                return INVALID
+
+            parent_string = self.block_strings[position]
+            parent_work = self.chain_work[position]
+        else:
+            # Pruning may have cut the parent's branch off from the chain
+            parent = self.tree.get(parent_hash)
+            if parent is None or self.tree.branch(parent_hash)[0] not in (
+                self.blocks_by_hash
+            ):
+                return ORPHAN
+
+            parent_string = parent.block.to_string()
+            parent_work = parent.work
+
+        if (
+            verify_block(
+                parent_string,
+                block.to_string(),
+                min_difficulty,
+                self.verifier,
+                self.reward,
+            )
+            is None
+        ):
+            return INVALID
+
+        if block.difficulty != self._expected_difficulty(parent_hash):
+            return INVALID
+
+        previous = self._previous_timestamps(parent_hash)
+        if not valid_timestamp(block.timestamp, previous):
+            return INVALID
+
+        # Builds on our tip, the common case
+        if position == len(self.chain) - 1:
+            if not self._fits(block):
+                return INVALID
+
+            self._append_block(block)
+            self.mempool.discard(tx.txid() for tx in block.transactions)
+
+            return EXTENDED
+
+        work = parent_work + block_work(block.difficulty)
+        self.tree.add(block_hash, block, work)
+
+        # On a tie the branch we saw first stays
+        if work <= self.work:
+            return SIDE_BRANCH
+
+        fork_hash, branch = self.tree.branch(block_hash)
+        fork = self.blocks_by_hash[fork_hash] + 1
+        if fork < self.pruned_height:
+            return INVALID
+
+        if not self._switch_branch(fork, [side.block for _, side in branch]):
+            return INVALID
+
+        return REORGANIZED
+
+    def _expected_difficulty(self, parent_hash):
+        """
+        Difficulty the retarget rules give for a block on top of `parent_hash`,
+        which may be on a side branch
+        """
+        if parent_hash == self.block_hashes[-1]:
+            return self.difficulty
+
+        retarget = self.retarget.fresh()
+        window = list(islice(self._ancestors(parent_hash), retarget.window + 1))
+
+        for block in reversed(window):
+            retarget.add_block(block.timestamp, block.difficulty)
+
+        return retarget.next_difficulty()
+
+    def _previous_timestamps(self, parent_hash):
+        """
+        :return: <list> Timestamps of the `MEDIAN_TIME_BLOCKS` blocks up to
+        `parent_hash`, or fewer near the genesis block
+        """
+        ancestors = islice(self._ancestors(parent_hash), MEDIAN_TIME_BLOCKS)
+
+        return [block.timestamp for block in ancestors]
+
+    def _ancestors(self, block_hash):
+        """
+        Yields the block with `block_hash` and then its ancestors, newest
+        first, through side branches and down the chain
+        """
+        while block_hash in self.tree:
+            block = self.tree.get(block_hash).block
+            yield block
+            block_hash = block.previous_hash
+
+        position = self.blocks_by_hash.get(block_hash)
+        if position is None:
+            return
+
+        for i in range(position, -1, -1):
+            yield self.chain[i]
+
+    def replace_chain(self, chain):
+        """
+        Swaps in a whole new chain and rebuilds every cache and index
+        :param chain: <list> The new chain of Blocks, genesis block first
+        """
+        if self.store is not None:
+            self.store.truncate(0)
+
+        self._reset_chain()
+
+        for block in chain:
+            self._append_block(block)
+
+    def validate_chain(self, checkpoint=None, min_difficulty=0, workers=None):
+        """
+        Checks the links, stored hashes, proofs and difficulties of the
+        whole chain
+        :param checkpoint: (Optional) <str> Hash of a trusted block, only
+        the blocks after it are checked
+        :param min_difficulty: <int> Leading zero bits every proof needs
+        :param workers: <int> Number of worker processes for the hash checks
+        :return: True if the chain is valid, False otherwise
+        """
+        start = 0
+        if checkpoint is not None:
+            position = self.blocks_by_hash.get(checkpoint)
+            if position is None:
+                # Checkpoint isn't in our chain at all
+                return False
+
+            start = position + 1
+
+        return validate_chain(
+            self.block_strings,
+            self.block_hashes,
+            start,
+            min_difficulty,
+            workers,
+            self.retarget.fresh(),
+            self.pruned_height,
+            self.reward,
+        )
+
+    def prune(self):
+        """
+        Drops the transactions of every block up to the latest snapshot,
+        keeping only their headers. The snapshot's balances stand in for
+        them, and is saved with the store so the chain can be reloaded
+        :return: <int> Index of the last pruned block
+        """
+        latest = self.snapshot
+        if latest is None or latest.height <= self.pruned_height:
+            return self.pruned_height
+
+        height = latest.height
+
+        if self.store is None:
+            for i in range(self.pruned_height, height):
+                self.chain[i] = self.chain[i].header_only()
+                self.block_strings[i] = self.chain[i].to_string()
+        else:
+            # The snapshot goes first, a pruned store is useless without it
+            save_snapshot(self._snapshot_path(), latest)
+
+            # Only the blocks since the last prune are decoded and written
+            self.store.replace(
+                self.pruned_height,
+                (
+                    Block.from_string(self.store[i]).header_only().to_string()
+                    for i in range(self.pruned_height, height)
+                ),
+            )
+            self.chain.forget(self.pruned_height)
+
+        self.ledger.prune_history(height)
+        self.pruned_height = height
+
+        return height
+
+    def bootstrap(self, base, headers, blocks):
+        """
+        Replaces the chain with one that starts from a balance snapshot
+        instead of from the first transaction
+        :param base: <Snapshot> Balances as of the last header
+        :param headers: <list> Blocks 1 to `base.height`, pruned to headers
+        :param blocks: <list> Full Blocks after the snapshot, the first of
+        which commits to it
+        :return: True if the chain was replaced, False if the snapshot or a
+        later block's state root doesn't add up. Proofs and links have to
+        be validated beforehand
+        """
+        if not is_snapshot_height(base.height, self.snapshot_interval):
+            return False
+        if len(headers) != base.height or not blocks:
+            return False
+        if self.hash(headers[-1]) != base.hash:
+            return False
+
+        # Check every commitment against a scratch ledger first, so a bad
+        # snapshot leaves the chain alone
+        ledger = Ledger(base.balances, base.nonces)
+        for block in blocks:
+            height = block.index - 1
+            if is_snapshot_height(height, self.snapshot_interval):
+                expected = ledger.state_root()
+            else:
+                expected = None
+
+            if block.state_root != expected:
+                return False
+
+            transactions = block.transactions
+            if len(ledger.admissible(transactions)) != len(transactions):
+                return False
+
+            ledger.apply_block(block)
+
+        # Whatever work the peer claimed, ours comes from the headers
+        base = base._replace(work=sum(block_work(h.difficulty) for h in headers))
+
+        if self.store is not None:
+            save_snapshot(self._snapshot_path(), base)
+            self.store.truncate(0)
+
+        self._reset_chain()
+
+        for header in headers:
+            self._append_block(header.header_only())
+
+        self.ledger = Ledger(base.balances, base.nonces)
+        self.snapshots = [base]
+        self.pruned_height = base.height
+
+        for block in blocks:
+            self._append_block(block)
+
+        return True
+
+    @timed(HASH_SECONDS)
     def hash(self, block):
         """
-        Creates a SHA-256 hash of a Block
+        Creates a SHA-256 hash of a Block's header
 ​
-        :param block": <dict> Block
+        :param block": <Block> Block
         "return": <str>
         """
 
+        # Blocks in the chain were already hashed when they were appended
+        index = block.index - 1
+        if 0 <= index < len(self.chain) and self.chain[index] is block:
+            return self.block_hashes[index]
+
         # 1. hashlib requires byte string to hash
         # 2. Must maintain order of hashes
 
-        # Create block string
-        string_object = json.dumps(block, sort_keys=True)
-        block_string = string_object.encode()
+        # Binary header, the Merkle root in it covers the transactions
+        header = block.header_bytes()
 
-        # Hash block string using sha256
+        # Hash the header using sha256
         # hexdigest converts to hex string (easier to work with)
-        raw_hash = hashlib.sha256(block_string)
+        raw_hash = hashlib.sha256(header)
         hex_hash = raw_hash.hexdigest()
 
         return hex_hash
 
+    def register_node(self, address):
+        """
+        Add a new node to the list of nodes
+        :param address: <str> Address of node. Eg. 'http://192.168.0.5:5000'
+        or just '192.168.0.5:5000'
+        :return: <str> The node's base URL
+        """
+        if "://" not in address:
+            address = "http://" + address
+
+        parsed_url = urlparse(address)
+        if parsed_url.scheme not in ("http", "https") or not parsed_url.netloc:
+            raise ValueError(f"Invalid node address: {address}")
+
+        node = f"{parsed_url.scheme}://{parsed_url.netloc}"
+        self.nodes = self.nodes | {node}
+
+        return node
+
+    @property
+    def work(self):
+        """
+        Cumulative work of the chain, the sum of 2 ** difficulty over its
+        blocks. The chain with the most work wins
+        """
+        return self.chain_work[-1] if self.chain_work else 0
+
+    def hash_rate(self, blocks=RETARGET_WINDOW):
+        """
+        Estimates the network hash rate from how fast the latest blocks came
+        :param blocks: <int> Number of block intervals to average over
+        :return: <float> Hashes per second, 0 if the chain is too short to tell
+        """
+        blocks = min(blocks, len(self.chain) - 1)
+
+        # Work before a restored snapshot isn't known block by block
+        if blocks > 0 and self.chain_work[-1 - blocks] is None:
+            blocks = len(self.chain) - self.pruned_height
+
+        if blocks < 1:
+            return 0.0
+
+        elapsed = self.last_block.timestamp - self.chain[-1 - blocks].timestamp
+        if elapsed <= 0:
+            return 0.0
+
+        # Work of the blocks mined during those intervals
+        return (self.chain_work[-1] - self.chain_work[-1 - blocks]) / elapsed
+
     @property
     def last_block(self):
         return self.chain[-1]
 
+    @property
+    def last_header_bytes(self):
+        """
+        Binary header of the last block, what the next proof is mined on.
+        Headers are a handful of fixed-size fields, so this is cheap
+        """
+        return self.last_block.header_bytes()
+
+    def merkle_proof(self, index, position):
+        """
+        Inclusion proof for one transaction, for wallets to check against
+        the block header without downloading the block
+        :param index: <int> Block index
+        :param position: <int> Position of the transaction in the block
+        :return: (txid, proof) or None if there is no such transaction
+        """
+        block = self.get_block(index)
+        if block is None or block.pruned:
+            return None
+
+        if not 0 <= position < len(block.transactions):
+            return None
+
+        txids = [tx.txid() for tx in block.transactions]
+
+        return txids[position], merkle_proof(txids, position)
+
+    def get_block(self, index):
+        """
+        Looks up a block by its 1-based index
+        :param index: <int> Block index
+        :return: <Block> The block, or None if there is no such block
+        """
+        if 1 <= index <= len(self.chain):
+            return self.chain[index - 1]
+
+        return None
+
+    def get_block_by_hash(self, block_hash):
+        """
+        Looks up a block by the hash its successor stores as `previous_hash`
+        :param block_hash: <str> Block hash
+        :return: <Block> The block, or None if there is no such block
+        """
+        i = self.blocks_by_hash.get(block_hash)
+        if i is None:
+            return None
+
+        return self.chain[i]
+
+    def balance(self, address):
+        """
+        :param address: <str> Wallet address
+        :return: <int> Confirmed balance of `address`
+        """
+        return self.ledger.balance(address)
+
+    def transactions_for(self, address, page=1, per_page=10):
+        """
+        One page of the confirmed transactions involving `address`,
+        newest first
+        :param address: <str> Wallet address
+        :param page: <int> 1-based page number
+        :param per_page: <int> Transactions per page
+        :return: <list> (block index, position in block, Transaction)
+        """
+        return [
+            (index, position, self.get_block(index).transactions[position])
+            for index, position in self.ledger.page(address, page, per_page)
+        ]
+
+    def proof_used(self, proof):
+        """
+        Has `proof` already been used by a block in the chain?
+        :param proof: The proof to look up
+        :return: True if a block already holds this proof
+        """
+        try:
+            return proof in self.used_proofs
+        except TypeError:
+            # Unhashable junk from a request can't be in the set
+            return False
+
     def proof_of_work(self):
         """
         Simple Proof of Work Algorithm
-        Stringify the block and look for a proof.
+        Encode the last block's header and look for a proof.
         Loop through possibilities, checking each one against `valid_proof`
         in an effort to find a number that is a valid proof
         :return: A valid proof for the provided block
         """
 
-        block_string = json.dumps(self.last_block, sort_keys=True)
-        proof = None
+        # Hash the header once, every guess reuses that state
+        hasher = ProofHasher(self.last_header_bytes)
+
+        # Count up from a random start so no nonce is tried twice
+        proof = random.getrandbits(62)
 
-        while not self.valid_proof(block_string, proof):
-            proof = random.random()
+        while not hasher.valid(proof, self.difficulty):
+            proof += 1
         return proof
 
     # @staticmethod
-    def valid_proof(self, block_string, proof):
+    def valid_proof(self, header, proof):
         """
-        Validates the Proof:  Does hash(block_string, proof) contain 6
-        leading zeroes?  Return true if the proof is valid
-        :param block_string: <string> The stringified block to use to
-        check in combination with `proof`
+        Validates the Proof:  Does hash(header, proof) contain
+        `difficulty` leading zero bits?  Return true if the proof is valid
+        :param header: <bytes> The binary block header to use
+        to check in combination with `proof`
         :param proof: <int?> The value that when combined with the
         stringified previous block results in a hash that has the
         correct number of leading zeroes.
         :return: True if the resulting hash is a valid proof, False otherwise
         """
 
-        guess = f"{block_string}{proof}".encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
+        return valid_proof(header, proof, self.difficulty)
 
-        return guess_hash[: self.difficulty] == "0" * self.difficulty
-
-    def new_transaction(self, sender, recipient, amount):
+    def new_transaction(
+        self, sender, recipient, amount, fee=0, nonce=0, signature=None
+    ):
         """
         Creates a new transaction to go into the next mined Block
         :param sender: <str> Address of the Recipient
         :param recipient: <str> Address of the Recipient
         :param amount: <int> Amount
-        :return: <int> The index of the Block that will hold this transaction
+        :param fee: <int> Fee paid to the miner, higher fees get mined first
+        :param nonce: <int> The sender's nonce, see `next_nonce`
+        :param signature: <str> The sender's signature, checked beforehand
+        :return: <int> The index of the Block that will hold this transaction,
+        or None if it was turned away: its nonce already used or waiting, more
+        than the sender can spend, or too low a fee for a full mempool
         """
+        tx = Transaction(sender, recipient, amount, fee, nonce, signature)
 
-        self.current_transactions.append(
-            {"sender": sender, "recipient": recipient, "amount": amount}
-        )
+        if not self._admit(tx):
+            return None
+
+        return self.last_block.index + 1
+
+    def new_transactions(self, transactions):
+        """
+        Adds a batch of transactions to go into the next mined Blocks
+        :param transactions: <list> Transactions, in submission order
+        :return: <list> For each transaction, the index of the Block that
+        will hold it, or None if it was turned away
+        """
+        index = self.last_block.index + 1
+
+        return [index if self._admit(tx) else None for tx in transactions]
 
-        return self.last_block["index"] + 1
+    def _admit(self, tx):
+        """
+        Adds a transaction to the mempool, unless its nonce was already
+        used or its sender can't afford it on top of what it already has
+        waiting
+        :return: True if it went in
+        """
+        if not self.ledger.admissible([tx], self.mempool.pending, ahead=True):
+            return False
 
-    def update_difficulty(self, new_difficulty: int):
+        return self.mempool.add(tx)
+
+    def next_nonce(self, address):
+        """
+        :param address: <str> Wallet address
+        :return: <int> Nonce for the next transaction `address` signs, past
+        the ones it has waiting in the mempool
+        """
+        return max(self.ledger.nonce(address), self.mempool.next_nonce(address))
+
+    @property
+    def target(self):
         """
-        Changes the mining difficulty
+        The difficulty as a numeric threshold a proof hash must stay under
         """
-        self.difficulty = new_difficulty
-        self.difficulty_string = "0" * new_difficulty
+        return target(self.difficulty)
@@ -1,12 +1,33 @@
-import hashlib
+import atexit
 import json
+import math
+import os
+import threading
+import traceback
 
-from time import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
 
 from uuid import uuid4
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
+from waitress import serve
 
+from block import Block, Transaction, chain_bytes
 from blockchain import Blockchain
+from consensus import bootstrap_from_peers, sync_with_peers
+from hashing import valid_proof
+from ledger import MINT_ADDRESS, valid_amount
+from metrics import CONTENT_TYPE, LATENCY_BUCKETS, REGISTRY, Counter, Gauge, Histogram
+from node_client import NodeClient, NodeUnavailable
+from pool import BLOCK, INVALID as INVALID_SHARE, SHARE, Pool
+from signatures import SignatureVerifier
+from snapshot import to_json as snapshot_json
+from storage import BlockStore
+from tree import EXTENDED, INVALID, ORPHAN, REORGANIZED
+from validation import start_pool
+from wire import MIMETYPE, Reader, encode
+from writer import ChainWriter
 
 # Instantiate our Node
 app = Flask(__name__)
@@ -14,53 +35,262 @@ app = Flask(__name__)
 # Generate a globally unique address for this node
 node_identifier = str(uuid4()).replace("-", "")
 
+# Open the on-disk block store, the chain survives restarts
+store = BlockStore(os.environ.get("BLOCKCHAIN_DATA_DIR", "chaindata"))
+atexit.register(store.close)
+
+# Difficulty never drops below this many leading zero bits, blocks from
+# peers are held to it too
+MIN_DIFFICULTY = 16
+
+# Checks transaction signatures in batches, and remembers the results so
+# a transaction is only checked once on its way into a block. Its worker
+# processes are started by the entry point below
+verifier = SignatureVerifier()
+atexit.register(verifier.close)
+
 # Instantiate the Blockchain
-blockchain = Blockchain(difficulty=4)
+# Difficulty is in leading zero bits, 16 bits == 4 hex zeroes. It is
+# retargeted as blocks are appended, aiming for a block a minute
+blockchain = Blockchain(difficulty=MIN_DIFFICULTY, store=store, verifier=verifier)
+
+# Peers to sync with, as a comma separated list of addresses
+for address in filter(None, os.environ.get("BLOCKCHAIN_PEERS", "").split(",")):
+    blockchain.register_node(address.strip())
+
+# Pruning mode: start from a peer's balance snapshot instead of replaying
+# the whole chain, and keep only the headers of blocks before the latest
+# snapshot
+PRUNE = os.environ.get("BLOCKCHAIN_PRUNE") == "1"
+
+# Keep-alive connections to peers, shared by every sync
+peer_client = NodeClient([], timeout=(3.05, 30), retries=2)
+
+# Seconds between background syncs with peers
+SYNC_INTERVAL = 30
+
+# Sends new blocks to peers in the background
+announcer = ThreadPoolExecutor(max_workers=4, thread_name_prefix="announce")
+
+# Every change to the chain or mempool runs on this one thread
+writer = ChainWriter()
+
+# Pool mode, for miners that would rather share the work and the rewards
+pool = Pool()
+
+# Immutable picture of the chain tip. Handlers read whichever snapshot is
+# current without taking a lock, and the writer swaps in a new one after
+# every change
+TipSnapshot = namedtuple(
+    "TipSnapshot",
+    ["header", "header_bytes", "hash", "length", "work", "difficulty", "target"],
+)
+tip = None
+
+# Miners long-polling /work wait on this until the tip or difficulty changes
+work_changed = threading.Condition()
+
+# Longest a /work request is held open, in seconds
+MAX_WORK_TIMEOUT = 60
+
+# Threads serving requests. Long-polling miners each hold one for up to
+# MAX_WORK_TIMEOUT
+SERVER_THREADS = int(os.environ.get("BLOCKCHAIN_THREADS", 32))
+
+# At most this many /work requests are held open at once, so long-polls
+# can't take every thread. Past it, miners are answered straight away and
+# told to poll again after WORK_RETRY_AFTER seconds
+MAX_WORK_WAITERS = max(SERVER_THREADS // 2, 1)
+WORK_RETRY_AFTER = 5
+work_waiters = threading.BoundedSemaphore(MAX_WORK_WAITERS)
+
+# Served on /metrics. Gauges are only read when scraped, and latencies are
+# only timed once something has scraped
+REQUEST_SECONDS = Histogram(
+    "blockchain_request_seconds",
+    "Time to handle a request, up to the start of a streamed body",
+    LATENCY_BUCKETS,
+    ["route"],
+)
+PROOFS = Counter(
+    "blockchain_proofs_total",
+    "Proofs submitted to /mine, by whether they forged a block",
+    ["result"],
+)
+SHARES = Counter(
+    "blockchain_pool_shares_total", "Shares submitted to /pool/share", ["status"]
+)
+CHAIN_BYTES = Counter(
+    "blockchain_chain_bytes_total", "Bytes of blocks served by /chain", ["format"]
+)
+Gauge("blockchain_height", "Blocks in the chain", lambda: tip.length)
+Gauge(
+    "blockchain_difficulty", "Leading zero bits a proof needs", lambda: tip.difficulty
+)
+Gauge(
+    "blockchain_mempool_transactions",
+    "Transactions waiting for a block",
+    lambda: len(blockchain.mempool),
+)
+Gauge(
+    "blockchain_network_hash_rate",
+    "Hashes per second the network is doing, estimated from recent blocks",
+    lambda: writer.read(blockchain.hash_rate),
+)
+
+
+@app.before_request
+def start_timer():
+    if REGISTRY.scraped:
+        g.request_start = perf_counter()
+
+
+@app.after_request
+def record_latency(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(perf_counter() - start, (route,))
+
+    return response
+
+
+def publish_tip():
+    """
+    Takes a new tip snapshot and wakes up every miner waiting on /work.
+    Only called from the writer thread (or before serving starts)
+    """
+    global tip
+
+    # Prune as soon as a block commits to a new snapshot
+    if PRUNE:
+        blockchain.prune()
+
+    last_block = blockchain.last_block
+    tip = TipSnapshot(
+        header=last_block.header(),
+        header_bytes=last_block.header_bytes(),
+        hash=blockchain.block_hashes[-1],
+        length=len(blockchain.chain),
+        work=blockchain.work,
+        difficulty=blockchain.difficulty,
+        target=f"{blockchain.target:064x}",
+    )
+
+    with work_changed:
+        work_changed.notify_all()
+
+
+publish_tip()
+
+
+def current_work(snapshot):
+    """
+    What miners need to search for the next block: the last block's header,
+    its hash and the current difficulty
+    """
+    return {
+        "block": snapshot.header,
+        "tip": snapshot.hash,
+        "difficulty": snapshot.difficulty,
+        "target": snapshot.target,
+    }
+
+
+def forge_block(proof, miner_id=None):
+    """
+    Checks `proof` against the tip as it is right now and, if it holds,
+    appends the new block. Runs on the writer thread
+    :param proof: <int> The proof
+    :param miner_id: <str> Who gets the reward. None for a block found by
+    the pool, whose reward is split over the round's shares
+    :return: <Block> The new block, or None if the proof was rejected
+    """
+    if blockchain.proof_used(proof):
+        # Proof already submitted previously
+        return None
+
+    if not blockchain.valid_proof(blockchain.last_header_bytes, proof):
+        return None
+
+    # Only now is the pool's round really over
+    reward_to = miner_id if miner_id is not None else pool.take_round()
+
+    # Forge the new Block by adding it to the chain with the proof,
+    # paying the miner the reward plus the block's fees
+    previous_hash = blockchain.hash(blockchain.last_block)
+    block = blockchain.new_block(proof, previous_hash, reward_to=reward_to)
+
+    # Everyone else is now mining on a stale tip
+    publish_tip()
+    announce(block)
+
+    return block
+
+
+def announce(block):
+    """
+    Sends a block to every peer, without waiting for them
+    """
+    for peer in blockchain.nodes:
+        announcer.submit(_send_block, peer, block.to_json())
+
+
+def _send_block(peer, data):
+    try:
+        peer_client.post("/blocks", json=data, nodes=[peer], retries=1)
+    except NodeUnavailable:
+        # It will catch up at its next sync
+        pass
+
+
+def valid_miner_id(miner_id):
+    """
+    :return: True if `miner_id` can be paid, and used as a key
+    """
+    return isinstance(miner_id, str) and miner_id != ""
 
 
 @app.route("/mine", methods=["POST"])
 def mine():
-    try:
-        data = request.get_json()
-    except:
-        # TODO Handle bad requests
-        print("Invalid request body")
+    if request.mimetype == MIMETYPE:
+        # Binary body: the miner id, then the proof
+        try:
+            miner_id, proof = Reader(request.get_data()).values(2)
+            data = {"id": miner_id, "proof": proof}
+        except ValueError:
+            data = {}
+    else:
+        data = request.get_json(silent=True)
 
-    if "id" not in data or "proof" not in data:
+    if not isinstance(data, dict) or "id" not in data or "proof" not in data:
         # Bad Request
         return jsonify({"error": "Request missing an id and/or a proof"}), 400
+    elif not valid_miner_id(data["id"]):
+        return jsonify({"error": "id must be a non-empty string"}), 400
     else:
-        # Check if proof is unique to chain
-        for block in blockchain.chain:
-            if block["proof"] == data["proof"]:
-                # Proof already submitted previously
-                return jsonify({"success": False})
-
-        # Validate proof
-        block_string = json.dumps(blockchain.last_block, sort_keys=True)
-        proof_string = f"{block_string}{data['proof']}".encode()
-        proof_hash = hashlib.sha256(proof_string).hexdigest()
-
-        valid_proof = (
-            proof_hash[: blockchain.difficulty] == blockchain.difficulty_string
-        )
+        # Cheap check against the current snapshot first, so hopeless
+        # proofs never queue up behind the writer
+        snapshot = tip
+        if not valid_proof(snapshot.header_bytes, data["proof"], snapshot.difficulty):
+            PROOFS.inc(labels=("rejected",))
+            return jsonify({"success": False})
 
-        if valid_proof:
-            # Create miner reward tx
-            blockchain.new_transaction("0", data["id"], blockchain.reward)
+        # The writer checks again against the tip as it is when its turn comes
+        block = writer.call(forge_block, data["proof"], data["id"])
 
-            # Forge the new Block by adding it to the chain with the proof
-            previous_hash = blockchain.hash(blockchain.last_block)
-            block = blockchain.new_block(data["proof"], previous_hash)
+        # Stale: valid for the snapshot, but another block got in first
+        PROOFS.inc(labels=("accepted" if block is not None else "stale",))
 
+        if block is not None:
             response = {
                 "success": True,
                 "message": "New block forged!",
-                "index": block["index"],
-                "transactions": block["transactions"],
-                "proof": block["proof"],
-                "previous_hash": previous_hash,
-                "hash": block["hash"],
+                "index": block.index,
+                "transactions": [tx.to_json() for tx in block.transactions],
+                "proof": block.proof,
+                "previous_hash": block.previous_hash,
+                "hash": block.hash,
             }
         else:
             response = {"success": False}
@@ -68,90 +298,763 @@ def mine():
         return jsonify(response)
 
 
+# Blocks per chunk when streaming the chain
+CHAIN_CHUNK_SIZE = 100
+
+
 @app.route("/chain", methods=["GET"])
 def full_chain():
+    """
+    Returns the chain, or a range of it.
+
+    Query parameters (all optional, block indexes are 1-based):
+    * from / to - first and last block to return
+    * cursor - same as `from`, for following `next_cursor`
+    * limit - maximum number of blocks to return
+    * format=ndjson - one block per line instead of a JSON document
+      (also chosen by `Accept: application/x-ndjson`)
+    * format=binary - length-prefixed binary blocks, see `block.chain_bytes`
+      (also chosen by `Accept: application/octet-stream`)
+    * headers=1 - blocks without their transactions, for nodes
+      bootstrapping from a snapshot
+
+    The body is streamed from the cached block strings, and an ETag
+    keyed on the tip hash lets clients skip unchanged ranges.
+    """
+    # A reorg can still replace blocks while we stream them, the chunk
+    # generators stop if it does
+    snapshot = tip
+    length = snapshot.length
+
+    start = request.args.get("cursor", request.args.get("from", 1, type=int), type=int)
+    end = request.args.get("to", length, type=int)
+    limit = request.args.get("limit", type=int)
+
+    if start < 1 or end < start or end > length or (limit is not None and limit < 1):
+        return jsonify({"error": f"Blocks run from 1 to {length}"}), 400
+
+    if limit is not None:
+        end = min(end, start + limit - 1)
+
+    headers_only = request.args.get("headers") == "1"
+
+    # The last block pins the branch, if it changes so may any before it
+    end_hash = snapshot.hash if end == length else blockchain.block_hashes[end - 1]
+
+    next_cursor = end + 1 if end < length else None
+
+    body_format = request.args.get("format")
+    if body_format is None:
+        body_format = {
+            "application/x-ndjson": "ndjson",
+            MIMETYPE: "binary",
+        }.get(request.accept_mimetypes.best, "json")
+
+    # Blocks never change, so the tip and the range pin down the response
+    etag = f"{snapshot.hash}-{start}-{end}-{body_format}-{int(headers_only)}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    if body_format in ("ndjson", "binary"):
+        if body_format == "ndjson":
+            chunks = _chain_chunks(
+                start, end, end_hash, "", "\n", "\n", "", headers_only
+            )
+            response = Response(
+                _counted(chunks, body_format), mimetype="application/x-ndjson"
+            )
+        else:
+            chunks = _binary_chunks(start, end, end_hash, headers_only)
+            response = Response(_counted(chunks, body_format), mimetype=MIMETYPE)
+
+        response.headers["X-Chain-Length"] = str(length)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = str(next_cursor)
+    else:
+        head = (
+            f'{{"length": {length}, "from": {start}, "to": {end}, '
+            f'"next_cursor": {"null" if next_cursor is None else next_cursor}, '
+            f'"chain": ['
+        )
+        chunks = _chain_chunks(start, end, end_hash, head, ",", "", "]}", headers_only)
+        response = Response(_counted(chunks, body_format), mimetype="application/json")
+
+    response.set_etag(etag)
+    return response
+
+
+def _same_branch(end, end_hash):
+    """
+    :return: True if block `end` (1-based) still has hash `end_hash`, i.e.
+    no reorg replaced it or anything before it
+    """
+    try:
+        return blockchain.block_hashes[end - 1] == end_hash
+    except IndexError:
+        return False
+
+
+def _chain_chunks(
+    start, end, end_hash, head, separator, tail_separator, tail, headers_only=False
+):
+    """
+    Yields the block strings from `start` to `end` (inclusive, 1-based)
+    a chunk at a time, straight from the cache without re-encoding unless
+    only the headers are wanted. Stops short, leaving the body incomplete,
+    if a reorg replaces block `end` on the way
+    """
+    yield head
+
+    for chunk_start in range(start - 1, end, CHAIN_CHUNK_SIZE):
+        chunk_end = min(chunk_start + CHAIN_CHUNK_SIZE, end)
+        block_strings = blockchain.block_strings[chunk_start:chunk_end]
+
+        # Checked after the read, so the chunk is from the pinned branch
+        if not _same_branch(end, end_hash):
+            return
+
+        if headers_only:
+            block_strings = [
+                Block.from_string(block_string).header_only().to_string()
+                for block_string in block_strings
+            ]
+
+        chunk = separator.join(block_strings)
+
+        if chunk_start > start - 1:
+            chunk = separator + chunk
+
+        yield chunk
+
+    if end >= start:
+        yield tail_separator
+
+    yield tail
+
+
+def _binary_chunks(start, end, end_hash, headers_only=False):
+    """
+    Yields blocks `start` to `end` (inclusive, 1-based) in their binary
+    form, a chunk at a time. Blocks are stored as JSON, so each one is
+    decoded and re-encoded on the way out. Stops short if a reorg
+    replaces block `end` on the way
+    """
+    for chunk_start in range(start - 1, end, CHAIN_CHUNK_SIZE):
+        chunk_end = min(chunk_start + CHAIN_CHUNK_SIZE, end)
+        block_strings = blockchain.block_strings[chunk_start:chunk_end]
+
+        if not _same_branch(end, end_hash):
+            return
+
+        blocks = map(Block.from_string, block_strings)
+        if headers_only:
+            blocks = (block.header_only() for block in blocks)
+
+        yield b"".join(chain_bytes(blocks))
+
+
+def _counted(chunks, body_format):
+    """
+    Passes the chunks of a /chain body through, counting the bytes served.
+    Block strings are ASCII JSON, so characters are bytes
+    """
+    for chunk in chunks:
+        CHAIN_BYTES.inc(len(chunk), (body_format,))
+        yield chunk
+
+
+@app.route("/last_block", methods=["GET"])
+def last_block():
+    # Miners only need the fixed-size header, not the transactions
+    snapshot = tip
+
+    if request.accept_mimetypes.best == MIMETYPE:
+        # The tip hash, difficulty and target, then the header exactly as
+        # the proof is hashed on top of it
+        body = (
+            encode((snapshot.hash, snapshot.difficulty, snapshot.target))
+            + snapshot.header_bytes
+        )
+        return Response(body, mimetype=MIMETYPE), 200
+
+    return jsonify(current_work(snapshot)), 200
+
+
+@app.route("/snapshot", methods=["GET"])
+def latest_snapshot():
+    """
+    The latest balance snapshot a block in our chain commits to, for new
+    nodes to bootstrap from
+    """
+    # Snapshots are swapped on the writer thread
+    latest = writer.read(lambda: blockchain.snapshot)
+    if latest is None:
+        return jsonify({"error": "No snapshot yet"}), 404
+
+    return jsonify(snapshot_json(latest)), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """
+    Every metric in the Prometheus text format, see metrics.py
+    """
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE), 200
+
+
+@app.route("/pool/work", methods=["GET"])
+def pool_work():
+    """
+    Work for a pool miner: the usual work, plus the share difficulty and
+    the miner's own nonce range to search
+    """
+    miner_id = request.args.get("id")
+    if not valid_miner_id(miner_id):
+        return jsonify({"error": "Request missing an id"}), 400
+
+    snapshot = tip
+    start, end = pool.assign(miner_id)
+
+    response = current_work(snapshot)
+    response["share_difficulty"] = pool.share_difficulty(snapshot.difficulty)
+    response["nonce_start"] = start
+    response["nonce_end"] = end
+
+    return jsonify(response), 200
+
+
+@app.route("/pool/share", methods=["POST"])
+def pool_share():
+    """
+    A share from a pool miner: {"id", "proof", "tip"}. Shares are checked
+    without the writer, only one that is also a block goes through it
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not all(k in data for k in ("id", "proof", "tip")):
+        return jsonify({"error": "Request missing an id, proof and/or tip"}), 400
+
+    if not valid_miner_id(data["id"]):
+        return jsonify({"error": "id must be a non-empty string"}), 400
+
+    status = pool.submit(data["id"], data["proof"], data["tip"], tip)
+
+    if status == BLOCK:
+        block = writer.call(forge_block, data["proof"])
+        if block is None:
+            # Someone else got there first, it still counted as a share
+            status = SHARE
+
+    SHARES.inc(labels=(status,))
+
+    if status == INVALID_SHARE:
+        return jsonify({"status": status}), 400
+
+    return jsonify({"status": status}), 200
+
+
+@app.route("/pool/stats", methods=["GET"])
+def pool_stats():
+    shares = pool.round_shares()
+
     response = {
-        "length": len(blockchain.chain),
-        "chain": blockchain.chain,
+        "miners": len(pool.ranges),
+        "round_shares": sum(shares.values()),
+        "shares": shares,
+        "share_difficulty": pool.share_difficulty(tip.difficulty),
     }
+
     return jsonify(response), 200
 
 
-@app.route("/last_block", methods=["GET"])
-def last_block():
-    # Last block in chain
-    block = blockchain.chain[-1]
-
-    # TODO Needs a re-work
-    # Target time per block in seconds
-    target_time = 60
-    # Margin buffer time in percent
-    time_margin = 0.35
-    # Sample last n blocks
-    target_blocks = 10
-    # Last n blocks
-    last_n_blocks = blockchain.chain[-target_blocks:]
-    # Last n blocks time
-    last_n_time = 0
-
-    if len(last_n_blocks) == target_blocks:
-        # Recalculate difficulty
-        for i in range(1, len(last_n_blocks)):
-            current_block = last_n_blocks[i]
-            prev_block = last_n_blocks[i - 1]
-            last_n_time += current_block["timestamp"] - prev_block["timestamp"]
-
-        # Get average time per block
-        average_time = last_n_time / target_blocks
-
-        # Determine if we need to raise or lower difficulty
-        # print(f"Stay under {target_time - (time_margin * target_time)}")
-        # print(f"Stay above {target_time + (time_margin * target_time)}")
-        # print(f"Actual {average_time}")
-        if average_time < target_time - (time_margin * target_time):
-            new_difficulty = blockchain.difficulty + 1
-        elif average_time > target_time + (time_margin * target_time):
-            new_difficulty = blockchain.difficulty - 1
-
-        # Prevent less than 1 difficulty if necessary
-        if new_difficulty < 4:
-            new_difficulty = 4
-
-        # Update difficulty
-        blockchain.update_difficulty(new_difficulty)
+@app.route("/work", methods=["GET"])
+def work():
+    """
+    Long-poll for new work. Returns as soon as the chain tip or the
+    difficulty differs from the `tip` and `difficulty` the miner is
+    working on, or after `timeout` seconds with the unchanged work.
+    With MAX_WORK_WAITERS requests already waiting, the unchanged work
+    comes back at once, with a Retry-After header.
+    """
+    tip_hash = request.args.get("tip")
+    difficulty = request.args.get("difficulty", type=int)
+    timeout = request.args.get("timeout", 30, type=float)
+    if not math.isfinite(timeout):
+        return jsonify({"error": "timeout must be a number of seconds"}), 400
+    timeout = min(max(timeout, 0), MAX_WORK_TIMEOUT)
+
+    def changed():
+        return tip.hash != tip_hash or (
+            difficulty is not None and tip.difficulty != difficulty
+        )
+
+    if changed() or timeout == 0:
+        return jsonify(current_work(tip)), 200
+
+    if not work_waiters.acquire(blocking=False):
+        return jsonify(current_work(tip)), 200, {"Retry-After": WORK_RETRY_AFTER}
+
+    try:
+        with work_changed:
+            work_changed.wait_for(changed, timeout)
+    finally:
+        work_waiters.release()
+
+    return jsonify(current_work(tip)), 200
+
+
+# The ledger and chain are only consistent between writer jobs, so reads
+# of them go through `writer.read`, which retries any read a job overlapped.
+# The tip snapshot covers the rest
+
+
+def read_balance(address):
+    """
+    Read in one go, so the nonce counts the same transactions as the
+    balance
+    :return: (confirmed balance, nonce for the next transaction it signs)
+    """
+    return blockchain.balance(address), blockchain.next_nonce(address)
+
+
+@app.route("/balance/<address>", methods=["GET"])
+def balance(address):
+    amount, nonce = writer.read(read_balance, address)
+
+    response = {"id": address, "balance": amount, "nonce": nonce}
+
+    return jsonify(response), 200
+
+
+def read_merkle_proof(index, position):
+    """
+    Read in one go, so a reorg can't swap the block between the proof and
+    its header
+    :return: (txid, proof, header) or None if there is no such transaction
+    """
+    result = blockchain.merkle_proof(index, position)
+    if result is None:
+        return None
+
+    return result + (blockchain.get_block(index).header(),)
+
+
+@app.route("/merkle_proof/<int:index>/<int:position>", methods=["GET"])
+def merkle_proof(index, position):
+    result = writer.read(read_merkle_proof, index, position)
+    if result is None:
+        return jsonify({"error": "No such transaction"}), 404
+
+    txid, proof, header = result
 
     response = {
-        "block": {
-            "index": block["index"],
-            "transactions": block["transactions"],
-            "proof": block["proof"],
-            "previous_hash": block["previous_hash"],
-            "hash": block["hash"],
-            "timestamp": block["timestamp"],
-        },
-        "difficulty": blockchain.difficulty,
+        "txid": txid,
+        "proof": proof,
+        "header": header,
     }
 
     return jsonify(response), 200
 
 
+def read_history(address, page, per_page):
+    """
+    Read in one go, so the page and the total agree
+    :return: (page of `Blockchain.transactions_for`, total transactions)
+    """
+    history = blockchain.transactions_for(address, page, per_page)
+
+    return history, blockchain.ledger.count(address)
+
+
+@app.route("/transactions/<address>", methods=["GET"])
+def transactions(address):
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", 10, type=int)
+
+    if page < 1 or not 1 <= per_page <= 100:
+        return jsonify({"error": "page must be >= 1, per_page 1 to 100"}), 400
+
+    history, total = writer.read(read_history, address, page, per_page)
+
+    response = {
+        "id": address,
+        "page": page,
+        "per_page": per_page,
+        "total": total,
+        "transactions": [
+            dict(tx.to_json(), block=index, position=position)
+            for index, position, tx in history
+        ],
+    }
+
+    return jsonify(response), 200
+
+
+# Most transactions accepted by one /transactions/batch request
+MAX_BATCH_SIZE = 10000
+
+REJECTED_BY_MEMPOOL = (
+    "Nonce already used or waiting, more than the sender's balance, or fee too"
+    " low for a full pool"
+)
+
+INVALID_SIGNATURE = "Invalid signature"
+
+
+def parse_transaction(values):
+    """
+    Checks a transaction submitted as JSON
+    :param values: <dict> The submitted transaction
+    :return: (Transaction, None) if it is well formed, else (None, error)
+    """
+    required = ["sender", "recipient", "amount", "signature"]
+    if not isinstance(values, dict) or not all(k in values for k in required):
+        return None, "Requires sender, recipient, amount, and signature"
+
+    # Anything else can't be encoded, let alone signed
+    if not isinstance(values["sender"], str) or not isinstance(
+        values["recipient"], str
+    ):
+        return None, "sender and recipient must be strings"
+
+    # Only mining rewards come from the mint
+    if values["sender"] == MINT_ADDRESS:
+        return None, "Can't send from the mint address"
+
+    amount = values["amount"]
+    if not valid_amount(amount):
+        return None, "amount must be a positive number"
+
+    # Optional fee, higher fees get mined sooner
+    fee = values.get("fee", 0)
+    if not valid_amount(fee, allow_zero=True):
+        return None, "fee must be a non-negative number"
+
+    # Optional nonce, the sender's first transaction has 0
+    nonce = values.get("nonce", 0)
+    if not isinstance(nonce, int) or isinstance(nonce, bool) or nonce < 0:
+        return None, "nonce must be a non-negative integer"
+
+    if not isinstance(values["signature"], str):
+        return None, INVALID_SIGNATURE
+
+    tx = Transaction(
+        values["sender"], values["recipient"], amount, fee, nonce, values["signature"]
+    )
+
+    return tx, None
+
+
 @app.route("/transactions/new", methods=["POST"])
 def new_transaction():
-    values = request.get_json()
+    tx, error = parse_transaction(request.get_json(silent=True))
+    if error is not None:
+        return jsonify({"error": error}), 400
 
-    required = ["sender", "recipient", "amount"]
-    if not all(k in values for k in required):
-        return jsonify({"error": "Requires sender, recipient, and amount"}), 400
+    # Checked here, off the writer thread, so the mempool only ever sees
+    # signed transactions
+    if not verifier.verify([tx])[0]:
+        return jsonify({"error": INVALID_SIGNATURE}), 400
 
-    index = blockchain.new_transaction(
-        values["sender"], values["recipient"], values["amount"]
+    index = writer.call(
+        blockchain.new_transaction,
+        tx.sender,
+        tx.recipient,
+        tx.amount,
+        tx.fee,
+        tx.nonce,
+        tx.signature,
     )
 
+    if index is None:
+        return jsonify({"error": REJECTED_BY_MEMPOOL}), 409
+
     response = {"message": f"Transaction will be added to Block {index}"}
 
     return jsonify(response), 200
 
 
+@app.route("/transactions/batch", methods=["POST"])
+def new_transactions():
+    """
+    Accepts many transactions at once, either as a JSON array or as NDJSON
+    (one transaction per line, `Content-Type: application/x-ndjson`).
+    Every item is checked, the signatures of the well formed ones in one
+    batch, the signed ones go to the mempool in a single writer job, and
+    the response has one result per item, in order.
+    """
+    if request.mimetype == "application/x-ndjson":
+        items = []
+        for line in request.stream:
+            if line.strip():
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    # Keep the item so its result lines up with its position
+                    items.append(None)
+
+            # Don't read an oversized stream to the end before refusing it
+            if len(items) > MAX_BATCH_SIZE:
+                break
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return jsonify({"error": "Expected a JSON array of transactions"}), 400
+
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} per batch"}), 413
+
+    results = []
+    parsed = []
+    for values in items:
+        tx, error = parse_transaction(values)
+        if error is not None:
+            results.append({"accepted": False, "error": error})
+        else:
+            results.append(None)
+            parsed.append((len(results) - 1, tx))
+
+    transactions = []
+    signed = verifier.verify([tx for _, tx in parsed])
+    for (i, tx), valid in zip(parsed, signed):
+        if valid:
+            transactions.append(tx)
+        else:
+            results[i] = {"accepted": False, "error": INVALID_SIGNATURE}
+
+    indexes = iter(writer.call(blockchain.new_transactions, transactions))
+
+    for i, result in enumerate(results):
+        if result is not None:
+            continue
+
+        index = next(indexes)
+        if index is None:
+            results[i] = {"accepted": False, "error": REJECTED_BY_MEMPOOL}
+        else:
+            results[i] = {"accepted": True, "block": index}
+
+    response = {
+        "accepted": sum(result["accepted"] for result in results),
+        "results": results,
+    }
+
+    return jsonify(response), 200
+
+
+def adopt_branch(fork, fork_hash, blocks):
+    """
+    Switches to a branch with more work found by `sync_with_peers`. Runs
+    on the writer thread
+    :return: True if our chain was replaced
+    """
+    if not blockchain.adopt_branch(fork, fork_hash, blocks):
+        return False
+
+    # Miners have to move over to the new tip
+    publish_tip()
+
+    return True
+
+
+def adopt_snapshot(base, headers, blocks):
+    """
+    Replaces our fresh chain with one bootstrapped from a peer's snapshot.
+    Runs on the writer thread
+    :return: True if our chain was replaced
+    """
+    # Only a node that has nothing yet starts over from a snapshot
+    if len(blockchain.chain) > 1:
+        return False
+
+    if not blockchain.bootstrap(base, headers, blocks):
+        return False
+
+    publish_tip()
+
+    return True
+
+
+# One sync at a time, a second one would only download the same blocks
+sync_lock = threading.Lock()
+
+
+def sync(wait=True):
+    """
+    Consensus with our peers: the valid chain with the most work wins
+    :param wait: <bool> Wait for a sync that is already running, instead
+    of leaving it to that one
+    :return: True if our chain was replaced
+    """
+    if not sync_lock.acquire(blocking=wait):
+        return False
+
+    try:
+        # A new pruning node skips replaying the chain if it can
+        if PRUNE and tip.length == 1:
+            start = bootstrap_from_peers(
+                blockchain, peer_client, node_identifier, MIN_DIFFICULTY
+            )
+            if start is not None and writer.call(adopt_snapshot, *start):
+                return True
+
+        branch = sync_with_peers(
+            blockchain, peer_client, node_identifier, MIN_DIFFICULTY
+        )
+        if branch is None:
+            return False
+
+        return writer.call(adopt_branch, *branch)
+    finally:
+        sync_lock.release()
+
+
+def sync_forever():
+    while True:
+        sleep(SYNC_INTERVAL)
+
+        if not blockchain.nodes:
+            continue
+
+        # Whatever a peer sent us, the next round still has to run
+        try:
+            sync()
+        except Exception:
+            traceback.print_exc()
+
+
+def start_sync():
+    """
+    Starts syncing with peers every `SYNC_INTERVAL` seconds, in the
+    background. Whatever serves the node calls this once, importing the
+    module never starts it
+    """
+    threading.Thread(target=sync_forever, name="sync", daemon=True).start()
+
+
+@app.route("/nodes", methods=["GET"])
+def nodes():
+    """
+    Who this node is, its chain tip and the peers it knows about
+    """
+    snapshot = tip
+
+    response = {
+        "node_id": node_identifier,
+        "length": snapshot.length,
+        "work": snapshot.work,
+        "tip": snapshot.hash,
+        "nodes": sorted(blockchain.nodes),
+    }
+
+    return jsonify(response), 200
+
+
+def receive_block(block):
+    """
+    Adds a block a peer announced. Runs on the writer thread
+    :return: <str> What `Blockchain.add_block` did with it
+    """
+    status = blockchain.add_block(block, MIN_DIFFICULTY)
+
+    if status in (EXTENDED, REORGANIZED):
+        publish_tip()
+        # Pass it on, peers that already have it answer "duplicate"
+        announce(block)
+
+    return status
+
+
+@app.route("/blocks", methods=["POST"])
+def new_block():
+    """
+    A peer announcing a block it mined or received. Blocks that compete
+    with our tip are kept on a side branch, and a branch that gets more
+    work than ours becomes our chain
+    """
+    try:
+        block = Block.from_json(request.get_json(silent=True))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Not a block"}), 400
+
+    # New blocks come whole, only old ones get pruned
+    if block.pruned:
+        return jsonify({"error": "Not a block"}), 400
+
+    # Check the signatures here rather than on the writer thread, the
+    # results are cached for when the writer validates the block
+    verifier.verify([tx for tx in block.transactions if tx.sender != MINT_ADDRESS])
+
+    status = writer.call(receive_block, block)
+
+    if status == ORPHAN:
+        # We are missing blocks before this one, go and get them
+        threading.Thread(target=sync, args=(False,), daemon=True).start()
+    elif status == INVALID:
+        return jsonify({"status": status}), 400
+
+    return jsonify({"status": status}), 200
+
+
+@app.route("/nodes/register", methods=["POST"])
+def register_nodes():
+    values = request.get_json(silent=True) or {}
+
+    addresses = values.get("nodes")
+    if not isinstance(addresses, list) or not addresses:
+        return jsonify({"error": "Please supply a valid list of nodes"}), 400
+
+    for address in addresses:
+        try:
+            writer.call(blockchain.register_node, str(address))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    response = {
+        "message": "New nodes have been added",
+        "total_nodes": sorted(blockchain.nodes),
+    }
+
+    return jsonify(response), 201
+
+
+@app.route("/nodes/resolve", methods=["GET"])
+def consensus():
+    replaced = sync()
+
+    if replaced:
+        message = "Our chain was replaced"
+    else:
+        message = "Our chain is authoritative"
+
+    response = {
+        "message": message,
+        "length": tip.length,
+        "work": tip.work,
+        "tip": tip.hash,
+    }
+
+    return jsonify(response), 200
+
+
 # Run the program on port 5000
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Worker processes for validating long chains and checking signatures.
+    # Only a node that serves needs them, so importing this module (e.g.
+    # from the benchmarks) doesn't fork any
+    start_pool()
+    verifier.start()
+
+    # Check a chain loaded from disk before serving it. Everything up to
+    # BLOCKCHAIN_CHECKPOINT (a block hash) is trusted as is
+    checkpoint = os.environ.get("BLOCKCHAIN_CHECKPOINT")
+    if not blockchain.validate_chain(checkpoint):
+        raise SystemExit("Stored chain failed validation")
+
+    start_sync()
+
+    # Requests run on a pool of threads. Handlers only read snapshots or
+    # hand their work to the writer, so they are safe to run side by side
+    port = int(os.environ.get("BLOCKCHAIN_PORT", 5000))
+    serve(app, host="0.0.0.0", port=port, threads=SERVER_THREADS)
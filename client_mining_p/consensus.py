@@ -0,0 +1,261 @@
+import hashlib
+
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+from block import read_chain
+from node_client import NodeUnavailable
+from snapshot import from_json as snapshot_from_json
+from validation import validate_chain
+
+# Blocks asked for in one /chain request while downloading a branch
+SYNC_CHUNK_SIZE = 500
+
+# Most requests in flight at once while syncing
+MAX_SYNC_REQUESTS = 8
+
+
+class Branch(Sequence):
+    """
+    Our chain up to the fork point followed by a peer's blocks, as one
+    sequence of block strings for `validate_chain`
+    """
+
+    def __init__(self, base, fork, block_strings):
+        self.base = base
+        self.fork = fork
+        self.block_strings = block_strings
+
+    def __len__(self):
+        return self.fork + len(self.block_strings)
+
+    def __getitem__(self, i):
+        if i < self.fork:
+            return self.base[i]
+
+        return self.block_strings[i - self.fork]
+
+
+def fetch_tips(client, peers, node_id):
+    """
+    Asks every peer for its chain tip, all at once
+    :param client: <NodeClient> Client to talk to peers with
+    :param peers: <list> Peer base URLs
+    :param node_id: <str> Our own node identifier, so we skip ourselves
+    :return: <list> (peer, chain length, chain work, tip hash) for each
+    peer that answered
+    """
+
+    def ask(peer):
+        try:
+            _, data = client.get("/nodes", nodes=[peer], retries=1)
+            if data["node_id"] == node_id:
+                return None
+
+            return peer, int(data["length"]), int(data["work"]), data["tip"]
+        except (NodeUnavailable, KeyError, TypeError, ValueError):
+            return None
+
+    with ThreadPoolExecutor(min(len(peers), MAX_SYNC_REQUESTS)) as pool:
+        return [tip for tip in pool.map(ask, peers) if tip is not None]
+
+
+def fetch_blocks(client, peers, start, end, headers_only=False):
+    """
+    Downloads blocks `start` to `end` (inclusive, 1-based). The range is
+    split into chunks that are fetched in parallel, spread over `peers`,
+    each chunk failing over to the next peer if its first one fails
+    :param client: <NodeClient> Client to talk to peers with
+    :param peers: <list> Peers that all hold the same chain
+    :param headers_only: <bool> Leave out the transactions
+    :return: <list> The Blocks
+    :raises NodeUnavailable: if some chunk could not be fetched from anyone
+    :raises ValueError: if a peer sent something that isn't blocks
+    """
+    chunks = [
+        (i, min(i + SYNC_CHUNK_SIZE - 1, end))
+        for i in range(start, end + 1, SYNC_CHUNK_SIZE)
+    ]
+
+    def fetch(numbered_chunk):
+        n, (first, last) = numbered_chunk
+        order = peers[n % len(peers) :] + peers[: n % len(peers)]
+
+        # Binary is well under half the size of JSON
+        params = {"from": first, "to": last, "format": "binary"}
+        if headers_only:
+            params["headers"] = 1
+
+        _, data = client.get("/chain", params=params, nodes=order, raw=True)
+        blocks = read_chain(data)
+        if len(blocks) != last - first + 1:
+            raise ValueError(f"Expected blocks {first} to {last}")
+
+        return blocks
+
+    with ThreadPoolExecutor(min(len(chunks), MAX_SYNC_REQUESTS)) as pool:
+        return [
+            block for chunk in pool.map(fetch, enumerate(chunks)) for block in chunk
+        ]
+
+
+def block_hash(block):
+    """
+    :param block: <Block> A block from a peer
+    :return: <str> Its hash, as its successor's `previous_hash` holds it
+    """
+    return hashlib.sha256(block.header_bytes()).hexdigest()
+
+
+def find_fork(block_hashes, length, client, peer, peer_length):
+    """
+    Finds how many blocks our chain and a peer's have in common. Chains
+    that agree on a block agree on everything before it, so this is a
+    binary search, and a peer that merely extends our chain costs a
+    single request
+    :param block_hashes: <Sequence> Our block hashes
+    :param length: <int> Length of our chain
+    :param peer: <str> Peer to compare with
+    :param peer_length: <int> Length of the peer's chain
+    :return: <int> Number of leading blocks both chains share
+    """
+
+    def shared(k):
+        (block,) = fetch_blocks(client, [peer], k, k)
+        return block_hash(block) == block_hashes[k - 1]
+
+    high = min(length, peer_length)
+    if shared(high):
+        return high
+
+    # The first `low` blocks are shared, the first `high` are not
+    low = 0
+    while high - low > 1:
+        middle = (low + high) // 2
+        if shared(middle):
+            low = middle
+        else:
+            high = middle
+
+    return low
+
+
+def sync_with_peers(blockchain, client, node_id, min_difficulty=0, workers=None):
+    """
+    Consensus: looks for a peer whose chain has more work than ours, downloads
+    only the blocks after the point where the chains fork, and checks them.
+    Our chain is not touched, adopting the branch is up to the caller
+    :param blockchain: <Blockchain> Our chain
+    :param client: <NodeClient> Client to talk to peers with
+    :param node_id: <str> Our own node identifier
+    :param min_difficulty: <int> Leading zero bits every proof needs
+    :param workers: <int> Number of worker processes for validation
+    :return: (fork, fork hash, Blocks) for `Blockchain.adopt_branch`, or
+    None if no peer has a valid chain with more work
+    """
+    peers = sorted(blockchain.nodes)
+    if not peers:
+        return None
+
+    tips = fetch_tips(client, peers, node_id)
+
+    # Ours may grow meanwhile, the writer checks again before adopting
+    length = len(blockchain.chain)
+    block_hashes = blockchain.block_hashes
+
+    # Most work wins, and every peer with that exact tip can serve it.
+    # What peers claim is checked again once their blocks are in
+    candidates = [tip for tip in tips if tip[2] > blockchain.work]
+    if not candidates:
+        return None
+
+    _, best_length, _, best_tip = max(candidates, key=lambda tip: tip[2])
+    sources = [tip[0] for tip in tips if tip[3] == best_tip]
+
+    try:
+        fork = find_fork(block_hashes, length, client, sources[0], best_length)
+        fork_hash = block_hashes[fork - 1] if fork > 0 else None
+
+        blocks = fetch_blocks(client, sources, fork + 1, best_length)
+
+        # The peer may have switched branches while we were downloading
+        if block_hash(blocks[-1]) != best_tip:
+            return None
+    except (NodeUnavailable, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+    # Validate the canonical form, it is what we would store
+    branch = Branch(
+        blockchain.block_strings, fork, [block.to_string() for block in blocks]
+    )
+    retarget = blockchain.retarget.fresh()
+    if not validate_chain(
+        branch,
+        None,
+        fork,
+        min_difficulty,
+        workers,
+        retarget,
+        reward=blockchain.reward,
+    ):
+        return None
+
+    return fork, fork_hash, blocks
+
+
+def bootstrap_from_peers(blockchain, client, node_id, min_difficulty=0, workers=None):
+    """
+    Fast start for a new node: instead of every block, downloads the
+    headers up to the best peer's latest balance snapshot, the snapshot,
+    and the full blocks after it. The headers are checked like any chain,
+    so the snapshot is as trustworthy as the proof of work on top of the
+    block that commits to it
+    :param blockchain: <Blockchain> Our chain
+    :param client: <NodeClient> Client to talk to peers with
+    :param node_id: <str> Our own node identifier
+    :param min_difficulty: <int> Leading zero bits every proof needs
+    :param workers: <int> Number of worker processes for validation
+    :return: (Snapshot, headers, Blocks) for `Blockchain.bootstrap`, or
+    None if no peer has a snapshot to start from
+    """
+    peers = sorted(blockchain.nodes)
+    if not peers:
+        return None
+
+    tips = fetch_tips(client, peers, node_id)
+    if not tips:
+        return None
+
+    _, best_length, _, best_tip = max(tips, key=lambda tip: tip[2])
+    sources = [tip[0] for tip in tips if tip[3] == best_tip]
+
+    try:
+        _, data = client.get("/snapshot", nodes=sources)
+        base = snapshot_from_json(data)
+
+        if not 0 < base.height < best_length:
+            return None
+
+        headers = fetch_blocks(client, sources, 1, base.height, headers_only=True)
+        blocks = fetch_blocks(client, sources, base.height + 1, best_length)
+
+        if block_hash(blocks[-1]) != best_tip:
+            return None
+    except (NodeUnavailable, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+    block_strings = [block.to_string() for block in headers + blocks]
+    retarget = blockchain.retarget.fresh()
+    if not validate_chain(
+        block_strings,
+        None,
+        0,
+        min_difficulty,
+        workers,
+        retarget,
+        base.height,
+        blockchain.reward,
+    ):
+        return None
+
+    return base, headers, blocks
@@ -0,0 +1,169 @@
+from collections import deque
+from math import log2
+from time import time
+
+# Seconds we want between blocks
+TARGET_BLOCK_TIME = 60
+
+# Block intervals averaged before the difficulty may change
+RETARGET_WINDOW = 10
+
+# How far off target the average may drift before we retarget, in percent
+RETARGET_MARGIN = 0.35
+
+# Most bits one retarget may add or remove, each bit doubles or halves
+# the work
+MAX_RETARGET_STEP = 2
+
+# Beyond this a proof is out of reach of 8-byte nonces
+MAX_DIFFICULTY = 64
+
+# A block has to be later than the median timestamp of this many blocks
+# before it
+MEDIAN_TIME_BLOCKS = 11
+
+# Seconds a block's timestamp may be ahead of our clock
+MAX_FUTURE_DRIFT = 2 * 60 * 60
+
+
+def median_time(timestamps):
+    """
+    :param timestamps: <Sequence> Timestamps of the blocks before a new
+    one, at most `MEDIAN_TIME_BLOCKS` of them
+    :return: <float> Their median (the later middle one for an even
+    count), or None if there are none
+    """
+    if not timestamps:
+        return None
+
+    return sorted(timestamps)[len(timestamps) // 2]
+
+
+def valid_timestamp(timestamp, previous, now=None):
+    """
+    A block's timestamp has to move past the median of the blocks before
+    it, so it can't be dragged back to make the difficulty drop, and may
+    only be a little ahead of our clock
+    :param timestamp: <float> The block's timestamp
+    :param previous: <Sequence> Timestamps of up to `MEDIAN_TIME_BLOCKS`
+    blocks before it
+    :param now: (Optional) <float> Our clock, defaults to the current time
+    :return: True if the timestamp is acceptable
+    """
+    median = median_time(previous)
+    if median is not None and not timestamp > median:
+        return False
+
+    if now is None:
+        now = time()
+
+    return timestamp <= now + MAX_FUTURE_DRIFT
+
+
+class Retarget(object):
+    """
+    Difficulty retargeting, fed one block at a time as blocks are appended.
+
+    The window holds the intervals of the most recent blocks mined at the
+    current difficulty, at most `window` of them, with a running total, so
+    each block costs O(1). Once the window is full and its average is
+    outside the margin around `target_time`, the difficulty moves by whole
+    bits, log2 of how far off the average is, clamped to `max_step` and to
+    [min_difficulty, max_difficulty]. A change empties the window, since
+    intervals at the old difficulty say nothing about the new one.
+
+    The next difficulty depends only on the last `window` + 1 blocks, so
+    any node can check the difficulty recorded in a block header.
+    Intervals are summed in whole milliseconds, keeping the arithmetic
+    exact and the same on every node.
+    """
+
+    def __init__(
+        self,
+        target_time=TARGET_BLOCK_TIME,
+        window=RETARGET_WINDOW,
+        margin=RETARGET_MARGIN,
+        max_step=MAX_RETARGET_STEP,
+        min_difficulty=0,
+        max_difficulty=MAX_DIFFICULTY,
+    ):
+        self.target_time = target_time
+        self.window = window
+        self.margin = margin
+        self.max_step = max_step
+        self.min_difficulty = min_difficulty
+        self.max_difficulty = max_difficulty
+
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets every block seen so far
+        """
+        self.intervals = deque()
+        self.total = 0
+        self.difficulty = None
+        self.last_timestamp = None
+
+    def fresh(self):
+        """
+        :return: <Retarget> A new engine with the same settings, no blocks
+        """
+        return Retarget(
+            self.target_time,
+            self.window,
+            self.margin,
+            self.max_step,
+            self.min_difficulty,
+            self.max_difficulty,
+        )
+
+    def add_block(self, timestamp, difficulty):
+        """
+        Feeds the next block of the chain into the window
+        :param timestamp: <float> The block's timestamp
+        :param difficulty: <int> The difficulty the block was mined at
+        """
+        timestamp = int(round(timestamp * 1000))
+
+        if self.last_timestamp is not None:
+            if difficulty != self.difficulty:
+                self.intervals.clear()
+                self.total = 0
+
+            interval = timestamp - self.last_timestamp
+            self.intervals.append(interval)
+            self.total += interval
+
+            if len(self.intervals) > self.window:
+                self.total -= self.intervals.popleft()
+
+        self.difficulty = difficulty
+        self.last_timestamp = timestamp
+
+    def next_difficulty(self):
+        """
+        :return: <int> Difficulty the block after the last one fed in has
+        to be mined at
+        """
+        if len(self.intervals) < self.window:
+            return self.difficulty
+
+        target_total = self.target_time * 1000 * self.window
+        if abs(self.total - target_total) <= self.margin * target_total:
+            return self.difficulty
+
+        # Blocks come too fast: positive step, too slow: negative
+        if self.total <= 0:
+            step = self.max_step
+        else:
+            step = round(log2(target_total / self.total))
+            step = max(-self.max_step, min(self.max_step, step))
+
+        # Outside the margin always moves at least one bit
+        if step == 0:
+            step = 1 if self.total < target_total else -1
+
+        return max(
+            self.min_difficulty, min(self.max_difficulty, self.difficulty + step)
+        )
@@ -0,0 +1,97 @@
+import hashlib
+
+from metrics import HASH_BUCKETS, Histogram, timed
+
+# Proofs are unsigned 64 bit integers, always hashed as 8 big-endian bytes
+NONCE_BYTES = 8
+MAX_NONCE = 2 ** (NONCE_BYTES * 8) - 1
+
+VALID_PROOF_SECONDS = Histogram(
+    "blockchain_valid_proof_seconds",
+    "Time spent checking single proofs",
+    HASH_BUCKETS,
+)
+
+
+class ProofHasher(object):
+    """
+    Hashes `header + proof` guesses for a single block.
+
+    The binary header never changes while mining, so it is fed to SHA-256
+    once and the resulting state is copied for every guess. Only the
+    fixed-width proof bytes get hashed per guess.
+    """
+
+    def __init__(self, header):
+        self.midstate = hashlib.sha256(header)
+
+    def digest(self, proof):
+        """
+        Raw SHA-256 digest of the header followed by `proof`
+        :param proof: <int> The nonce to append to the header
+        :return: <bytes> 32 byte digest
+        """
+        guess = self.midstate.copy()
+        guess.update(proof.to_bytes(NONCE_BYTES, "big"))
+
+        return guess.digest()
+
+    def valid(self, proof, zero_bits):
+        """
+        Does hash(header, proof) start with `zero_bits` zero bits?
+        :param proof: <int> The nonce to check
+        :param zero_bits: <int> Required number of leading zero bits
+        :return: True if the proof is valid, False otherwise
+        """
+        return has_leading_zero_bits(self.digest(proof), zero_bits)
+
+
+def has_leading_zero_bits(digest, zero_bits):
+    """
+    Checks a raw digest for leading zero bits without hex encoding it
+    :param digest: <bytes> Raw hash digest
+    :param zero_bits: <int> Required number of leading zero bits
+    :return: True if the digest starts with at least `zero_bits` zeroes
+    """
+    full_bytes, extra_bits = divmod(zero_bits, 8)
+
+    if digest[:full_bytes] != bytes(full_bytes):
+        return False
+
+    return extra_bits == 0 or digest[full_bytes] >> (8 - extra_bits) == 0
+
+
+def valid_nonce(proof):
+    """
+    Is `proof` something that can be hashed as a nonce?
+    Anything submitted from outside (floats, strings, negative or huge
+    numbers) has to pass this before it reaches a `ProofHasher`.
+    """
+    return (
+        isinstance(proof, int)
+        and not isinstance(proof, bool)
+        and 0 <= proof <= MAX_NONCE
+    )
+
+
+def target(zero_bits):
+    """
+    Numeric form of a difficulty: a digest read as a big-endian integer
+    must be below this value to have `zero_bits` leading zero bits
+    """
+    return 1 << (256 - zero_bits)
+
+
+@timed(VALID_PROOF_SECONDS)
+def valid_proof(header, proof, zero_bits):
+    """
+    One-off proof check for callers that only verify a single guess
+    :param header: <bytes> The binary block header
+    :param proof: <int> The nonce to check
+    :param zero_bits: <int> Required number of leading zero bits
+    :return: True if the proof is valid, False otherwise
+    """
+    if not valid_nonce(proof):
+        return False
+
+    return ProofHasher(header).valid(proof, zero_bits)
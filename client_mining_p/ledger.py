@@ -0,0 +1,290 @@
+import hashlib
+import math
+
+from collections import defaultdict
+
+from merkle import merkle_root
+from wire import encode
+
+# Sender used for coins created by mining rewards
+MINT_ADDRESS = "0"
+
+# Coins minted by every block, on top of the fees it collects
+BLOCK_REWARD = 5
+
+# Split rewards are rounded to this many decimal places
+REWARD_DECIMALS = 8
+
+
+def valid_amount(amount, allow_zero=False):
+    """
+    :param amount: An amount or fee from a request or a block
+    :param allow_zero: <bool> Accept 0, e.g. for fees
+    :return: True if it is a finite number above zero (or zero, if allowed)
+    """
+    if not isinstance(amount, (int, float)) or isinstance(amount, bool):
+        return False
+
+    if not math.isfinite(amount):
+        return False
+
+    return amount >= 0 if allow_zero else amount > 0
+
+
+def valid_rewards(transactions, reward=BLOCK_REWARD):
+    """
+    Checks the coins a block moves and creates. Its mining rewards come
+    first, from the mint, and together pay out at most the block reward
+    plus the fees of the block's other transactions
+    :param transactions: <list> The block's transactions
+    :param reward: The block reward
+    :return: True if the amounts add up, False otherwise
+    """
+    minted = []
+    fees = []
+    for tx in transactions:
+        if tx.sender == MINT_ADDRESS and not fees and valid_amount(tx.amount):
+            minted.append(tx.amount)
+        elif valid_amount(tx.amount) and valid_amount(tx.fee, allow_zero=True):
+            # Mint transactions after the rewards fail their signature check
+            fees.append(tx.fee)
+        else:
+            return False
+
+    # Split rewards are rounded, each may be off by a little
+    slack = len(minted) * 10**-REWARD_DECIMALS
+
+    return sum(minted) <= reward + sum(fees) + slack
+
+
+def canonical_amount(amount):
+    """
+    Balances add up floats in whatever order blocks were applied and
+    reverted, so they are rounded before being hashed, and whole numbers
+    are always ints
+    :param amount: An int or float balance
+    :return: The amount as every node hashes it
+    """
+    amount = round(amount, REWARD_DECIMALS)
+    if amount == int(amount):
+        return int(amount)
+
+    return amount
+
+
+def split_reward(total, weights):
+    """
+    Splits a block reward in proportion to each address's weight, e.g. its
+    shares in a mining pool
+    :param total: The whole reward, block reward plus fees
+    :param weights: <dict> Address -> weight
+    :return: <list> (address, amount) pairs, by address
+    """
+    if len(weights) == 1:
+        # Nothing to split, keep the amount exact
+        return [(address, total) for address in weights]
+
+    total_weight = sum(weights.values())
+
+    return [
+        (address, round(total * weights[address] / total_weight, REWARD_DECIMALS))
+        for address in sorted(weights)
+    ]
+
+
+class Ledger(object):
+    """
+    Per-address balances, transaction history and nonces.
+
+    Updated one block at a time as blocks are appended, so looking up a
+    balance never means walking the chain. History entries are
+    (block index, position in block) pairs, the transactions themselves
+    stay in the chain. Every transaction a sender signs carries the next
+    nonce of its sender, so a confirmed one can't be replayed, while
+    paying the same amount to the same address twice is still two
+    different transactions.
+
+    A ledger can also start from a snapshot of balances and nonces, in
+    which case it has no history for the blocks before it.
+    """
+
+    def __init__(self, balances=None, nonces=None):
+        self.balances = defaultdict(int, balances or {})
+        self.history = defaultdict(list)
+
+        # Address -> nonce of its next transaction, for addresses that
+        # have sent any. Mining rewards don't count
+        self.nonces = defaultdict(int, nonces or {})
+
+    def apply_block(self, block):
+        """
+        Adds every transaction in `block` to the balances and history
+        :param block: <Block> A block that was just appended to the chain
+        """
+        for position, tx in enumerate(block.transactions):
+            if tx.sender != MINT_ADDRESS:
+                self.balances[tx.sender] -= tx.amount + tx.fee
+                self.history[tx.sender].append((block.index, position))
+                self.nonces[tx.sender] += 1
+
+            self.balances[tx.recipient] += tx.amount
+
+            # Sending to yourself only shows up once
+            if tx.recipient != tx.sender:
+                self.history[tx.recipient].append((block.index, position))
+
+    def revert_block(self, block):
+        """
+        Undoes `apply_block` for a block that is being rolled back. Blocks
+        have to be reverted newest first
+        :param block: <Block> The last block applied
+        """
+        for tx in reversed(block.transactions):
+            if tx.recipient != tx.sender:
+                self.history[tx.recipient].pop()
+
+            self.balances[tx.recipient] -= tx.amount
+
+            if tx.sender != MINT_ADDRESS:
+                self.balances[tx.sender] += tx.amount + tx.fee
+                self.history[tx.sender].pop()
+
+                self.nonces[tx.sender] -= 1
+                if not self.nonces[tx.sender]:
+                    del self.nonces[tx.sender]
+
+    def admissible(self, transactions, pending=None, ahead=False):
+        """
+        Picks the transactions that can go on top of the confirmed state,
+        in order: each carrying the next nonce of its sender, counting
+        earlier ones, and none spending more than its sender has, counting
+        what earlier ones paid or spent
+        :param transactions: <list> Transactions, e.g. a block's
+        :param pending: (Optional) <dict> Address -> amount already spoken
+        for by transactions waiting in the mempool
+        :param ahead: <bool> Also accept nonces past the next one, for
+        transactions that can wait in the mempool for the ones before them
+        :return: <list> The ones that fit
+        """
+        changes = defaultdict(int)
+        if pending:
+            for address, amount in pending.items():
+                changes[address] -= amount
+
+        fitting = []
+        nonces = {}
+        for tx in transactions:
+            if tx.sender != MINT_ADDRESS:
+                expected = nonces.get(tx.sender, self.nonce(tx.sender))
+                if tx.nonce < expected or (tx.nonce > expected and not ahead):
+                    continue
+
+                cost = tx.amount + tx.fee
+                available = self.balance(tx.sender) + changes[tx.sender]
+                if canonical_amount(available - cost) < 0:
+                    continue
+
+                changes[tx.sender] -= cost
+                nonces[tx.sender] = tx.nonce + 1
+
+            changes[tx.recipient] += tx.amount
+            fitting.append(tx)
+
+        return fitting
+
+    def state_root(self):
+        """
+        Merkle root over every address with a non-zero balance or nonce.
+        Blocks commit to it so a snapshot can be checked against the chain
+        :return: <str> Hex root hash
+        """
+        balances = self.snapshot()
+        nonces = self.nonce_snapshot()
+
+        # Leaves are in hash order, addresses may not even be comparable
+        leaves = [
+            hashlib.sha256(
+                encode((address, balances.get(address, 0), nonces.get(address, 0)))
+            ).hexdigest()
+            for address in balances.keys() | nonces.keys()
+        ]
+        leaves.sort()
+
+        return merkle_root(leaves)
+
+    def snapshot(self):
+        """
+        :return: <dict> Address -> balance, for every non-zero balance
+        """
+        snapshot = {}
+        for address, amount in self.balances.items():
+            amount = canonical_amount(amount)
+            if amount:
+                snapshot[address] = amount
+
+        return snapshot
+
+    def prune_history(self, height):
+        """
+        Forgets the history of blocks up to `height`, whose transactions
+        are about to be pruned
+        :param height: <int> Index of the last block to forget
+        """
+        for address in list(self.history):
+            entries = self.history[address]
+
+            # Entries are in chain order, so the old ones are a prefix
+            keep = 0
+            while keep < len(entries) and entries[keep][0] <= height:
+                keep += 1
+
+            if keep == len(entries):
+                del self.history[address]
+            else:
+                del entries[:keep]
+
+    def nonce_snapshot(self):
+        """
+        :return: <dict> Address -> next nonce, for every address that has
+        sent anything
+        """
+        return dict(self.nonces)
+
+    def balance(self, address):
+        """
+        :param address: <str> Wallet address
+        :return: <int> Confirmed balance of `address`
+        """
+        return self.balances.get(address, 0)
+
+    def nonce(self, address):
+        """
+        :param address: <str> Wallet address
+        :return: <int> Nonce the next transaction from `address` has to carry
+        """
+        return self.nonces.get(address, 0)
+
+    def page(self, address, page, per_page):
+        """
+        One page of an address's history, newest first
+        :param address: <str> Wallet address
+        :param page: <int> 1-based page number
+        :param per_page: <int> Entries per page
+        :return: <list> (block index, position in block) pairs
+        """
+        entries = self.history.get(address, [])
+
+        end = len(entries) - (page - 1) * per_page
+        start = max(end - per_page, 0)
+
+        if end <= 0:
+            return []
+
+        return entries[start:end][::-1]
+
+    def count(self, address):
+        """
+        :param address: <str> Wallet address
+        :return: <int> Number of transactions involving `address`
+        """
+        return len(self.history.get(address, []))
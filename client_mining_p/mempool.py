@@ -0,0 +1,209 @@
+import heapq
+
+from collections import defaultdict
+from itertools import count
+
+from ledger import canonical_amount
+
+# Default limits for the pool itself
+MAX_POOL_TRANSACTIONS = 50000
+MAX_POOL_BYTES = 20000000
+
+# Default limits for a single block
+MAX_BLOCK_TRANSACTIONS = 1000
+MAX_BLOCK_BYTES = 500000
+
+
+class Mempool(object):
+    """
+    Transactions waiting to be put into a block.
+
+    * A dict keyed by transaction id drops duplicate submissions, and one
+      keyed by sender and nonce drops a second transaction for a nonce
+      that is already taken
+    * A max-heap on (fee, arrival) decides what goes into the next block
+    * A min-heap on the same key decides what gets evicted when the pool
+      is over `max_count` transactions or `max_bytes` bytes
+    * Per-sender totals of what the waiting transactions spend, so a new
+      one can be checked against what is left of the sender's balance
+
+    Both heaps use lazy deletion: entries for transactions that already
+    left the pool are skipped when they come up, and the heaps are
+    rebuilt once they are mostly stale entries.
+    """
+
+    def __init__(self, max_count=MAX_POOL_TRANSACTIONS, max_bytes=MAX_POOL_BYTES):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+
+        # txid -> (Transaction, size in bytes)
+        self.transactions = {}
+        self.size = 0
+
+        # Sender -> amount plus fee of its transactions in the pool
+        self.pending = defaultdict(int)
+
+        # Sender -> {nonce: txid} of its transactions in the pool
+        self.nonces = defaultdict(dict)
+
+        self.best = []
+        self.worst = []
+        self.arrivals = count()
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __contains__(self, txid):
+        return txid in self.transactions
+
+    def add(self, tx):
+        """
+        Adds a transaction to the pool, evicting the lowest fee ones if the
+        pool is full
+        :param tx: <Transaction> The transaction to add
+        :return: True if it was added, False if it was a duplicate, its
+        nonce is taken or its fee is too low to displace anything in a full
+        pool
+        """
+        txid = tx.txid()
+        if txid in self.transactions or tx.nonce in self.nonces.get(tx.sender, ()):
+            return False
+
+        size = len(tx.to_string())
+        if size > self.max_bytes:
+            # Wouldn't fit even in an empty pool
+            return False
+
+        arrival = next(self.arrivals)
+
+        # Find what would have to go before throwing anything out, so a
+        # transaction that can't get in leaves the pool as it was
+        evicted = []
+        left, room = len(self.transactions), self.max_bytes - self.size
+        while left >= self.max_count or size > room:
+            worst = self._peek(self.worst)
+            if (tx.fee, -arrival) <= (worst[0], worst[1]):
+                # Never make room by throwing out a better transaction
+                for entry in evicted:
+                    heapq.heappush(self.worst, entry)
+                return False
+
+            evicted.append(heapq.heappop(self.worst))
+            left -= 1
+            room += self.transactions[worst[2]][1]
+
+        for entry in evicted:
+            self._remove(entry[2])
+
+        self.transactions[txid] = (tx, size)
+        self.size += size
+        self.pending[tx.sender] += tx.amount + tx.fee
+        self.nonces[tx.sender][tx.nonce] = txid
+
+        heapq.heappush(self.best, (-tx.fee, arrival, txid))
+        heapq.heappush(self.worst, (tx.fee, -arrival, txid))
+
+        self._compact()
+
+        return True
+
+    def select(self, max_count=MAX_BLOCK_TRANSACTIONS, max_bytes=MAX_BLOCK_BYTES):
+        """
+        Takes the highest fee transactions, oldest first on equal fees, out
+        of the pool until the block is full
+        :param max_count: <int> Maximum transactions in the block
+        :param max_bytes: <int> Maximum bytes of transactions in the block
+        :return: <list> The chosen Transactions, best first, except that
+        each sender's own go in nonce order
+        """
+        chosen = []
+        skipped = []
+        room = max_bytes
+
+        while self.best and len(chosen) < max_count:
+            entry = heapq.heappop(self.best)
+            txid = entry[2]
+
+            if txid not in self.transactions:
+                # Stale entry, the transaction already left the pool
+                continue
+
+            tx, size = self.transactions[txid]
+            if size > room:
+                # Too big for what is left, a smaller one might still fit
+                skipped.append(entry)
+                continue
+
+            chosen.append(tx)
+            room -= size
+            self._remove(txid)
+
+        for entry in skipped:
+            heapq.heappush(self.best, entry)
+
+        self._compact()
+
+        # A later nonce may pay a higher fee, but can only be mined after
+        # the earlier ones, so each sender's transactions swap places
+        by_sender = defaultdict(list)
+        for tx in chosen:
+            by_sender[tx.sender].append(tx)
+        for transactions in by_sender.values():
+            transactions.sort(key=lambda tx: tx.nonce, reverse=True)
+
+        return [by_sender[tx.sender].pop() for tx in chosen]
+
+    def discard(self, txids):
+        """
+        Drops transactions that were mined elsewhere, if they are in the pool
+        :param txids: Iterable of transaction ids
+        """
+        for txid in txids:
+            if txid in self.transactions:
+                self._remove(txid)
+
+        self._compact()
+
+    def next_nonce(self, address):
+        """
+        :param address: <str> Wallet address
+        :return: <int> One past the highest nonce `address` has waiting,
+        0 if it has nothing waiting
+        """
+        nonces = self.nonces.get(address)
+
+        return max(nonces) + 1 if nonces else 0
+
+    def _peek(self, heap):
+        """
+        First live entry of `heap`, dropping stale ones on the way
+        """
+        while heap[0][2] not in self.transactions:
+            heapq.heappop(heap)
+
+        return heap[0]
+
+    def _remove(self, txid):
+        tx, size = self.transactions.pop(txid)
+        self.size -= size
+
+        # Float amounts may not add back up to exactly zero
+        self.pending[tx.sender] -= tx.amount + tx.fee
+        if canonical_amount(self.pending[tx.sender]) <= 0:
+            del self.pending[tx.sender]
+
+        del self.nonces[tx.sender][tx.nonce]
+        if not self.nonces[tx.sender]:
+            del self.nonces[tx.sender]
+
+    def _compact(self):
+        """
+        Rebuilds the heaps once they are mostly stale entries
+        """
+        if len(self.best) + len(self.worst) <= 4 * len(self.transactions) + 64:
+            return
+
+        self.best = [e for e in self.best if e[2] in self.transactions]
+        self.worst = [e for e in self.worst if e[2] in self.transactions]
+        heapq.heapify(self.best)
+        heapq.heapify(self.worst)
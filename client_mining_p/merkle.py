@@ -0,0 +1,76 @@
+import hashlib
+
+# Root of a block with no transactions
+EMPTY_ROOT = "0" * 64
+
+
+def _pair(left, right):
+    return hashlib.sha256(bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def _next_level(level):
+    # An odd node out is paired with itself
+    if len(level) % 2:
+        level = level + [level[-1]]
+
+    return [_pair(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+
+
+def merkle_root(txids):
+    """
+    Merkle root of a block's transaction ids
+    :param txids: <list> Hex transaction ids, in block order
+    :return: <str> Hex root hash
+    """
+    if not txids:
+        return EMPTY_ROOT
+
+    level = list(txids)
+    while len(level) > 1:
+        level = _next_level(level)
+
+    return level[0]
+
+
+def merkle_proof(txids, position):
+    """
+    Inclusion proof for one transaction: the sibling hash at every level
+    on the way up to the root
+    :param txids: <list> Hex transaction ids, in block order
+    :param position: <int> Position of the transaction in the block
+    :return: <list> [sibling hash, "left" or "right"] pairs, leaf first
+    """
+    proof = []
+
+    level = list(txids)
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+
+        sibling = position ^ 1
+        side = "left" if sibling < position else "right"
+        proof.append([level[sibling], side])
+
+        level = _next_level(level)
+        position //= 2
+
+    return proof
+
+
+def verify_merkle_proof(txid, proof, root):
+    """
+    Checks an inclusion proof from `merkle_proof`
+    :param txid: <str> Hex id of the transaction
+    :param proof: <list> [sibling hash, side] pairs, leaf first
+    :param root: <str> Merkle root from the block header
+    :return: True if the transaction is in the block, False otherwise
+    """
+    current = txid
+
+    for sibling, side in proof:
+        if side == "left":
+            current = _pair(sibling, current)
+        else:
+            current = _pair(current, sibling)
+
+    return current == root
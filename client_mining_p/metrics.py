@@ -0,0 +1,232 @@
+"""
+Counters, gauges and histograms served in the Prometheus text format.
+
+Metrics register themselves with `REGISTRY` when they are created, and
+`REGISTRY.render()` is what `/metrics` returns.
+
+Hot paths stay cheap:
+
+* Counters are one locked addition
+* Gauges are functions, only called when someone scrapes
+* Timings (`timed`, and request latencies) are only taken once the
+  registry has been scraped at least once. Until then a timed call costs
+  one attribute check, so a node nobody monitors doesn't pay for clocks
+"""
+
+import functools
+import threading
+
+from bisect import bisect_left
+from time import perf_counter
+
+# Content type of the text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, for request latencies. Long polls of /work take up to a minute
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Seconds, for single hashes and proof checks
+HASH_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 1e-3)
+
+
+class Registry(object):
+    """
+    Every metric of the process, in the order they were created
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+        # Set by the first `render`, timings are skipped until then
+        self.scraped = False
+
+    def register(self, metric):
+        with self.lock:
+            if any(m.name == metric.name for m in self.metrics):
+                raise ValueError(f"Duplicate metric {metric.name}")
+            self.metrics.append(metric)
+
+        return metric
+
+    def render(self):
+        """
+        :return: <str> Every metric in the Prometheus text format
+        """
+        self.scraped = True
+
+        lines = []
+        for metric in list(self.metrics):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _labels(names, values, extra=""):
+    """
+    :return: <str> `{name="value",...}`, or "" without labels
+    """
+    pairs = [
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"),
+        )
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """
+    A total that only goes up, optionally split by labels
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        """
+        :param name: <str> Metric name, ending in `_total` by convention
+        :param help: <str> One line description
+        :param labelnames: <tuple> Names of the labels `inc` is given values for
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+        self.values = {}
+        self.lock = threading.Lock()
+
+        registry.register(self)
+
+    def inc(self, amount=1, labels=()):
+        """
+        :param amount: <int> or <float> How much to add, never negative
+        :param labels: <tuple> One value per label name
+        """
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+
+        for labels, value in values:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Gauge(object):
+    """
+    A value read from `function` at scrape time, so keeping it up to date
+    costs nothing
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, function, registry=REGISTRY):
+        """
+        :param function: Called with no arguments, returns the current value
+        """
+        self.name = name
+        self.help = help
+        self.function = function
+
+        registry.register(self)
+
+    def samples(self):
+        yield f"{self.name} {_number(self.function())}"
+
+
+class Histogram(object):
+    """
+    Counts of observed values by bucket, plus their sum and count,
+    optionally split by labels
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labelnames=(), registry=REGISTRY):
+        """
+        :param buckets: <tuple> Upper bounds, increasing. +Inf is implied
+        """
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+
+        # Label values -> [per-bucket counts (not cumulative), sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+        registry.register(self)
+
+    def observe(self, value, labels=()):
+        """
+        :param value: <float> The observation, e.g. seconds taken
+        :param labels: <tuple> One value per label name
+        """
+        bucket = bisect_left(self.buckets, value)
+
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+
+            entry[0][bucket] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted(
+                (labels, list(counts), total)
+                for labels, (counts, total) in self.values.items()
+            )
+
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{_number(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+
+            label_string = _labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_string} {_number(total)}"
+            yield f"{self.name}_count{label_string} {cumulative}"
+
+
+def timed(histogram):
+    """
+    Decorator recording how long each call takes in `histogram`, once its
+    registry has been scraped
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not histogram.registry.scraped:
+                return fn(*args, **kwargs)
+
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start)
+
+        return wrapper
+
+    return decorator
@@ -1,52 +1,284 @@
-import hashlib
+import argparse
 import requests
 import random
 
-import sys
-import json
+from multiprocessing import Event, Process, Queue, cpu_count
+from threading import Thread
+from time import sleep, time
 
-from time import time
+from block import header_bytes
+from hashing import ProofHasher, target
+from node_client import NodeClient, NodeUnavailable
+from wire import MIMETYPE, Reader, encode
 
+# Size of the contiguous nonce range handed to each worker
+NONCE_RANGE = 2**32
+# How many guesses a worker makes between checks of the stop flag
+CHECK_INTERVAL = 1 << 14
 
-def proof_of_work(block, difficulty):
+
+def proof_of_work(header, difficulty, workers=None, stop=None):
     """
-    Simple Proof of Work Algorithm
-    Stringify the block and look for a proof.
-    Loop through possibilities, checking each one against `valid_proof`
-    in an effort to find a number that is a valid proof
-    :return: A valid proof for the provided block
+    Multi-process Proof of Work Algorithm
+    Split the nonce space into one contiguous range per worker process.
+    Every worker checks its own range against `valid_proof`, and as soon
+    as one of them finds a valid proof all of the others are told to stop.
+    :param header: <bytes> Binary header of the last block in the chain
+    :param difficulty: <int> Required number of leading zero bits
+    :param workers: <int> Number of worker processes (defaults to cpu count)
+    :param stop: (Optional) <multiprocessing.Event> Set it to abandon the
+    search, e.g. because someone else already mined this block
+    :return: A valid proof for the provided block, or None if the search
+    was stopped or the whole nonce space handed out was exhausted
     """
-    block_string = json.dumps(block, sort_keys=True)
+    workers = workers or cpu_count()
+
+    # Random base so separate miners don't search the same nonces
+    base = random.getrandbits(62)
+
+    found = stop if stop is not None else Event()
+    results = Queue()
+
+    processes = [
+        Process(
+            target=_search,
+            args=(
+                header,
+                difficulty,
+                base + i * NONCE_RANGE,
+                base + (i + 1) * NONCE_RANGE,
+                found,
+                results,
+            ),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+
+    for process in processes:
+        process.start()
+
     proof = None
+    try:
+        # Every worker reports exactly once: a proof or None when exhausted
+        for _ in range(workers):
+            proof = results.get()
+            if proof is not None:
+                break
+    finally:
+        # Stop the remaining workers
+        found.set()
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
 
-    while not valid_proof(block_string, proof, difficulty):
-        proof = random.random()
     return proof
 
 
-def valid_proof(block_string, proof, difficulty):
+def _search(header, difficulty, start, stop, found, results):
+    """
+    Worker loop for `proof_of_work`
+    Tries every nonce in [start, stop) until a valid proof is found or
+    `found` is set by another worker (or because the work went stale).
+    """
+    # Hash the header once, every guess reuses that state. Comparing the
+    # digest as a number is cheaper than counting its zero bits
+    digest = ProofHasher(header).digest
+    threshold = target(difficulty)
+
+    for proof in range(start, stop):
+        # Only look at the shared flag every so often, it's not free
+        if proof % CHECK_INTERVAL == 0 and found.is_set():
+            break
+
+        if int.from_bytes(digest(proof), "big") < threshold:
+            results.put(proof)
+            return
+
+    results.put(None)
+
+
+def find_shares(header, share_difficulty, start, end, workers=None, stop=None):
+    """
+    Pool mining: searches the nonce range the pool assigned for shares,
+    split over worker processes, and yields every share as it is found
+    :param header: <bytes> Binary header of the last block in the chain
+    :param share_difficulty: <int> Leading zero bits a share needs
+    :param start: <int> First nonce of our range
+    :param end: <int> End of our range
+    :param workers: <int> Number of worker processes (defaults to cpu count)
+    :param stop: (Optional) <multiprocessing.Event> Set it to end the search
+    """
+    workers = workers or cpu_count()
+    stop = stop if stop is not None else Event()
+    results = Queue()
+
+    step = (end - start) // workers
+    processes = [
+        Process(
+            target=_search_shares,
+            args=(
+                header,
+                share_difficulty,
+                start + i * step,
+                start + (i + 1) * step,
+                stop,
+                results,
+            ),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+
+    for process in processes:
+        process.start()
+
+    try:
+        # Each worker sends None once it stops
+        running = workers
+        while running:
+            proof = results.get()
+            if proof is None:
+                running -= 1
+            else:
+                yield proof
+    finally:
+        stop.set()
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+
+def _search_shares(header, difficulty, start, stop, found, results):
+    """
+    Worker loop for `find_shares`, like `_search` but it keeps going after
+    a hit until `found` is set
+    """
+    digest = ProofHasher(header).digest
+    threshold = target(difficulty)
+
+    for proof in range(start, stop):
+        if proof % CHECK_INTERVAL == 0 and found.is_set():
+            break
+
+        if int.from_bytes(digest(proof), "big") < threshold:
+            results.put(proof)
+
+    results.put(None)
+
+
+def pool_mine(client, miner_id, workers):
     """
-    Validates the Proof:  Does hash(block_string, proof) contain 6
-    leading zeroes?  Return true if the proof is valid
-    :param block_string: <string> The stringified block to use to
-    check in combination with `proof`
-    :param proof: <int?> The value that when combined with the
-    stringified previous block results in a hash that has the
-    correct number of leading zeroes.
-    :return: True if the resulting hash is a valid proof, False otherwise
+    Mines for the node's pool forever: every share found is submitted,
+    and the pool pays out in proportion to them
     """
-    guess = f"{block_string}{proof}".encode()
-    guess_hash = hashlib.sha256(guess).hexdigest()
+    while True:
+        try:
+            node, work = client.get("/pool/work", params={"id": miner_id})
+        except NodeUnavailable as e:
+            print(f"Error:  {e}")
+            sleep(5)
+            continue
+
+        stop = Event()
+        watcher = Thread(
+            target=watch_work,
+            args=(client, node, work["tip"], work["difficulty"], stop),
+            daemon=True,
+        )
+        watcher.start()
+
+        accepted = 0
+        start_time = time()
+        shares = find_shares(
+            header_bytes(work["block"]),
+            work["share_difficulty"],
+            work["nonce_start"],
+            work["nonce_end"],
+            workers,
+            stop,
+        )
+        for proof in shares:
+            post_data = {"id": miner_id, "proof": proof, "tip": work["tip"]}
+            try:
+                # Shares only count with the node that handed out the work
+                _, data = client.post("/pool/share", json=post_data, nodes=[node])
+            except NodeUnavailable as e:
+                print(f"Error:  {e}")
+                continue
+
+            status = data.get("status")
+            if status in ("share", "block"):
+                accepted += 1
+            if status == "block":
+                print("Found a block for the pool!")
+            elif status == "stale":
+                break
 
-    return guess_hash[:difficulty] == "0" * difficulty
+        stop.set()
+        shares.close()
+
+        # Every share stands for 2 ** share_difficulty guesses on average
+        elapsed = time() - start_time
+        hash_rate = accepted * 2 ** work["share_difficulty"] / max(elapsed, 1e-9)
+        print(
+            f"{accepted} shares accepted in {elapsed:.1f}s "
+            f"(~{hash_rate / 1000:.0f} kH/s)"
+        )
+
+
+def watch_work(client, node, tip, difficulty, stop):
+    """
+    Long-polls a node's /work endpoint in the background and sets `stop`
+    as soon as the tip or difficulty being mined on is out of date
+    :param client: <NodeClient> Client whose connection pool to use
+    :param node: <str> URL of the node the work came from
+    :param tip: <str> Hash of the block being mined on
+    :param difficulty: <int> Difficulty being mined at
+    :param stop: <multiprocessing.Event> Stop flag of the current search
+    """
+    params = {"tip": tip, "difficulty": difficulty, "timeout": 30}
+
+    while not stop.is_set():
+        try:
+            r = client.session.get(
+                url=node + "/work", params=params, timeout=(3.05, 40)
+            )
+            data = r.json()
+        except (requests.RequestException, ValueError):
+            # Can't tell, keep mining on what we have
+            return
+
+        if data["tip"] != tip or data["difficulty"] != difficulty:
+            stop.set()
+            return
+
+        # The node had no thread to spare for holding the request open
+        retry_after = r.headers.get("Retry-After")
+        if retry_after is not None:
+            stop.wait(float(retry_after))
 
 
 if __name__ == "__main__":
-    # What is the server address? IE `python3 miner.py https://server.com/api/`
-    if len(sys.argv) > 1:
-        node = sys.argv[1]
-    else:
-        node = "http://localhost:5000"
+    # What are the server addresses?
+    # IE `python3 miner.py https://one.com/api/ https://two.com/api/`
+    parser = argparse.ArgumentParser(description="Mine blocks for a node")
+    parser.add_argument(
+        "nodes", nargs="*", default=["http://localhost:5000"], help="Node URLs"
+    )
+    # How many worker processes to mine with? Defaults to one per core
+    parser.add_argument("--workers", type=int, default=cpu_count())
+    parser.add_argument(
+        "--timeout", type=float, default=10, help="Seconds to wait for a node"
+    )
+    # Share the work (and the rewards) with other miners in the node's pool
+    parser.add_argument("--pool", action="store_true", help="Mine in pool mode")
+    args = parser.parse_args()
+
+    client = NodeClient(args.nodes, timeout=(3.05, args.timeout))
+    workers = args.workers
 
     # Load ID
     f = open("my_id.txt", "r")
@@ -54,44 +286,80 @@ if __name__ == "__main__":
     print("ID is", id)
     f.close()
 
+    if args.pool:
+        pool_mine(client, id, workers)
+
     mining_difficulty = None
     coins_mined = 0
 
     # Run forever until interrupted
     while True:
-        r = requests.get(url=node + "/last_block")
-        # Handle non-json response
         try:
-            data = r.json()
+            # Binary work: the tip hash, difficulty and target, followed
+            # by the header to hash exactly as it comes
+            node, body = client.get(
+                "/last_block", headers={"Accept": MIMETYPE}, raw=True
+            )
+            reader = Reader(body)
+            tip, difficulty, _ = reader.values(3)
+        except NodeUnavailable as e:
+            # Every node is down, wait a bit and try again
+            print(f"Error:  {e}")
+            sleep(5)
+            continue
         except ValueError:
-            print("Error:  Non-json response")
-            print("Response returned:")
-            print(r)
-            break
+            print("Error:  Malformed work from the node")
+            sleep(5)
+            continue
 
         # Grab block data
-        last_block = data["block"]
+        last_header = body[reader.position :]
         # Store previous difficulty
         prev_difficulty = mining_difficulty
         # Get new difficulty
-        mining_difficulty = data["difficulty"]
+        mining_difficulty = difficulty
 
         if mining_difficulty != prev_difficulty:
             print(f"Difficulty changed from {prev_difficulty} to {mining_difficulty}")
 
+        # Abandon the search as soon as the node has moved on
+        stop = Event()
+        watcher = Thread(
+            target=watch_work,
+            args=(client, node, tip, mining_difficulty, stop),
+            daemon=True,
+        )
+        watcher.start()
+
         start_time = time()
-        new_proof = proof_of_work(last_block, mining_difficulty)
+        new_proof = proof_of_work(last_header, mining_difficulty, workers, stop)
         end_time = time()
 
-        print(f"Found hash in {end_time - start_time} seconds")
+        # Also tells the watcher to quit
+        stop.set()
 
-        # When found, POST it to the server {"proof": new_proof, "id": id}
-        post_data = {"proof": new_proof, "id": id}
+        if new_proof is None:
+            print("Work went stale, fetching new work")
+            continue
+
+        # A proof takes 2 ** difficulty guesses on average, so this is a
+        # rough estimate that evens out over many blocks
+        elapsed = end_time - start_time
+        hash_rate = 2**mining_difficulty / max(elapsed, 1e-9)
+        print(f"Found hash in {elapsed} seconds (~{hash_rate / 1000:.0f} kH/s)")
+
+        # When found, POST it to the server as binary: the id, then the proof
+        post_data = encode((id, new_proof))
 
         # print(post_data)
 
-        r = requests.post(url=node + "/mine", json=post_data)
-        data = r.json()
+        try:
+            node, data = client.post(
+                "/mine", data=post_data, headers={"Content-Type": MIMETYPE}
+            )
+        except NodeUnavailable as e:
+            print(f"Error:  {e}")
+            continue
         # print(data)
 
         if "success" in data:
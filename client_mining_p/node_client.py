@@ -0,0 +1,115 @@
+import random
+import requests
+
+from collections import defaultdict
+from time import sleep, time
+
+from requests.adapters import HTTPAdapter
+
+
+class NodeUnavailable(Exception):
+    """
+    No node gave a usable answer, even after retrying
+    """
+
+
+class NodeClient(object):
+    """
+    Keep-alive HTTP client for one or more nodes.
+
+    * One `requests.Session`, so connections are pooled and reused
+    * Every request has a (connect, read) timeout
+    * Nodes are tried fastest first, by a moving average of their response
+      times, and nodes that just failed go to the back of the line
+    * When every node fails, the whole round is retried with exponential
+      backoff and jitter
+    """
+
+    def __init__(
+        self,
+        nodes,
+        timeout=(3.05, 10),
+        retries=5,
+        backoff=0.5,
+        max_backoff=30,
+        pool_size=10,
+    ):
+        self.nodes = [node.rstrip("/") for node in nodes]
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max(len(self.nodes), 1), pool_maxsize=pool_size
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Moving average response time and consecutive failures, per node
+        self.latency = defaultdict(float)
+        self.failures = defaultdict(int)
+
+    def ranked_nodes(self, nodes=None):
+        """
+        :param nodes: (Optional) <list> Nodes to rank, defaults to all of them
+        :return: <list> Nodes, healthy and fast ones first
+        """
+        return sorted(
+            nodes if nodes is not None else self.nodes,
+            key=lambda node: (self.failures[node], self.latency[node]),
+        )
+
+    def request(
+        self, method, path, timeout=None, retries=None, nodes=None, raw=False, **kwargs
+    ):
+        """
+        Sends a request to the best node that answers
+        :param method: <str> HTTP method
+        :param path: <str> Path on the node, e.g. "/last_block"
+        :param timeout: (Optional) Override the client's timeout
+        :param retries: (Optional) Override the client's number of rounds
+        :param nodes: (Optional) <list> Nodes to try, in this order, instead
+        of every node ranked by health and speed
+        :param raw: <bool> Return the body as bytes instead of decoding JSON,
+        for binary responses
+        :return: (node, decoded JSON body, or raw body if `raw`)
+        :raises NodeUnavailable: if every node failed on every round
+        """
+        timeout = timeout or self.timeout
+        retries = retries or self.retries
+
+        for attempt in range(retries):
+            for node in nodes if nodes is not None else self.ranked_nodes():
+                start = time()
+                try:
+                    r = self.session.request(
+                        method, node + path, timeout=timeout, **kwargs
+                    )
+                    # Client errors are our own fault, another node won't help
+                    if r.status_code >= 500:
+                        raise requests.HTTPError(f"{r.status_code} from {node}")
+
+                    data = r.content if raw else r.json()
+                except (requests.RequestException, ValueError):
+                    self.failures[node] += 1
+                    continue
+
+                elapsed = time() - start
+                self.latency[node] = 0.8 * self.latency[node] + 0.2 * elapsed
+                self.failures[node] = 0
+
+                return node, data
+
+            if attempt < retries - 1:
+                delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                sleep(delay * random.uniform(0.5, 1.5))
+
+        raise NodeUnavailable(f"No node answered {method} {path}")
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
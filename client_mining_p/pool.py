@@ -0,0 +1,160 @@
+import threading
+
+from collections import Counter
+
+from hashing import NONCE_BYTES, ProofHasher, has_leading_zero_bits, valid_nonce
+
+# Shares are this many bits easier than a block, so a pool finds about
+# 2 ** SHARE_DIFFICULTY_GAP shares per block
+SHARE_DIFFICULTY_GAP = 6
+
+# Shares never get easier than this, or miners would flood the pool
+MIN_SHARE_DIFFICULTY = 8
+
+# Each miner searches 2 ** NONCE_RANGE_BITS nonces on its own, the higher
+# bits of a nonce (its extranonce) say whose range it is in
+NONCE_RANGE_BITS = 40
+
+# What `Pool.submit` thought of a share
+SHARE = "share"
+BLOCK = "block"
+STALE = "stale"
+DUPLICATE = "duplicate"
+INVALID = "invalid"
+
+
+class Pool(object):
+    """
+    Pool mode: the work of finding the next block is split among many
+    miners instead of each one racing alone.
+
+    * Every miner is handed its own nonce range, so no two miners ever
+      hash the same guesses
+    * Miners submit shares: proofs that meet a share difficulty a few bits
+      below the block's. Checking one costs a single hash from a cached
+      midstate, and how many a miner finds shows how much it hashed
+    * A share that also meets the block difficulty forges the block, and
+      the reward is split among the round's shares, in proportion
+    """
+
+    def __init__(
+        self,
+        share_gap=SHARE_DIFFICULTY_GAP,
+        min_share_difficulty=MIN_SHARE_DIFFICULTY,
+        range_bits=NONCE_RANGE_BITS,
+    ):
+        self.share_gap = share_gap
+        self.min_share_difficulty = min_share_difficulty
+        self.range_bits = range_bits
+
+        # Miner id -> first nonce of its range
+        self.ranges = {}
+        self.next_range = 0
+
+        # Shares per miner since the pool last found a block
+        self.shares = Counter()
+
+        # Proofs already submitted for the current tip, and its midstate
+        self.tip_hash = None
+        self.hasher = None
+        self.seen = set()
+
+        self.lock = threading.Lock()
+
+    def share_difficulty(self, difficulty):
+        """
+        :param difficulty: <int> Block difficulty
+        :return: <int> Leading zero bits a share needs
+        """
+        share_difficulty = max(difficulty - self.share_gap, self.min_share_difficulty)
+
+        return min(share_difficulty, difficulty)
+
+    def assign(self, miner_id):
+        """
+        Hands out a nonce range, the same one every time for the same miner
+        :param miner_id: <str> Miner id, also its payout address
+        :return: (first nonce, end of range) of the miner's range
+        """
+        with self.lock:
+            start = self.ranges.get(miner_id)
+
+            if start is None:
+                start = self.next_range << self.range_bits
+                self.ranges[miner_id] = start
+
+                # Wrap around once every extranonce is taken
+                ranges = 1 << (NONCE_BYTES * 8 - self.range_bits)
+                self.next_range = (self.next_range + 1) % ranges
+
+        return start, start + (1 << self.range_bits)
+
+    def submit(self, miner_id, proof, tip_hash, snapshot):
+        """
+        Checks a share and credits it to the miner
+        :param miner_id: <str> The miner's id
+        :param proof: <int> The share's nonce
+        :param tip_hash: <str> Hash of the block the miner was mining on
+        :param snapshot: The node's current tip snapshot
+        :return: <str> BLOCK if the share is also a valid proof for the next
+        block, SHARE if it only counts as a share, else STALE, DUPLICATE
+        or INVALID
+        """
+        if tip_hash != snapshot.hash:
+            return STALE
+
+        start = self.ranges.get(miner_id)
+        if start is None or not valid_nonce(proof):
+            return INVALID
+
+        # Only the miner's own range counts, nobody gets paid for another's
+        if not start <= proof < start + (1 << self.range_bits):
+            return INVALID
+
+        with self.lock:
+            if self.tip_hash != snapshot.hash:
+                self.tip_hash = snapshot.hash
+                self.hasher = ProofHasher(snapshot.header_bytes)
+                self.seen = set()
+
+            if proof in self.seen:
+                return DUPLICATE
+
+            hasher = self.hasher
+
+        digest = hasher.digest(proof)
+        if not has_leading_zero_bits(
+            digest, self.share_difficulty(snapshot.difficulty)
+        ):
+            return INVALID
+
+        with self.lock:
+            # Another thread may have credited the same proof meanwhile
+            if self.tip_hash != snapshot.hash or proof in self.seen:
+                return DUPLICATE
+
+            self.seen.add(proof)
+            self.shares[miner_id] += 1
+
+        if has_leading_zero_bits(digest, snapshot.difficulty):
+            return BLOCK
+
+        return SHARE
+
+    def round_shares(self):
+        """
+        :return: <dict> Miner id -> shares so far in the current round
+        """
+        with self.lock:
+            return dict(self.shares)
+
+    def take_round(self):
+        """
+        Ends the current round, the pool just found a block
+        :return: <dict> Miner id -> shares in the round
+        """
+        with self.lock:
+            shares = dict(self.shares)
+            self.shares.clear()
+
+        return shares
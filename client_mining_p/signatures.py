@@ -0,0 +1,196 @@
+import hashlib
+import threading
+
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+
+from ecdsa import SECP256k1, BadSignatureError, SigningKey, VerifyingKey
+from ecdsa.errors import MalformedPointError
+from ecdsa.util import sigdecode_string, sigencode_string_canonize
+
+from ledger import MINT_ADDRESS
+
+# Below this many uncached signatures a batch is checked in-process
+PARALLEL_THRESHOLD = 64
+
+# Verification results remembered, by transaction id
+CACHE_SIZE = 100000
+
+
+def generate_keypair():
+    """
+    :return: (private key, address) as hex strings. The address is the
+    compressed public key
+    """
+    private_key = SigningKey.generate(curve=SECP256k1)
+    address = private_key.verifying_key.to_string("compressed").hex()
+
+    return private_key.to_string().hex(), address
+
+
+def sign(private_key, message):
+    """
+    :param private_key: <str> Hex private key from `generate_keypair`
+    :param message: <bytes> What to sign
+    :return: <str> Hex signature, deterministic and in low-s form
+    """
+    key = SigningKey.from_string(bytes.fromhex(private_key), curve=SECP256k1)
+    signature = key.sign_deterministic(
+        message,
+        hashfunc=hashlib.sha256,
+        sigencode=sigencode_string_canonize,
+    )
+
+    return signature.hex()
+
+
+def verify(address, message, signature):
+    """
+    :param address: <str> Hex compressed public key
+    :param message: <bytes> What was signed
+    :param signature: <str> Hex signature
+    :return: True if `address` signed `message`, False otherwise
+    """
+    try:
+        key = VerifyingKey.from_string(bytes.fromhex(address), curve=SECP256k1)
+        raw_signature = bytes.fromhex(signature)
+
+        # Only the low-s form counts, otherwise anyone could flip a
+        # signature into a second valid one and change the txid
+        _, s = sigdecode_string(raw_signature, SECP256k1.order)
+        if s > SECP256k1.order // 2:
+            return False
+
+        return key.verify(raw_signature, message, hashfunc=hashlib.sha256)
+    except (BadSignatureError, MalformedPointError, ValueError, TypeError):
+        return False
+
+
+def sign_transaction(tx, private_key):
+    """
+    Signs a transaction in place
+    :param tx: <Transaction> Transaction from the key's address
+    :param private_key: <str> Hex private key
+    """
+    tx.signature = sign(private_key, tx.signing_bytes())
+
+
+def verify_transaction(tx):
+    """
+    :param tx: <Transaction> A transaction someone submitted
+    :return: True if the sender signed it. Nobody can sign for the mint
+    """
+    if tx.sender == MINT_ADDRESS or not tx.signature:
+        return False
+
+    return verify(tx.sender, tx.signing_bytes(), tx.signature)
+
+
+def block_signed(transactions, verifier=None):
+    """
+    Checks the transactions of a block: mining rewards come first and are
+    minted, everything after them has to be signed by its sender
+    :param transactions: <list> The block's transactions
+    :param verifier: (Optional) <SignatureVerifier> Checks them in a batch,
+    with its cache, instead of one at a time
+    :return: True if every transaction is allowed, False otherwise
+    """
+    rewards = 0
+    for tx in transactions:
+        if tx.sender != MINT_ADDRESS:
+            break
+        rewards += 1
+
+    signed = transactions[rewards:]
+    if verifier is not None:
+        return all(verifier.verify(signed))
+
+    return all(verify_transaction(tx) for tx in signed)
+
+
+def _verify_task(task):
+    return verify(*task)
+
+
+class SignatureVerifier(object):
+    """
+    Checks transaction signatures in batches.
+
+    Signature checks are the expensive part of accepting a transaction, so
+    every result is remembered by txid: a transaction checked when it was
+    submitted costs nothing when it shows up again in a block. Uncached
+    signatures in a large batch are spread over a process pool once
+    `start` has been called, and checked in-process until then.
+    """
+
+    def __init__(self, workers=None, cache_size=CACHE_SIZE):
+        self.workers = workers or cpu_count()
+        self.cache_size = cache_size
+
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def start(self):
+        """
+        Starts the process pool. Until then transactions are checked in
+        the calling thread. Same rules as `validation.start_pool` for when
+        to call it
+        """
+        if self.pool is None:
+            self.pool = Pool(self.workers)
+
+    def verify(self, transactions):
+        """
+        :param transactions: <list> Transactions to check
+        :return: <list> True or False for each transaction, in order
+        """
+        results = [None] * len(transactions)
+        pending = []
+
+        with self.lock:
+            for i, tx in enumerate(transactions):
+                txid = tx.txid()
+                if txid in self.cache:
+                    self.cache.move_to_end(txid)
+                    results[i] = self.cache[txid]
+                else:
+                    pending.append((i, txid, tx))
+
+        checked = self._check([tx for _, _, tx in pending])
+
+        with self.lock:
+            for (i, txid, _), valid in zip(pending, checked):
+                results[i] = valid
+                self.cache[txid] = valid
+
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return results
+
+    def _check(self, transactions):
+        # The mint has no key, and unsigned transactions need no math
+        tasks = [
+            (tx.sender, tx.signing_bytes(), tx.signature)
+            for tx in transactions
+            if tx.sender != MINT_ADDRESS and tx.signature
+        ]
+
+        if len(tasks) < PARALLEL_THRESHOLD or self.pool is None:
+            valid = map(_verify_task, tasks)
+        else:
+            chunksize = max(1, len(tasks) // (self.workers * 4))
+            valid = iter(self.pool.map(_verify_task, tasks, chunksize))
+
+        valid = iter(valid)
+
+        return [
+            next(valid) if tx.sender != MINT_ADDRESS and tx.signature else False
+            for tx in transactions
+        ]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
@@ -0,0 +1,129 @@
+import json
+import os
+
+from collections import namedtuple
+
+from ledger import valid_amount
+
+# Every block right after a multiple of this many blocks commits to the
+# balances before it
+SNAPSHOT_INTERVAL = 1000
+
+# Snapshots kept in memory, the latest one may still be rolled back
+KEEP_SNAPSHOTS = 2
+
+# Balances and nonces as of the end of block `height` (whose hash
+# is `hash`), the state root block `height + 1` commits to, and the
+# cumulative work of the chain up to `height` (None if unknown)
+Snapshot = namedtuple(
+    "Snapshot", ["height", "hash", "state_root", "balances", "nonces", "work"]
+)
+
+
+def is_snapshot_height(height, interval=SNAPSHOT_INTERVAL):
+    """
+    :param height: <int> Index of a block
+    :return: True if the balances after this block get committed to
+    """
+    return height > 0 and height % interval == 0
+
+
+def to_json(snapshot):
+    """
+    :return: <dict> JSON-ready form. Balances and nonces go as pairs, so
+    addresses keep their type
+    """
+    return {
+        "height": snapshot.height,
+        "hash": snapshot.hash,
+        "state_root": snapshot.state_root,
+        "balances": sorted(snapshot.balances.items(), key=str),
+        "nonces": sorted(snapshot.nonces.items(), key=str),
+        "work": snapshot.work,
+    }
+
+
+def from_json(data):
+    """
+    :raises ValueError: if `data` isn't a snapshot
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Not a snapshot")
+
+    try:
+        height = data["height"]
+        block_hash = data["hash"]
+        state_root = data["state_root"]
+        balances = _pairs(data["balances"], valid_amount)
+        nonces = _pairs(data["nonces"], _valid_nonce)
+    except KeyError as e:
+        raise ValueError(f"Missing {e}")
+
+    if not _valid_count(height):
+        raise ValueError("Bad height")
+    if not isinstance(block_hash, str) or not isinstance(state_root, str):
+        raise ValueError("Bad hash")
+
+    work = data.get("work")
+    if work is not None and not _valid_count(work):
+        raise ValueError("Bad work")
+
+    return Snapshot(height, block_hash, state_root, balances, nonces, work)
+
+
+def _pairs(items, valid):
+    """
+    :return: <dict> Address -> value, from a list of [address, value] pairs
+    :raises ValueError: unless every address is a string and every value
+    passes `valid`
+    """
+    if not isinstance(items, list):
+        raise ValueError("Not a list of pairs")
+
+    pairs = {}
+    for item in items:
+        if not isinstance(item, list) or len(item) != 2:
+            raise ValueError("Not a pair")
+
+        address, value = item
+        if not isinstance(address, str) or not valid(value):
+            raise ValueError(f"Bad entry for {address!r}")
+
+        pairs[address] = value
+
+    return pairs
+
+
+def _valid_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _valid_nonce(value):
+    # Addresses that never sent anything are left out
+    return _valid_count(value) and value > 0
+
+
+def save_snapshot(path, snapshot):
+    """
+    Writes a snapshot to `path`. The old file is only replaced once the
+    new one is fully on disk
+    """
+    temporary = path + ".tmp"
+
+    with open(temporary, "w") as f:
+        json.dump(to_json(snapshot), f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(temporary, path)
+
+
+def load_snapshot(path):
+    """
+    :return: <Snapshot> The snapshot saved at `path`, or None if there is none
+    """
+    try:
+        with open(path) as f:
+            return from_json(json.load(f))
+    except FileNotFoundError:
+        return None
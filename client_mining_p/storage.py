@@ -0,0 +1,398 @@
+import json
+import mmap
+import os
+import struct
+import threading
+
+from collections import OrderedDict
+from collections.abc import Sequence
+
+# One index record per block: data offset, data length, block hash, proof
+INDEX_RECORD = struct.Struct("<QI32sQ")
+
+# Present while a rewrite is being moved into place
+REWRITE_MARKER = "rewrite.done"
+
+
+class DataMap(object):
+    """
+    One blocks.dat file and the latest memory map of it. A rewrite starts
+    a new one, so offsets from an index are only ever read against the
+    file they were written for
+    """
+
+    def __init__(self, data_file):
+        self.data_file = data_file
+        self.map = None
+
+    def read(self, start, end):
+        """
+        :return: <bytes> The file's bytes from `start` to `end`
+        """
+        # Work on a local reference, another reader may swap self.map
+        block_map = self.map
+        if block_map is None or end > len(block_map):
+            block_map = self._remap()
+
+        return block_map[start:end]
+
+    def _remap(self):
+        """
+        Maps the whole file as it is now. The old mapping is left for the
+        garbage collector, a concurrent reader may still hold it
+        """
+        # Written bytes have to reach the file before they can be mapped
+        self.data_file.flush()
+        self.map = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self.map
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class BlockStore(Sequence):
+    """
+    Append-only on-disk storage for canonical block strings.
+
+    Two files live in `path`:
+    * blocks.dat - block strings, back to back, never overwritten
+    * blocks.idx - one fixed-size `INDEX_RECORD` per block
+
+    The index also carries each block's hash and proof, so a node can
+    rebuild its lookup tables from the index alone without decoding a
+    single block. Reads go through a memory map of blocks.dat, and
+    fsyncs are batched every `sync_every` appends.
+
+    One thread appends while any number of others read: a block only
+    becomes visible once its offset is recorded, and nothing closes a
+    mapping or file a reader might still be using. Old ones are left for
+    the garbage collector. Readers take the offsets, lengths and data map
+    from `view` in one go, so they never mix an old index with a new file.
+
+    `truncate` only cuts the index, and `replace` appends new data for
+    blocks that already have some, e.g. pruned down to their headers. The
+    bytes either leaves behind stay in blocks.dat (where a reader may
+    still be looking at them) until `rewrite` swaps in new contents for
+    both files, which `replace` does once they are most of the file.
+    """
+
+    def __init__(self, path, sync_every=64):
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.sync_every = sync_every
+        self.unsynced = 0
+
+        # Where the next block's data goes. Past the end of every block's
+        # data after a truncate
+        self.data_size = 0
+
+        # (offsets, lengths, DataMap), filled in by `_load_index`. Appends
+        # and truncates change the lists in place, anything that moves a
+        # block's data publishes a new tuple
+        self.view = ([], [], None)
+
+        # Also filled in by `_load_index`. Only ever changed in place, so
+        # a Blockchain can hold on to `hashes` across a rewrite
+        self.hashes = []
+        self.proofs = []
+
+        self._finish_rewrite()
+        self._open_files()
+
+    def _open_files(self):
+        """
+        Opens (or reopens, after a rewrite) both files. Handles that were
+        open before are only dropped, a reader may still be using them
+        """
+        self.data_file = open(os.path.join(self.path, "blocks.dat"), "a+b")
+        self.index_file = open(os.path.join(self.path, "blocks.idx"), "a+b")
+
+        self._load_index()
+
+    def _finish_rewrite(self):
+        """
+        Completes a rewrite a crash interrupted, or throws it away if it
+        never got as far as the marker
+        """
+        marker = os.path.join(self.path, REWRITE_MARKER)
+        done = os.path.exists(marker)
+
+        for name in ("blocks.dat", "blocks.idx"):
+            new = os.path.join(self.path, name + ".new")
+            if os.path.exists(new):
+                if done:
+                    os.replace(new, os.path.join(self.path, name))
+                else:
+                    os.remove(new)
+
+        if done:
+            os.remove(marker)
+
+    def _load_index(self):
+        """
+        Reads blocks.idx into memory and throws away anything a crash
+        left half written at the end of either file
+        """
+        self.index_file.seek(0)
+        raw = self.index_file.read()
+
+        # Drop a trailing partial index record
+        usable = len(raw) - len(raw) % INDEX_RECORD.size
+        data_size = os.fstat(self.data_file.fileno()).st_size
+
+        offsets, lengths, hashes, proofs = [], [], [], []
+        for offset, length, raw_hash, proof in INDEX_RECORD.iter_unpack(raw[:usable]):
+            # Index record written but its block data never made it
+            if offset + length > data_size:
+                break
+
+            offsets.append(offset)
+            lengths.append(length)
+            hashes.append(raw_hash.hex())
+            proofs.append(proof)
+
+        self.view = (offsets, lengths, DataMap(self.data_file))
+        self.hashes[:] = hashes
+        self.proofs[:] = proofs
+
+        # Replaced blocks point past the ones after them
+        self.data_size = max(map(sum, zip(offsets, lengths)), default=0)
+
+        # Nothing is mapped yet, so the data file can shrink too
+        self.data_file.truncate(self.data_size)
+        self.index_file.truncate(len(offsets) * INDEX_RECORD.size)
+
+    def __len__(self):
+        return len(self.view[0])
+
+    def __getitem__(self, i):
+        """
+        Canonical block string at position `i`, read through the memory map
+        """
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        offsets, lengths, data = self.view
+
+        if i < 0:
+            i += len(offsets)
+        if not 0 <= i < len(offsets):
+            raise IndexError("block index out of range")
+
+        start = offsets[i]
+
+        return data.read(start, start + lengths[i]).decode()
+
+    def append(self, block_string, block_hash, proof):
+        """
+        Appends one block to the end of the store
+        :param block_string: <str> Canonical block string
+        :param block_hash: <str> Hex hash of the block string
+        :param proof: <int> The block's proof
+        """
+        data = block_string.encode()
+        offset = self.data_size
+        offsets, lengths, _ = self.view
+
+        # Data goes first, so an index record never points at missing bytes
+        self.data_file.write(data)
+        self.index_file.write(
+            INDEX_RECORD.pack(offset, len(data), bytes.fromhex(block_hash), proof)
+        )
+
+        # The offset goes last, it is what makes the block visible to readers
+        lengths.append(len(data))
+        self.hashes.append(block_hash)
+        self.proofs.append(proof)
+        offsets.append(offset)
+        self.data_size += len(data)
+
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def truncate(self, length):
+        """
+        Drops every block from position `length` onwards
+        :param length: <int> Number of blocks to keep
+        """
+        offsets, lengths, _ = self.view
+
+        del offsets[length:]
+        del lengths[length:]
+        del self.hashes[length:]
+        del self.proofs[length:]
+
+        # blocks.dat keeps the dropped bytes, a reader may still have them
+        # mapped. Restarting or rewriting drops them
+        self.index_file.flush()
+        self.index_file.truncate(length * INDEX_RECORD.size)
+        self.sync()
+
+    def replace(self, start, block_strings):
+        """
+        Replaces the data of the blocks from position `start` on, keeping
+        their hashes and proofs. Costs O(blocks replaced): the new strings
+        are appended to blocks.dat and only their index records are
+        rewritten. Once unused bytes are most of blocks.dat, both files
+        are rewritten without them
+        :param start: <int> Position of the first block to replace
+        :param block_strings: Iterable of new block strings, one per block
+        """
+        offsets, lengths, data = self.view
+        offsets, lengths = list(offsets), list(lengths)
+
+        records = []
+        for i, block_string in enumerate(block_strings, start):
+            encoded = block_string.encode()
+            self.data_file.write(encoded)
+
+            offsets[i] = self.data_size
+            lengths[i] = len(encoded)
+            block_hash = bytes.fromhex(self.hashes[i])
+            records.append(
+                INDEX_RECORD.pack(offsets[i], lengths[i], block_hash, self.proofs[i])
+            )
+            self.data_size += len(encoded)
+
+        # The new data has to be on disk before any record points at it. A
+        # crash part way through the records leaves some blocks with their
+        # old data, which is still there
+        self.sync()
+
+        # The index is open for appending, records in the middle need a
+        # handle of their own
+        with open(os.path.join(self.path, "blocks.idx"), "r+b") as index_file:
+            index_file.seek(start * INDEX_RECORD.size)
+            index_file.write(b"".join(records))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+
+        self.view = (offsets, lengths, data)
+
+        # Each rewrite copies at most as many bytes as have been thrown
+        # away since the last one
+        if 2 * sum(lengths) < self.data_size:
+            self.rewrite(self)
+
+    def rewrite(self, block_strings):
+        """
+        Replaces every block's data, keeping its hash and proof. The new
+        files are written next to the old ones and moved into place once
+        they are complete, a crash part way leaves one or the other
+        :param block_strings: Iterable of one new block string per block
+        """
+        data_path = os.path.join(self.path, "blocks.dat.new")
+        index_path = os.path.join(self.path, "blocks.idx.new")
+
+        offset = 0
+        with open(data_path, "wb") as data_file, open(index_path, "wb") as index_file:
+            for i, block_string in enumerate(block_strings):
+                data = block_string.encode()
+                data_file.write(data)
+                index_file.write(
+                    INDEX_RECORD.pack(
+                        offset, len(data), bytes.fromhex(self.hashes[i]), self.proofs[i]
+                    )
+                )
+                offset += len(data)
+
+            for f in (data_file, index_file):
+                f.flush()
+                os.fsync(f.fileno())
+
+        # From here on the rewrite is committed, `_finish_rewrite` completes
+        # it after a crash
+        with open(os.path.join(self.path, REWRITE_MARKER), "w") as marker:
+            os.fsync(marker.fileno())
+
+        # Flushed, not closed, a reader may be remapping through the old
+        # data file right now
+        self.data_file.flush()
+        self.index_file.flush()
+
+        self._finish_rewrite()
+        self._open_files()
+
+    def sync(self):
+        """
+        Flushes and fsyncs both files
+        """
+        self.data_file.flush()
+        self.index_file.flush()
+        os.fsync(self.data_file.fileno())
+        os.fsync(self.index_file.fileno())
+
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.view[2].close()
+        self.data_file.close()
+        self.index_file.close()
+
+
+class StoredChain(Sequence):
+    """
+    List-like view of the blocks in a `BlockStore`.
+
+    Blocks are decoded from the store on access with `decode`. The most
+    recently used ones are kept decoded, so the tail of the chain that
+    every request looks at stays in memory as the same objects.
+    """
+
+    def __init__(self, store, decode=json.loads, cache_size=1024):
+        self.store = store
+        self.decode = decode
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+        # Request threads all share the cache
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("block index out of range")
+
+        with self.lock:
+            block = self.cache.get(i)
+            if block is not None:
+                self.cache.move_to_end(i)
+                return block
+
+        # Decode outside the lock, it's the slow part
+        block = self.decode(self.store[i])
+        self.remember(i, block)
+
+        return block
+
+    def remember(self, i, block):
+        """
+        Keeps the decoded block at position `i` in the cache
+        """
+        with self.lock:
+            self.cache[i] = block
+            self.cache.move_to_end(i)
+
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def forget(self, length):
+        """
+        Drops cached blocks from position `length` onwards
+        """
+        with self.lock:
+            for i in [i for i in self.cache if i >= length]:
+                del self.cache[i]
@@ -0,0 +1,181 @@
+import hashlib
+
+import pytest
+
+from block import Block, Transaction
+from blockchain import Blockchain
+from difficulty import Retarget
+from hashing import ProofHasher
+from ledger import BLOCK_REWARD, MINT_ADDRESS, Ledger
+from signatures import generate_keypair, sign_transaction
+from storage import BlockStore
+from tree import INVALID, REORGANIZED, SIDE_BRANCH
+
+# Low enough that every proof takes a handful of hashes
+DIFFICULTY = 1
+
+
+def new_chain(store=None):
+    retarget = Retarget(min_difficulty=DIFFICULTY, max_difficulty=DIFFICULTY)
+
+    return Blockchain(difficulty=DIFFICULTY, store=store, retarget=retarget)
+
+
+def mine(blockchain, count, reward_to):
+    return [
+        blockchain.new_block(blockchain.proof_of_work(), None, reward_to)
+        for _ in range(count)
+    ]
+
+
+def forge(parent, transactions):
+    """
+    Mines a block on top of `parent` without a Blockchain, so it can hold
+    anything that is valid on its own
+    """
+    header = parent.header_bytes()
+    hasher = ProofHasher(header)
+
+    proof = 0
+    while not hasher.valid(proof, DIFFICULTY):
+        proof += 1
+
+    return Block(
+        parent.index + 1,
+        hasher.digest(proof).hex(),
+        proof,
+        parent.timestamp + 1,
+        transactions,
+        hashlib.sha256(header).hexdigest(),
+        difficulty=DIFFICULTY,
+    )
+
+
+def forge_branch(parent, count, last_transactions=()):
+    blocks = []
+    for i in range(count):
+        transactions = [Transaction(MINT_ADDRESS, "side", BLOCK_REWARD)]
+        if i == count - 1:
+            transactions.extend(last_transactions)
+
+        parent = forge(parent, transactions)
+        blocks.append(parent)
+
+    return blocks
+
+
+def replayed_balances(blockchain):
+    ledger = Ledger()
+    for block in blockchain.chain:
+        ledger.apply_block(block)
+
+    return {address: amount for address, amount in ledger.balances.items() if amount}
+
+
+@pytest.mark.parametrize("stored", [False, True])
+def test_add_block_reorganizes_onto_more_work(tmp_path, stored):
+    ours = new_chain(BlockStore(str(tmp_path)) if stored else None)
+    mine(ours, 3, "miner")
+    fork = ours.last_block
+
+    theirs = new_chain()
+    theirs.replace_chain(list(ours.chain))
+
+    mine(ours, 2, "ours")
+    branch = mine(theirs, 3, "theirs")
+
+    assert ours.add_block(branch[0]) == SIDE_BRANCH
+    assert ours.add_block(branch[1]) == SIDE_BRANCH
+    assert ours.add_block(branch[2]) == REORGANIZED
+
+    assert list(ours.block_hashes) == list(theirs.block_hashes)
+    assert ours.last_block.index == fork.index + 3
+    assert ours.work == theirs.work
+    assert ours.ledger.balance("ours") == 0
+    assert ours.ledger.balance("theirs") == 3 * BLOCK_REWARD
+    assert replayed_balances(ours) == replayed_balances(theirs)
+    assert ours.validate_chain()
+
+
+def test_add_block_rolls_back_a_branch_that_does_not_fit():
+    blockchain = new_chain()
+    mine(blockchain, 3, "miner")
+    fork = blockchain.last_block
+    mine(blockchain, 2, "miner")
+
+    hashes = list(blockchain.block_hashes)
+    balances = replayed_balances(blockchain)
+
+    # Signed, so each block is valid on its own, but the sender has nothing
+    key, address = generate_keypair()
+    overspend = Transaction(address, "thief", 1000)
+    sign_transaction(overspend, key)
+
+    branch = forge_branch(fork, 3, [overspend])
+    for block in branch[:-1]:
+        assert blockchain.add_block(block) == SIDE_BRANCH
+
+    assert blockchain.add_block(branch[-1]) == INVALID
+
+    assert list(blockchain.block_hashes) == hashes
+    assert replayed_balances(blockchain) == balances
+    assert {a: b for a, b in blockchain.ledger.balances.items() if b} == balances
+    assert blockchain.validate_chain()
+
+
+def pay(blockchain, key, address, recipient, amount):
+    tx = Transaction(address, recipient, amount, nonce=blockchain.next_nonce(address))
+    sign_transaction(tx, key)
+
+    return tx
+
+
+def test_paying_the_same_amount_twice_is_two_transactions():
+    blockchain = new_chain()
+    key, address = generate_keypair()
+    mine(blockchain, 2, address)
+
+    first = pay(blockchain, key, address, "bob", 1)
+    assert blockchain.new_transactions([first]) == [4]
+    second = pay(blockchain, key, address, "bob", 1)
+    assert blockchain.new_transactions([second]) == [4]
+    mine(blockchain, 1, "miner")
+
+    assert first.txid() != second.txid()
+    assert blockchain.ledger.balance("bob") == 2
+    assert blockchain.ledger.nonce(address) == 2
+
+
+def test_confirmed_nonce_cannot_be_replayed():
+    blockchain = new_chain()
+    key, address = generate_keypair()
+    mine(blockchain, 2, address)
+
+    tx = pay(blockchain, key, address, "bob", 1)
+    blockchain.new_transactions([tx])
+    mine(blockchain, 1, "miner")
+
+    assert blockchain.new_transactions([tx]) == [None]
+    assert blockchain.ledger.admissible([tx]) == []
+
+
+def test_later_nonce_waits_for_the_earlier_one():
+    blockchain = new_chain()
+    key, address = generate_keypair()
+    mine(blockchain, 2, address)
+
+    first = Transaction(address, "bob", 1, nonce=0)
+    later = Transaction(address, "carol", 1, fee=1, nonce=1)
+    for tx in (first, later):
+        sign_transaction(tx, key)
+
+    assert blockchain.new_transactions([later]) == [4]
+    mine(blockchain, 1, "miner")
+    assert blockchain.ledger.balance("carol") == 0
+    assert later.txid() in blockchain.mempool
+
+    assert blockchain.new_transactions([first]) == [5]
+    mine(blockchain, 1, "miner")
+    assert blockchain.ledger.balance("bob") == 1
+    assert blockchain.ledger.balance("carol") == 1
+    assert len(blockchain.mempool) == 0
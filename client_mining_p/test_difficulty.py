@@ -0,0 +1,76 @@
+import pytest
+
+from difficulty import MAX_FUTURE_DRIFT, Retarget, median_time, valid_timestamp
+
+
+def retarget_after(interval, difficulty=20, blocks=11, **settings):
+    """
+    A Retarget fed `blocks` blocks mined `interval` seconds apart
+    """
+    retarget = Retarget(target_time=60, window=10, **settings)
+    for i in range(blocks):
+        retarget.add_block(1000 + i * interval, difficulty)
+
+    return retarget
+
+
+def test_next_difficulty_waits_for_a_full_window():
+    assert retarget_after(1, blocks=10).next_difficulty() == 20
+
+
+def test_next_difficulty_holds_within_the_margin():
+    assert retarget_after(60).next_difficulty() == 20
+    assert retarget_after(75).next_difficulty() == 20
+    assert retarget_after(45).next_difficulty() == 20
+
+
+@pytest.mark.parametrize(
+    "interval, expected",
+    [
+        # Twice too fast is one bit, four times two
+        (30, 21),
+        (15, 22),
+        # Never more than max_step bits at once
+        (1, 22),
+        (0, 22),
+        (120, 19),
+        (6000, 18),
+        # Outside the margin always moves at least one bit
+        (36, 21),
+        (90, 19),
+    ],
+)
+def test_next_difficulty_steps_by_whole_bits(interval, expected):
+    assert retarget_after(interval).next_difficulty() == expected
+
+
+def test_next_difficulty_stays_within_its_bounds():
+    assert retarget_after(1, max_difficulty=21).next_difficulty() == 21
+    assert retarget_after(6000, min_difficulty=19).next_difficulty() == 19
+
+
+def test_a_new_difficulty_empties_the_window():
+    retarget = retarget_after(1)
+    retarget.add_block(2000, 22)
+
+    assert len(retarget.intervals) == 1
+    assert retarget.next_difficulty() == 22
+
+
+def test_median_time():
+    assert median_time([]) is None
+    assert median_time([3, 1, 2]) == 2
+    assert median_time([4, 1, 3, 2]) == 3
+
+
+def test_valid_timestamp_has_to_pass_the_median():
+    previous = [10, 20, 30]
+
+    assert not valid_timestamp(20, previous, now=100)
+    assert valid_timestamp(20.001, previous, now=100)
+    assert valid_timestamp(5, [], now=100)
+
+
+def test_valid_timestamp_may_only_be_a_little_ahead():
+    assert valid_timestamp(100 + MAX_FUTURE_DRIFT, [], now=100)
+    assert not valid_timestamp(100 + MAX_FUTURE_DRIFT + 1, [], now=100)
@@ -0,0 +1,120 @@
+from block import Transaction
+from mempool import Mempool
+
+
+def tx(fee, nonce=0, sender="alice", amount=1):
+    return Transaction(sender, "bob", amount, fee, nonce)
+
+
+def fees(transactions):
+    return [t.fee for t in transactions]
+
+
+def test_select_takes_the_highest_fees_oldest_first():
+    pool = Mempool()
+    for nonce, fee in enumerate([1, 5, 3, 5]):
+        pool.add(tx(fee, sender=f"s{nonce}"))
+
+    chosen = pool.select(max_count=3)
+
+    assert fees(chosen) == [5, 5, 3]
+    assert [t.sender for t in chosen[:2]] == ["s1", "s3"]
+    assert len(pool) == 1
+
+
+def test_select_keeps_each_senders_nonces_in_order():
+    pool = Mempool()
+    pool.add(tx(1, nonce=0))
+    pool.add(tx(9, nonce=1))
+    pool.add(tx(5, sender="carol"))
+
+    chosen = pool.select()
+
+    assert [(t.sender, t.nonce) for t in chosen] == [
+        ("alice", 0),
+        ("carol", 0),
+        ("alice", 1),
+    ]
+
+
+def test_select_skips_what_doesnt_fit_and_keeps_it():
+    pool = Mempool()
+    big = Transaction("alice", "b" * 500, 1, 10)
+    small = tx(1, sender="carol")
+    pool.add(big)
+    pool.add(small)
+
+    chosen = pool.select(max_bytes=len(small.to_string()))
+
+    assert chosen == [small]
+    assert big.txid() in pool
+
+
+def test_add_rejects_duplicates_and_taken_nonces():
+    pool = Mempool()
+
+    assert pool.add(tx(1))
+    assert not pool.add(tx(1))
+    assert not pool.add(tx(2, amount=2))
+    assert pool.add(tx(2, nonce=1))
+    assert pool.next_nonce("alice") == 2
+    assert pool.pending == {"alice": 5}
+
+
+def test_full_pool_evicts_the_lowest_fee():
+    pool = Mempool(max_count=2)
+    low, high = tx(1, sender="low"), tx(3, sender="high")
+    pool.add(low)
+    pool.add(high)
+
+    assert pool.add(tx(2, sender="mid"))
+
+    assert low.txid() not in pool
+    assert sorted(t.fee for t, _ in pool.transactions.values()) == [2, 3]
+    assert "low" not in pool.pending
+    assert pool.next_nonce("low") == 0
+
+
+def test_full_pool_turns_away_what_cant_displace_anything():
+    pool = Mempool(max_count=2)
+    pool.add(tx(2, sender="a"))
+    pool.add(tx(2, sender="b"))
+
+    # An equal fee loses to the older transaction
+    assert not pool.add(tx(2, sender="c"))
+    assert not pool.add(tx(1, sender="d"))
+    assert len(pool) == 2
+
+
+def test_eviction_is_all_or_nothing():
+    first, second = tx(1, sender="a"), tx(10, sender="b")
+    pool = Mempool(max_bytes=len(first.to_string()) + len(second.to_string()))
+    pool.add(first)
+    pool.add(second)
+
+    # Only fits by evicting both, but the second pays more than it does
+    wide = Transaction("c", "r" * len(first.to_string()), 1, 5)
+    assert not pool.add(wide)
+    assert len(pool) == 2
+
+    assert pool.add(tx(5, sender="d"))
+    assert sorted(t.fee for t, _ in pool.transactions.values()) == [5, 10]
+
+
+def test_oversized_transaction_never_goes_in():
+    pool = Mempool(max_bytes=100)
+
+    assert not pool.add(Transaction("a" * 200, "b", 1, 100))
+    assert len(pool) == 0
+
+
+def test_discard_drops_mined_transactions():
+    pool = Mempool()
+    mined, waiting = tx(1), tx(1, sender="carol")
+    pool.add(mined)
+    pool.add(waiting)
+
+    pool.discard([mined.txid(), "not-in-the-pool"])
+
+    assert list(pool.transactions) == [waiting.txid()]
+    assert "alice" not in pool.pending
@@ -0,0 +1,73 @@
+import pytest
+
+from metrics import Counter, Gauge, Histogram, Registry, timed
+
+
+def test_render_counters_and_gauges():
+    registry = Registry()
+    requests = Counter(
+        "requests_total", "Requests served", ["route"], registry=registry
+    )
+    Gauge("queue_length", "Jobs waiting", lambda: 3, registry=registry)
+
+    requests.inc(labels=("/chain",))
+    requests.inc(2, labels=("/chain",))
+    requests.inc(labels=('say "hi"\n',))
+
+    assert registry.render() == (
+        "# HELP requests_total Requests served\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{route="/chain"} 3\n'
+        'requests_total{route="say \\"hi\\"\\n"} 1\n'
+        "# HELP queue_length Jobs waiting\n"
+        "# TYPE queue_length gauge\n"
+        "queue_length 3\n"
+    )
+
+
+def test_render_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = Histogram("latency_seconds", "Latency", (0.1, 1), registry=registry)
+
+    for value in (0.05, 0.1, 0.5, 2):
+        latency.observe(value)
+
+    assert registry.render().splitlines()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 2.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_histogram_labels_go_before_le():
+    registry = Registry()
+    latency = Histogram(
+        "latency_seconds", "Latency", (1,), ["route"], registry=registry
+    )
+
+    latency.observe(0.5, labels=("/work",))
+
+    assert 'latency_seconds_bucket{route="/work",le="1"} 1' in registry.render()
+
+
+def test_timed_only_records_once_scraped():
+    registry = Registry()
+    latency = Histogram("call_seconds", "Calls", (1,), registry=registry)
+    call = timed(latency)(lambda: "done")
+
+    assert call() == "done"
+    assert latency.values == {}
+
+    registry.render()
+    call()
+    assert latency.values[()][0] == [1, 0]
+
+
+def test_duplicate_names_are_rejected():
+    registry = Registry()
+    Gauge("up", "Up", lambda: 1, registry=registry)
+
+    with pytest.raises(ValueError):
+        Gauge("up", "Up again", lambda: 1, registry=registry)
@@ -0,0 +1,104 @@
+import hashlib
+from collections import namedtuple
+
+from hashing import ProofHasher, has_leading_zero_bits
+from pool import BLOCK, DUPLICATE, INVALID, SHARE, STALE, Pool
+
+# The parts of the node's tip snapshot a pool looks at
+Tip = namedtuple("Tip", ["hash", "header_bytes", "difficulty"])
+
+HEADER = b"header"
+TIP = Tip(hashlib.sha256(HEADER).hexdigest(), HEADER, 12)
+
+
+def new_pool():
+    # Shares need 4 zero bits, blocks 12
+    return Pool(share_gap=8, min_share_difficulty=1, range_bits=16)
+
+
+def find(start, end, zero_bits, block=False):
+    hasher = ProofHasher(HEADER)
+    for proof in range(start, end):
+        digest = hasher.digest(proof)
+        if has_leading_zero_bits(digest, zero_bits) and block == (
+            has_leading_zero_bits(digest, TIP.difficulty)
+        ):
+            return proof
+
+    raise LookupError("No such proof in the range")
+
+
+def test_assign_hands_each_miner_its_own_range():
+    pool = new_pool()
+
+    alice = pool.assign("alice")
+    bob = pool.assign("bob")
+
+    assert alice == (0, 1 << 16)
+    assert bob == (1 << 16, 2 << 16)
+    assert pool.assign("alice") == alice
+
+
+def test_submit_credits_shares_and_spots_blocks():
+    pool = new_pool()
+    start, end = pool.assign("alice")
+
+    share = find(start, end, 4)
+    block = find(start, end, 12, block=True)
+
+    assert pool.submit("alice", share, TIP.hash, TIP) == SHARE
+    assert pool.submit("alice", block, TIP.hash, TIP) == BLOCK
+    assert pool.round_shares() == {"alice": 2}
+
+
+def test_submit_rejects_proofs_outside_the_miners_range():
+    pool = new_pool()
+    pool.assign("alice")
+    start, end = pool.assign("bob")
+
+    share = find(start, end, 4)
+
+    assert pool.submit("alice", share, TIP.hash, TIP) == INVALID
+    assert pool.submit("carol", share, TIP.hash, TIP) == INVALID
+    assert pool.submit("bob", -1, TIP.hash, TIP) == INVALID
+    assert pool.submit("bob", 2**64, TIP.hash, TIP) == INVALID
+    assert pool.round_shares() == {}
+
+
+def test_submit_rejects_duplicate_and_weak_shares():
+    pool = new_pool()
+    start, end = pool.assign("alice")
+
+    share = find(start, end, 4)
+    weak = next(
+        proof
+        for proof in range(start, end)
+        if not has_leading_zero_bits(ProofHasher(HEADER).digest(proof), 4)
+    )
+
+    assert pool.submit("alice", share, TIP.hash, TIP) == SHARE
+    assert pool.submit("alice", share, TIP.hash, TIP) == DUPLICATE
+    assert pool.submit("alice", weak, TIP.hash, TIP) == INVALID
+    assert pool.round_shares() == {"alice": 1}
+
+
+def test_submit_rejects_work_on_an_old_tip():
+    pool = new_pool()
+    start, end = pool.assign("alice")
+    share = find(start, end, 4)
+
+    assert pool.submit("alice", share, "00" * 32, TIP) == STALE
+
+    # A share for a new tip starts a fresh set of seen proofs
+    assert pool.submit("alice", share, TIP.hash, TIP) == SHARE
+    new_tip = TIP._replace(hash="11" * 32)
+    assert pool.submit("alice", share, TIP.hash, new_tip) == STALE
+
+
+def test_take_round_starts_a_new_round():
+    pool = new_pool()
+    start, end = pool.assign("alice")
+    pool.submit("alice", find(start, end, 4), TIP.hash, TIP)
+
+    assert pool.take_round() == {"alice": 1}
+    assert pool.round_shares() == {}
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from snapshot import Snapshot, from_json, to_json
+
+SNAPSHOT = Snapshot(
+    1000, "ab" * 32, "cd" * 32, {"alice": 5, "bob": 0.5}, {"alice": 3}, 12345
+)
+
+
+def test_json_round_trip():
+    assert from_json(json.loads(json.dumps(to_json(SNAPSHOT)))) == SNAPSHOT
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [
+        ("height", "1000"),
+        ("height", True),
+        ("hash", None),
+        ("balances", {"alice": 5}),
+        ("balances", [["alice", "oops"]]),
+        ("balances", [["alice", 0]]),
+        ("balances", [[1, 5]]),
+        ("balances", [["alice"]]),
+        ("nonces", [["alice", 1.5]]),
+        ("nonces", [["alice", 0]]),
+        ("work", -1),
+    ],
+)
+def test_from_json_rejects_bad_fields(field, value):
+    data = json.loads(json.dumps(to_json(SNAPSHOT)))
+    data[field] = value
+
+    with pytest.raises(ValueError):
+        from_json(data)
+
+
+def test_from_json_rejects_missing_fields():
+    data = to_json(SNAPSHOT)
+    del data["nonces"]
+
+    with pytest.raises(ValueError):
+        from_json(data)
+
+    with pytest.raises(ValueError):
+        from_json([])
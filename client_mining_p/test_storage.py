@@ -0,0 +1,84 @@
+import hashlib
+import os
+
+from storage import INDEX_RECORD, BlockStore
+
+
+def test_store_drops_torn_tail(tmp_path):
+    store = BlockStore(str(tmp_path))
+    for i in range(3):
+        block_string = f"block {i}"
+        store.append(block_string, hashlib.sha256(block_string.encode()).hexdigest(), i)
+    store.close()
+
+    # A crash part way through appending a fourth block: its data made it
+    # but only half of its index record, then an index record whose data
+    # never did
+    with open(os.path.join(str(tmp_path), "blocks.dat"), "ab") as f:
+        f.write(b"block 3")
+    with open(os.path.join(str(tmp_path), "blocks.idx"), "ab") as f:
+        f.write(INDEX_RECORD.pack(1000, 10, bytes(32), 0))
+        f.write(b"\0" * 5)
+
+    store = BlockStore(str(tmp_path))
+
+    assert list(store) == ["block 0", "block 1", "block 2"]
+    assert os.path.getsize(os.path.join(str(tmp_path), "blocks.idx")) == (
+        3 * INDEX_RECORD.size
+    )
+
+    store.append("block 3", "00" * 32, 3)
+    assert store[3] == "block 3"
+    store.close()
+
+
+def fill(path, count, size=100):
+    store = BlockStore(str(path))
+    for i in range(count):
+        block_string = f"{i:<{size}}"
+        store.append(block_string, hashlib.sha256(block_string.encode()).hexdigest(), i)
+
+    return store
+
+
+def test_replace_only_moves_the_replaced_blocks(tmp_path):
+    store = fill(tmp_path, 10)
+    before = list(store)
+    hashes = list(store.hashes)
+
+    store.replace(2, ["two", "three"])
+
+    assert list(store) == before[:2] + ["two", "three"] + before[4:]
+    assert store.hashes == hashes
+    assert store.view[0][4:] == [i * 100 for i in range(4, 10)]
+    store.close()
+
+    store = BlockStore(str(tmp_path))
+    assert list(store) == before[:2] + ["two", "three"] + before[4:]
+    assert store.proofs == list(range(10))
+    store.close()
+
+
+def test_replace_rewrites_once_most_bytes_are_unused(tmp_path):
+    store = fill(tmp_path, 10)
+    data_path = os.path.join(str(tmp_path), "blocks.dat")
+
+    store.replace(0, ["a", "b", "c", "d"])
+    assert os.path.getsize(data_path) == 1000 + 4
+
+    store.replace(4, ["e", "f"])
+    assert os.path.getsize(data_path) == 6 + 4 * 100
+    assert list(store)[:6] == ["a", "b", "c", "d", "e", "f"]
+    store.close()
+
+
+def test_view_taken_before_replace_stays_consistent(tmp_path):
+    store = fill(tmp_path, 10)
+    offsets, lengths, data = store.view
+
+    store.replace(0, [str(i) for i in range(8)])
+
+    # A reader part way through a lookup still gets the old data
+    assert data.read(offsets[3], offsets[3] + lengths[3]).decode() == f"{3:<100}"
+    assert store[3] == "3"
+    store.close()
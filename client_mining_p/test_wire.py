@@ -0,0 +1,56 @@
+import pytest
+
+from block import chain_bytes, read_chain
+from blockchain import Blockchain
+from difficulty import Retarget
+from wire import Reader, encode
+
+VALUES = [
+    None,
+    True,
+    False,
+    0,
+    1,
+    127,
+    128,
+    2**70,
+    -1,
+    -(2**70),
+    0.5,
+    1.0,
+    "",
+    "0",
+    "abcd",
+    "ABCD",
+    "abc",
+    "é",
+]
+
+
+def test_wire_round_trip():
+    decoded = Reader(encode(VALUES)).values(len(VALUES))
+
+    assert decoded == VALUES
+    assert [type(value) for value in decoded] == [type(value) for value in VALUES]
+
+
+def test_wire_encodings_are_unique():
+    encodings = [encode([value]) for value in VALUES]
+
+    assert len(set(encodings)) == len(VALUES)
+
+
+def test_wire_rejects_containers():
+    with pytest.raises(TypeError):
+        encode([["x"]])
+
+
+def test_chain_bytes_round_trip():
+    retarget = Retarget(min_difficulty=1, max_difficulty=1)
+    blockchain = Blockchain(difficulty=1, retarget=retarget)
+    for _ in range(3):
+        blockchain.new_block(blockchain.proof_of_work(), None, "miner")
+
+    blocks = read_chain(b"".join(chain_bytes(blockchain.chain)))
+
+    assert [block.to_string() for block in blocks] == list(blockchain.block_strings)
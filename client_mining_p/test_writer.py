@@ -0,0 +1,31 @@
+import pytest
+
+from writer import ChainWriter
+
+
+def test_read_runs_again_if_a_job_overlapped_it():
+    writer = ChainWriter()
+    state = {"a": 0, "b": 0}
+    reads = []
+
+    def bump():
+        state["a"] += 1
+        state["b"] += 1
+
+    def read():
+        reads.append(state["a"])
+        if len(reads) == 1:
+            # A job runs between reading `a` and reading `b`
+            writer.call(bump)
+
+        return reads[-1], state["b"]
+
+    assert writer.read(read) == (1, 1)
+    assert reads == [0, 1]
+
+
+def test_read_raises_what_a_consistent_read_raised():
+    writer = ChainWriter()
+
+    with pytest.raises(KeyError):
+        writer.read(lambda: {}["missing"])
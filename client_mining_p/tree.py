@@ -0,0 +1,116 @@
+import heapq
+
+from collections import namedtuple
+
+# Side branches are dropped once the active chain is this many blocks past them
+PRUNE_DEPTH = 100
+
+# What `Blockchain.add_block` did with a block
+EXTENDED = "extended"
+REORGANIZED = "reorganized"
+SIDE_BRANCH = "side_branch"
+DUPLICATE = "duplicate"
+ORPHAN = "orphan"
+INVALID = "invalid"
+
+# A block off the active chain, with the total work of its branch up to it
+SideBlock = namedtuple("SideBlock", ["block", "work"])
+
+
+def block_work(difficulty):
+    """
+    :param difficulty: <int> Leading zero bits
+    :return: <int> Expected number of hashes it takes to find a proof
+    """
+    return 1 << difficulty
+
+
+class BlockTree(object):
+    """
+    Blocks that are not on the active chain, keyed by hash.
+
+    The active chain itself stays flat. The tree holds the competing
+    branches hanging off it, each block with the cumulative work of its
+    branch, so a branch that overtakes the active chain can be switched to
+    without fetching anything. Branches that fall `prune_depth` blocks
+    behind the tip are pruned.
+
+    Side blocks are also indexed by height, with a min-heap of the
+    heights, so pruning only looks at the blocks it drops.
+    """
+
+    def __init__(self, prune_depth=PRUNE_DEPTH):
+        self.prune_depth = prune_depth
+        self.blocks = {}
+
+        # Block index -> hashes of the side blocks at it
+        self.heights = {}
+        self.lowest = []
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __contains__(self, block_hash):
+        return block_hash in self.blocks
+
+    def get(self, block_hash):
+        """
+        :return: <SideBlock> The side block with `block_hash`, or None
+        """
+        return self.blocks.get(block_hash)
+
+    def add(self, block_hash, block, work):
+        """
+        :param block_hash: <str> Hash of `block`
+        :param block: <Block> A block off the active chain
+        :param work: <int> Cumulative work of its branch, up to `block`
+        """
+        self.blocks[block_hash] = SideBlock(block, work)
+
+        if block.index not in self.heights:
+            self.heights[block.index] = set()
+            heapq.heappush(self.lowest, block.index)
+        self.heights[block.index].add(block_hash)
+
+    def discard(self, block_hash):
+        """
+        Forgets a block, e.g. because it just became part of the active chain
+        """
+        side = self.blocks.pop(block_hash, None)
+        if side is None:
+            return
+
+        # An emptied height stays in the heap until pruning reaches it
+        at_height = self.heights[side.block.index]
+        at_height.discard(block_hash)
+        if not at_height:
+            del self.heights[side.block.index]
+
+    def branch(self, block_hash):
+        """
+        Walks from a side block back to where its branch leaves the tree
+        :param block_hash: <str> Hash of the branch's last block
+        :return: (hash of the block the branch hangs off, list of
+        (hash, SideBlock) pairs, oldest first)
+        """
+        branch = []
+
+        while block_hash in self.blocks:
+            side = self.blocks[block_hash]
+            branch.append((block_hash, side))
+            block_hash = side.block.previous_hash
+
+        branch.reverse()
+
+        return block_hash, branch
+
+    def prune(self, height):
+        """
+        Drops side blocks `prune_depth` or more blocks below `height`
+        :param height: <int> Index of the active tip
+        """
+        floor = height - self.prune_depth
+
+        while self.lowest and self.lowest[0] <= floor:
+            for block_hash in self.heights.pop(heapq.heappop(self.lowest), ()):
+                del self.blocks[block_hash]
@@ -0,0 +1,287 @@
+import hashlib
+import json
+
+from collections import deque
+from contextlib import nullcontext
+from multiprocessing import Pool, cpu_count
+
+from block import Transaction, header_bytes
+from difficulty import MEDIAN_TIME_BLOCKS, Retarget, valid_timestamp
+from hashing import ProofHasher, has_leading_zero_bits, valid_nonce
+from ledger import BLOCK_REWARD, valid_rewards
+from merkle import merkle_root
+from signatures import block_signed
+
+# Below this many blocks a process pool costs more than it saves
+PARALLEL_THRESHOLD = 512
+
+# Worker processes from `start_pool`, shared by every long chain
+_pool = None
+_pool_workers = None
+
+
+def start_pool(workers=None):
+    """
+    Starts the worker processes `validate_chain` spreads long chains over,
+    for the life of the process. Call it from the entry point, before
+    serving anything: the workers are forked, and a fork only copies the
+    calling thread, so a lock a busy thread held would stay held in
+    every worker
+    :param workers: <int> Number of worker processes (defaults to cpu count)
+    """
+    global _pool, _pool_workers
+
+    if _pool is None:
+        _pool_workers = workers or cpu_count()
+        _pool = Pool(_pool_workers)
+
+
+def validate_chain(
+    block_strings,
+    block_hashes=None,
+    start=0,
+    min_difficulty=0,
+    workers=None,
+    retarget=None,
+    pruned_height=0,
+    reward=BLOCK_REWARD,
+):
+    """
+    Checks a chain of canonical block strings, genesis block first.
+
+    Every block from position `start` on is checked on its own first:
+    its Merkle root, its header hash (against `block_hashes` when given),
+    its index, its proof against the difficulty it records, the coins it
+    mints and the signatures of its transactions.
+    Those checks don't depend on each other, so long chains are spread
+    over a process pool. A single sequential pass then checks that each
+    block's `previous_hash` matches the hash of the block before it, that
+    each recorded difficulty is the one the retarget rules give, and that
+    each timestamp passes `valid_timestamp`.
+
+    :param block_strings: <Sequence> Canonical block strings
+    :param block_hashes: (Optional) <Sequence> Hashes stored for the blocks
+    :param start: <int> Position of the first block to check, everything
+    before it is trusted
+    :param min_difficulty: <int> Leading zero bits every proof needs
+    :param workers: <int> Number of worker processes. Defaults to the
+    pool from `start_pool` if there is one, else a pool of cpu count
+    workers just for this call
+    :param retarget: (Optional) <Retarget> Retarget rules, with no blocks
+    fed in yet
+    :param pruned_height: <int> Blocks up to this index may be pruned down
+    to their headers, only their headers and proofs are checked then
+    :param reward: Most coins a block may mint, on top of its fees
+    :return: True if the chain is valid, False otherwise
+    """
+    if retarget is None:
+        retarget = Retarget(min_difficulty=min_difficulty)
+
+    # The difficulty and earliest timestamp of a block depend on the
+    # window before it
+    timestamps = deque(maxlen=MEDIAN_TIME_BLOCKS)
+    window = max(retarget.window + 1, MEDIAN_TIME_BLOCKS)
+    for position in range(max(start - window, 0), start):
+        block = json.loads(block_strings[position])
+        if position >= start - retarget.window - 1:
+            retarget.add_block(block["timestamp"], block["difficulty"])
+        timestamps.append(block["timestamp"])
+
+    count = len(block_strings) - start
+    tasks = (
+        (
+            position,
+            block_strings[position - 1] if position > 0 else None,
+            block_strings[position],
+            block_hashes[position] if block_hashes is not None else None,
+            min_difficulty,
+            None,
+            pruned_height,
+            reward,
+        )
+        for position in range(start, len(block_strings))
+    )
+
+    if start > 0:
+        if block_hashes is not None:
+            prev_hash = block_hashes[start - 1]
+        else:
+            prev_header = header_bytes(json.loads(block_strings[start - 1]))
+            prev_hash = hashlib.sha256(prev_header).hexdigest()
+    else:
+        prev_hash = None
+
+    if count < PARALLEL_THRESHOLD:
+        return _check_links(
+            map(_verify_block, tasks), start, prev_hash, retarget, timestamps
+        )
+
+    if workers is None and _pool is not None:
+        # The shared pool outlives this call
+        workers = _pool_workers
+        pool = nullcontext(_pool)
+    else:
+        workers = workers or cpu_count()
+        pool = Pool(workers)
+
+    with pool as pool:
+        # imap keeps results in order, so the link pass runs as they come in
+        chunksize = max(1, count // (workers * 16))
+        results = pool.imap(_verify_block, tasks, chunksize)
+
+        return _check_links(results, start, prev_hash, retarget, timestamps)
+
+
+def verify_block(
+    prev_string, block_string, min_difficulty=0, verifier=None, reward=BLOCK_REWARD
+):
+    """
+    Checks one block against the block it builds on, e.g. a block a peer
+    just announced
+    :param prev_string: <str> Canonical string of the parent block
+    :param block_string: <str> Canonical string of the block
+    :param min_difficulty: <int> Leading zero bits its proof needs at least
+    :param verifier: (Optional) <SignatureVerifier> Checks the signatures,
+    so ones already seen in the mempool aren't checked again
+    :param reward: Most coins the block may mint, on top of its fees
+    :return: (previous_hash, block hash, timestamp, difficulty) if the
+    block is valid on its own, else None. Its difficulty is not checked
+    against the retarget rules
+    """
+    try:
+        position = json.loads(prev_string)["index"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+    return _verify_block(
+        (
+            position,
+            prev_string,
+            block_string,
+            None,
+            min_difficulty,
+            verifier,
+            0,
+            reward,
+        )
+    )
+
+
+def _check_links(results, start, prev_hash, retarget, timestamps):
+    """
+    Sequential pass: each previous_hash must be the hash of the block before,
+    each difficulty the one the retarget window before it gives, and each
+    timestamp later than the median of the blocks before it
+    :param results: Iterable of `_verify_block` results, in chain order
+    :param start: <int> Position of the first result
+    :param prev_hash: <str> Hash of the block before `start`
+    :param retarget: <Retarget> Retarget rules, fed every block before `start`
+    :param timestamps: <deque> Timestamps of the blocks before `start`, at
+    most `MEDIAN_TIME_BLOCKS` of them
+    :return: True if every block was valid and linked, False otherwise
+    """
+    for position, result in enumerate(results, start):
+        if result is None:
+            return False
+
+        previous_hash, block_hash, timestamp, difficulty = result
+
+        if position > 0 and previous_hash != prev_hash:
+            return False
+
+        # The genesis block sets the starting difficulty
+        if position > 0 and difficulty != retarget.next_difficulty():
+            return False
+
+        if not valid_timestamp(timestamp, timestamps):
+            return False
+
+        retarget.add_block(timestamp, difficulty)
+        timestamps.append(timestamp)
+        prev_hash = block_hash
+
+    return True
+
+
+def _verify_block(task):
+    """
+    Checks one block on its own, in a worker process
+    :return: (previous_hash, block hash, timestamp, difficulty) if the
+    block is valid, else None
+    """
+    (
+        position,
+        prev_string,
+        block_string,
+        stored_hash,
+        min_difficulty,
+        verifier,
+        pruned_height,
+        reward,
+    ) = task
+
+    try:
+        block = json.loads(block_string)
+
+        block_hash = hashlib.sha256(header_bytes(block)).hexdigest()
+        if stored_hash is not None and block_hash != stored_hash:
+            return None
+
+        if block["index"] != position + 1:
+            return None
+
+        if not isinstance(block["timestamp"], (int, float)):
+            return None
+
+        difficulty = block["difficulty"]
+        if not isinstance(difficulty, int) or difficulty < min_difficulty:
+            return None
+
+        state_root = block["state_root"]
+        if state_root is not None and not isinstance(state_root, str):
+            return None
+
+        # Blocks before a balance snapshot may have had their transactions
+        # pruned, the snapshot stands in for them
+        transactions = block["transactions"]
+        if transactions is None:
+            if block["index"] > pruned_height:
+                return None
+            transactions = []
+        elif not isinstance(transactions, list):
+            return None
+        else:
+            transactions = [Transaction.from_json(tx) for tx in transactions]
+            # The header has to commit to exactly these transactions
+            txids = [tx.txid() for tx in transactions]
+            if merkle_root(txids) != block["merkle_root"]:
+                return None
+
+            # A transaction can only be spent once, even within a block
+            if len(set(txids)) != len(txids):
+                return None
+
+        # The genesis block has no proof of work to check
+        if position > 0:
+            proof = block["proof"]
+            if not valid_nonce(proof):
+                return None
+
+            prev_header = header_bytes(json.loads(prev_string))
+            digest = ProofHasher(prev_header).digest(proof)
+            if digest.hex() != block["hash"]:
+                return None
+            if not has_leading_zero_bits(digest, difficulty):
+                return None
+
+            if not valid_rewards(transactions, reward):
+                return None
+
+            # Signatures last, they cost far more than the hashes
+            if not block_signed(transactions, verifier):
+                return None
+
+        return block["previous_hash"], block_hash, block["timestamp"], difficulty
+    except (ValueError, KeyError, TypeError):
+        # Not even a well formed block
+        return None
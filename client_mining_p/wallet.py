@@ -0,0 +1,61 @@
+"""
+Keys and signed transactions from the command line.
+
+    python wallet.py new [--keyfile wallet.json]
+    python wallet.py send RECIPIENT AMOUNT [--fee FEE] [--node URL]
+
+The address is the public key, so it can go in `my_id.txt` to mine to it.
+"""
+
+import argparse
+import json
+
+from block import Transaction
+from node_client import NodeClient, NodeUnavailable
+from signatures import generate_keypair, sign_transaction
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sign and send transactions")
+    parser.add_argument("--keyfile", default="wallet.json")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("new", help="Create a keypair")
+
+    send = commands.add_parser("send", help="Sign a transaction and send it")
+    send.add_argument("recipient")
+    send.add_argument("amount", type=float)
+    send.add_argument("--fee", type=float, default=0)
+    send.add_argument("--node", default="http://localhost:5000")
+
+    args = parser.parse_args()
+
+    if args.command == "new":
+        private_key, address = generate_keypair()
+        with open(args.keyfile, "x") as f:
+            json.dump({"private_key": private_key, "address": address}, f)
+
+        print(f"Address: {address}")
+    else:
+        with open(args.keyfile) as f:
+            keys = json.load(f)
+
+        # Whole amounts are sent as ints, so they hash the same as ever
+        amount = int(args.amount) if args.amount.is_integer() else args.amount
+        fee = int(args.fee) if args.fee.is_integer() else args.fee
+
+        client = NodeClient([args.node])
+
+        try:
+            # The node counts what we already have waiting in its mempool
+            _, account = client.get(f"/balance/{keys['address']}")
+
+            tx = Transaction(
+                keys["address"], args.recipient, amount, fee, account["nonce"]
+            )
+            sign_transaction(tx, keys["private_key"])
+
+            _, response = client.post("/transactions/new", json=tx.to_json())
+        except NodeUnavailable as e:
+            print(f"Couldn't send: {e}")
+        else:
+            print(response.get("message") or response.get("error"))
@@ -0,0 +1,201 @@
+"""
+Compact binary encoding for blocks, headers and transactions.
+
+A value is a one-byte tag followed by its payload. Lengths and integers
+are varints, so small numbers take a byte or two. Hex strings (hashes,
+addresses, signatures) are stored as the raw bytes they spell out, half
+the size of the text. Every value has exactly one encoding, so the bytes
+are fit for hashing.
+
+Records (headers, transactions) are their field values back to back in
+a fixed order, with no field names.
+"""
+
+import struct
+
+# Content type of the binary form on the HTTP API
+MIMETYPE = "application/octet-stream"
+
+NONE = 0
+FALSE = 1
+TRUE = 2
+INT = 3
+NEGATIVE_INT = 4
+FLOAT = 5
+STRING = 6
+HEX = 7
+
+DOUBLE = struct.Struct(">d")
+
+
+def write_varint(out, n):
+    """
+    Appends a non-negative int, 7 bits per byte, low bits first
+    :param out: <bytearray> Where to write
+    :param n: <int> The number
+    """
+    while n > 0x7F:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+
+    out.append(n)
+
+
+def write_value(out, value):
+    """
+    Appends one tagged value
+    :param out: <bytearray> Where to write
+    :param value: None, a bool, an int, a float or a str
+    :raises TypeError: for anything else
+    """
+    # Strings first, most fields are hashes and addresses
+    if isinstance(value, str):
+        raw = _hex_bytes(value)
+        if raw is not None:
+            out.append(HEX)
+        else:
+            out.append(STRING)
+            raw = value.encode()
+
+        write_varint(out, len(raw))
+        out += raw
+    elif value is None:
+        out.append(NONE)
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif isinstance(value, int):
+        out.append(INT if value >= 0 else NEGATIVE_INT)
+        write_varint(out, abs(value))
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out += DOUBLE.pack(value)
+    else:
+        raise TypeError(f"Can't encode {type(value).__name__}")
+
+
+def _hex_bytes(value):
+    """
+    :return: <bytes> What `value` spells out if it is lowercase hex (the
+    only kind that survives the round trip through bytes), else None.
+    The empty string counts as text
+    """
+    # Cheap checks first, so ordinary text rarely pays for an exception
+    if len(value) % 2 or not value.isalnum():
+        return None
+
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return None
+
+    return raw if raw.hex() == value else None
+
+
+def encode(values):
+    """
+    :param values: Iterable of values
+    :return: <bytes> The values, back to back
+    """
+    out = bytearray()
+    for value in values:
+        write_value(out, value)
+
+    return bytes(out)
+
+
+def frame(payload):
+    """
+    :param payload: <bytes> One encoded record
+    :return: <bytes> The record prefixed by its length, for streaming
+    """
+    out = bytearray()
+    write_varint(out, len(payload))
+
+    return bytes(out) + payload
+
+
+class Reader(object):
+    """
+    Reads values back out of encoded bytes, front to back. Anything
+    malformed or truncated raises ValueError
+    """
+
+    def __init__(self, data, position=0):
+        self.data = memoryview(data)
+        self.position = position
+
+    def at_end(self):
+        return self.position >= len(self.data)
+
+    def take(self, n):
+        """
+        :return: <bytes> The next `n` bytes
+        """
+        end = self.position + n
+        if end > len(self.data):
+            raise ValueError("Truncated data")
+
+        raw = bytes(self.data[self.position : end])
+        self.position = end
+
+        return raw
+
+    def varint(self):
+        n = 0
+        shift = 0
+
+        while True:
+            (byte,) = self.take(1)
+            n |= (byte & 0x7F) << shift
+            shift += 7
+
+            if not byte & 0x80:
+                break
+
+        # Only the shortest form is valid, or values would have two encodings
+        if shift > 7 and byte == 0:
+            raise ValueError("Overlong varint")
+
+        return n
+
+    def value(self):
+        (tag,) = self.take(1)
+
+        if tag == NONE:
+            return None
+        if tag == TRUE:
+            return True
+        if tag == FALSE:
+            return False
+        if tag == INT:
+            return self.varint()
+        if tag == NEGATIVE_INT:
+            n = self.varint()
+            if n == 0:
+                raise ValueError("Negative zero")
+            return -n
+        if tag == FLOAT:
+            return DOUBLE.unpack(self.take(8))[0]
+        if tag == HEX:
+            return self.take(self.varint()).hex()
+        if tag == STRING:
+            value = self.take(self.varint()).decode()
+
+            # Hex always goes as HEX, so the encoding stays unique
+            if encode([value])[0] != STRING:
+                raise ValueError("Hex string encoded as text")
+            return value
+
+        raise ValueError(f"Unknown tag {tag}")
+
+    def values(self, n):
+        return [self.value() for _ in range(n)]
+
+    def frames(self):
+        """
+        Yields each length-prefixed record until the data runs out
+        """
+        while not self.at_end():
+            yield self.take(self.varint())
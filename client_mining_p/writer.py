@@ -0,0 +1,92 @@
+import queue
+import threading
+
+from concurrent.futures import Future
+from time import sleep
+
+# Tries `read` makes before it queues up behind the writer instead
+READ_ATTEMPTS = 8
+
+
+class ChainWriter(object):
+    """
+    Runs every change to the chain and mempool on one dedicated thread.
+
+    Request handlers hand their mutation to `call` and wait for the result.
+    Because jobs run strictly one after another, two miners submitting a
+    proof for the same tip at the same time can never both forge a block:
+    the second job sees the tip the first one created.
+
+    Reads don't queue up behind mutations: `read` runs them on the calling
+    thread, without a lock, and only keeps the result if no job ran in the
+    meantime (a sequence lock: `version` is odd while a job runs).
+    """
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.version = 0
+        self.thread = threading.Thread(
+            target=self._run, name="chain-writer", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queues `fn(*args, **kwargs)` to run on the writer thread
+        :return: <Future> Resolves to whatever `fn` returns
+        """
+        future = Future()
+        self.jobs.put((future, fn, args, kwargs))
+
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Runs `fn(*args, **kwargs)` on the writer thread and waits for it
+        :return: Whatever `fn` returns, exceptions are re-raised here
+        """
+        return self.submit(fn, *args, **kwargs).result()
+
+    def read(self, fn, *args, **kwargs):
+        """
+        Runs `fn(*args, **kwargs)` on the calling thread, against state
+        only the writer changes. If a job ran meanwhile the result may mix
+        old and new state, so it is thrown away and `fn` runs again. Under
+        a steady stream of jobs it falls back to `call`
+        :return: Whatever `fn` returns, as of a moment between two jobs
+        """
+        for _ in range(READ_ATTEMPTS):
+            version = self.version
+            if version % 2 == 0:
+                try:
+                    result, error = fn(*args, **kwargs), None
+                except Exception as e:
+                    # May just be a list shrinking under us
+                    result, error = None, e
+
+                if self.version == version:
+                    if error is not None:
+                        raise error
+                    return result
+
+            # Let the writer finish its job
+            sleep(0)
+
+        return self.call(fn, *args, **kwargs)
+
+    def _run(self):
+        while True:
+            future, fn, args, kwargs = self.jobs.get()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            self.version += 1
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                self.version += 1
+                future.set_exception(e)
+            else:
+                self.version += 1
+                future.set_result(result)